@@ -0,0 +1,171 @@
+"""
+Copyright (c) 2022 Ruilong Li, UC Berkeley.
+
+Bake a turntable of a trained `train_mlp_nerf.py` model on CPU workers.
+
+Passing several `--num_workers` renders the turntable once per value and
+reports the scaling, e.g.:
+
+    python bake_turntable_cpu.py --model_path mlp_nerf_50000 \\
+        --num_workers 1 2 4 8 16 32 64
+"""
+
+import argparse
+import functools
+import math
+import os
+import pathlib
+import time
+
+import imageio
+import numpy as np
+import torch
+import torch.nn.functional as F
+from datasets.utils import Rays
+from radiance_fields.mlp import VanillaNeRFRadianceField
+from utils import render_frames_cpu, render_image_with_occgrid
+
+from nerfacc.estimators.occ_grid import OccGridEstimator
+
+
+def turntable_rays(
+    n_frames: int,
+    width: int,
+    height: int,
+    focal: float,
+    radius: float,
+    elevation: float,
+):
+    """Rays of cameras circling around the origin (OpenGL convention)."""
+    x, y = torch.meshgrid(
+        torch.arange(width), torch.arange(height), indexing="xy"
+    )
+    camera_dirs = F.pad(
+        torch.stack(
+            [(x - width / 2 + 0.5) / focal, -(y - height / 2 + 0.5) / focal],
+            dim=-1,
+        ),
+        (0, 1),
+        value=-1.0,
+    )
+    frames = []
+    for i in range(n_frames):
+        theta = 2 * math.pi * i / n_frames
+        phi = math.radians(elevation)
+        eye = radius * torch.tensor(
+            [
+                math.cos(phi) * math.cos(theta),
+                math.cos(phi) * math.sin(theta),
+                math.sin(phi),
+            ]
+        )
+        forward = F.normalize(-eye, dim=0)
+        right = F.normalize(
+            torch.cross(forward, torch.tensor([0.0, 0, 1])), dim=0
+        )
+        up = torch.cross(right, forward)
+        rotation = torch.stack([right, up, -forward], dim=-1)
+        directions = (camera_dirs[..., None, :] * rotation).sum(dim=-1)
+        viewdirs = F.normalize(directions, dim=-1)
+        origins = torch.broadcast_to(eye, viewdirs.shape)
+        frames.append(Rays(origins=origins, viewdirs=viewdirs))
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model_path",
+        type=str,
+        default=None,
+        help="checkpoint of train_mlp_nerf.py. If None, a randomly "
+        "initialized model with a fully occupied grid is used, which is "
+        "only useful to measure the scaling.",
+    )
+    parser.add_argument(
+        "--out_dir",
+        type=str,
+        default=str(pathlib.Path.cwd() / "turntable"),
+    )
+    parser.add_argument("--n_frames", type=int, default=120)
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--height", type=int, default=800)
+    parser.add_argument("--focal", type=float, default=1111.0)
+    parser.add_argument("--radius", type=float, default=4.0)
+    parser.add_argument("--elevation", type=float, default=30.0)
+    parser.add_argument("--tile_size", type=int, default=16384)
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        nargs="+",
+        default=[os.cpu_count()],
+        help="one bake per value, to measure the scaling",
+    )
+    parser.add_argument("--threads_per_worker", type=int, default=1)
+    parser.add_argument(
+        "--executor", type=str, default="process", choices=["process", "thread"]
+    )
+    args = parser.parse_args()
+
+    # scene and render parameters of train_mlp_nerf.py
+    aabb = torch.tensor([-1.5, -1.5, -1.5, 1.5, 1.5, 1.5])
+    render_step_size = 5e-3
+    estimator = OccGridEstimator(roi_aabb=aabb, resolution=128, levels=1)
+    radiance_field = VanillaNeRFRadianceField()
+    if args.model_path is not None:
+        checkpoint = torch.load(args.model_path, map_location="cpu")
+        radiance_field.load_state_dict(checkpoint["radiance_field_state_dict"])
+        estimator.load_state_dict(checkpoint["estimator_state_dict"])
+    else:
+        estimator.binaries.fill_(True)
+    radiance_field.eval()
+    estimator.eval()
+
+    render_fn = functools.partial(
+        render_image_with_occgrid,
+        radiance_field,
+        estimator,
+        render_step_size=render_step_size,
+        render_bkgd=torch.ones(3),
+        test_chunk_size=args.tile_size,
+    )
+    frames = turntable_rays(
+        args.n_frames,
+        args.width,
+        args.height,
+        args.focal,
+        args.radius,
+        args.elevation,
+    )
+
+    base_fps = None
+    for num_workers in args.num_workers:
+        out_dir = os.path.join(args.out_dir, f"workers_{num_workers}")
+        tic = time.time()
+        paths = render_frames_cpu(
+            render_fn,
+            frames,
+            out_dir,
+            tile_size=args.tile_size,
+            num_workers=num_workers,
+            threads_per_worker=args.threads_per_worker,
+            executor=args.executor,
+        )
+        fps = args.n_frames / (time.time() - tic)
+        base_fps = base_fps or fps
+        print(
+            f"num_workers={num_workers} | "
+            f"threads_per_worker={args.threads_per_worker} | "
+            f"fps={fps:.4f} | speedup={fps / base_fps:.2f}x"
+        )
+
+    for path in paths:
+        rgb = np.load(path, mmap_mode="r")[..., :3]
+        imageio.imwrite(
+            path[: -len(".npy")] + ".png",
+            (np.clip(rgb, 0.0, 1.0) * 255).astype(np.uint8),
+        )
+
+
+if __name__ == "__main__":
+    main()
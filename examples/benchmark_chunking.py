@@ -0,0 +1,118 @@
+"""
+Copyright (c) 2022 Ruilong Li, UC Berkeley.
+
+Compare the evaluation throughput of `render_image_with_occgrid` with a
+fixed number of rays per chunk (`test_chunk_size`) against chunks sized
+from a sample budget (`test_max_samples`), on the test split of a NeRF
+synthetic scene and a `train_mlp_nerf.py` checkpoint, e.g.:
+
+    python benchmark_chunking.py --model_path mlp_nerf_50000 --scene lego \\
+        --test_chunk_size 1024 4096 16384 \\
+        --test_max_samples 65536 262144 1048576
+"""
+
+import argparse
+import pathlib
+import time
+
+import torch
+from datasets.nerf_synthetic import SubjectLoader
+from radiance_fields.mlp import VanillaNeRFRadianceField
+from utils import NERF_SYNTHETIC_SCENES, render_image_with_occgrid
+
+from nerfacc.estimators.occ_grid import OccGridEstimator
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data_root",
+        type=str,
+        default=str(pathlib.Path.cwd() / "data/nerf_synthetic"),
+    )
+    parser.add_argument(
+        "--scene", type=str, default="lego", choices=NERF_SYNTHETIC_SCENES
+    )
+    parser.add_argument("--model_path", type=str, required=True)
+    parser.add_argument("--n_images", type=int, default=10)
+    parser.add_argument(
+        "--test_chunk_size", type=int, nargs="*", default=[1024, 4096, 16384]
+    )
+    parser.add_argument(
+        "--test_max_samples",
+        type=int,
+        nargs="*",
+        default=[1 << 16, 1 << 18, 1 << 20],
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cuda:0" if torch.cuda.is_available() else "cpu",
+    )
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    # scene and render parameters of train_mlp_nerf.py
+    aabb = torch.tensor([-1.5, -1.5, -1.5, 1.5, 1.5, 1.5], device=device)
+    render_step_size = 5e-3
+    estimator = OccGridEstimator(roi_aabb=aabb, resolution=128, levels=1).to(
+        device
+    )
+    radiance_field = VanillaNeRFRadianceField().to(device)
+    checkpoint = torch.load(args.model_path, map_location=device)
+    radiance_field.load_state_dict(checkpoint["radiance_field_state_dict"])
+    estimator.load_state_dict(checkpoint["estimator_state_dict"])
+    radiance_field.eval()
+    estimator.eval()
+
+    test_dataset = SubjectLoader(
+        subject_id=args.scene,
+        root_fp=args.data_root,
+        split="test",
+        num_rays=None,
+        device=device,
+    )
+    n_images = min(args.n_images, len(test_dataset))
+
+    configs = [dict(test_chunk_size=n) for n in args.test_chunk_size] + [
+        dict(test_max_samples=n) for n in args.test_max_samples
+    ]
+    for config in configs:
+        n_rays = n_samples = 0
+        elapsed = 0.0
+        if device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(device)
+        with torch.no_grad():
+            for i in range(n_images):
+                data = test_dataset[i]
+                rays = data["rays"]
+                if device.type == "cuda":
+                    torch.cuda.synchronize(device)
+                tic = time.time()
+                _, _, _, samples = render_image_with_occgrid(
+                    radiance_field,
+                    estimator,
+                    rays,
+                    render_step_size=render_step_size,
+                    render_bkgd=data["color_bkgd"],
+                    **config,
+                )
+                if device.type == "cuda":
+                    torch.cuda.synchronize(device)
+                elapsed += time.time() - tic
+                n_rays += rays.origins.shape[:-1].numel()
+                n_samples += samples
+        peak = (
+            f"{torch.cuda.max_memory_allocated(device) / 2**20:.0f} MiB"
+            if device.type == "cuda"
+            else "n/a"
+        )
+        name = ", ".join(f"{k}={v}" for k, v in config.items())
+        print(
+            f"{name} | rays/s={n_rays / elapsed:.0f} | "
+            f"samples/s={n_samples / elapsed:.0f} | peak memory={peak}"
+        )
+
+
+if __name__ == "__main__":
+    main()
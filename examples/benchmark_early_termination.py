@@ -0,0 +1,163 @@
+"""
+Copyright (c) 2022 Ruilong Li, UC Berkeley.
+
+Count the network evaluations of `OccGridEstimator.render_streaming`
+against `OccGridEstimator.sampling` followed by `nerfacc.rendering`, on the
+test split of the NeRF synthetic scenes with `train_mlp_nerf.py` checkpoints:
+
+    python benchmark_early_termination.py --model_path "ckpts/{scene}" \\
+        --scenes lego chair ship
+"""
+
+import argparse
+import pathlib
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from datasets.nerf_synthetic import SubjectLoader
+from datasets.utils import namedtuple_map
+from radiance_fields.mlp import VanillaNeRFRadianceField
+from utils import NERF_SYNTHETIC_SCENES
+
+from nerfacc import rendering
+from nerfacc.estimators.occ_grid import OccGridEstimator
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data_root",
+        type=str,
+        default=str(pathlib.Path.cwd() / "data/nerf_synthetic"),
+    )
+    parser.add_argument(
+        "--scenes", type=str, nargs="+", default=NERF_SYNTHETIC_SCENES
+    )
+    parser.add_argument(
+        "--model_path",
+        type=str,
+        required=True,
+        help="checkpoint of train_mlp_nerf.py, formatted with the scene name",
+    )
+    parser.add_argument("--n_images", type=int, default=10)
+    parser.add_argument("--test_chunk_size", type=int, default=8192)
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cuda:0" if torch.cuda.is_available() else "cpu",
+    )
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    # scene and render parameters of train_mlp_nerf.py
+    aabb = torch.tensor([-1.5, -1.5, -1.5, 1.5, 1.5, 1.5], device=device)
+    render_step_size = 5e-3
+    early_stop_eps = 1e-4
+
+    for scene in args.scenes:
+        estimator = OccGridEstimator(
+            roi_aabb=aabb, resolution=128, levels=1
+        ).to(device)
+        radiance_field = VanillaNeRFRadianceField().to(device)
+        checkpoint = torch.load(
+            args.model_path.format(scene=scene), map_location=device
+        )
+        radiance_field.load_state_dict(checkpoint["radiance_field_state_dict"])
+        estimator.load_state_dict(checkpoint["estimator_state_dict"])
+        radiance_field.eval()
+        estimator.eval()
+
+        test_dataset = SubjectLoader(
+            subject_id=scene,
+            root_fp=args.data_root,
+            split="test",
+            num_rays=None,
+            device=device,
+        )
+
+        n_evals = {"sampling + rendering": 0, "streaming": 0}
+        elapsed = {"sampling + rendering": 0.0, "streaming": 0.0}
+        psnrs = {"sampling + rendering": [], "streaming": []}
+        for i in range(min(args.n_images, len(test_dataset))):
+            data = test_dataset[i]
+            rays = namedtuple_map(lambda r: r.reshape(-1, 3), data["rays"])
+            pixels = data["pixels"].reshape(-1, 3)
+            render_bkgd = data["color_bkgd"]
+
+            for mode in n_evals:
+                colors = []
+                if device.type == "cuda":
+                    torch.cuda.synchronize(device)
+                tic = time.time()
+                for start in range(0, len(pixels), args.test_chunk_size):
+                    chunk_rays = namedtuple_map(
+                        lambda r: r[start : start + args.test_chunk_size], rays
+                    )
+
+                    def positions_fn(t_starts, t_ends, ray_indices):
+                        t_origins = chunk_rays.origins[ray_indices]
+                        t_dirs = chunk_rays.viewdirs[ray_indices]
+                        return (
+                            t_origins
+                            + t_dirs * (t_starts + t_ends)[:, None] / 2.0
+                        )
+
+                    def sigma_fn(t_starts, t_ends, ray_indices):
+                        n_evals[mode] += len(t_starts)
+                        positions = positions_fn(t_starts, t_ends, ray_indices)
+                        return radiance_field.query_density(positions)[:, 0]
+
+                    def rgb_sigma_fn(t_starts, t_ends, ray_indices):
+                        n_evals[mode] += len(t_starts)
+                        positions = positions_fn(t_starts, t_ends, ray_indices)
+                        t_dirs = chunk_rays.viewdirs[ray_indices]
+                        rgbs, sigmas = radiance_field(positions, t_dirs)
+                        return rgbs, sigmas[:, 0]
+
+                    with torch.no_grad():
+                        if mode == "streaming":
+                            rgb, _, _, _ = estimator.render_streaming(
+                                chunk_rays.origins,
+                                chunk_rays.viewdirs,
+                                rgb_sigma_fn,
+                                render_step_size=render_step_size,
+                                early_stop_eps=early_stop_eps,
+                                render_bkgd=render_bkgd,
+                            )
+                        else:
+                            ray_indices, t_starts, t_ends = estimator.sampling(
+                                chunk_rays.origins,
+                                chunk_rays.viewdirs,
+                                sigma_fn=sigma_fn,
+                                render_step_size=render_step_size,
+                                early_stop_eps=early_stop_eps,
+                            )
+                            rgb, _, _, _ = rendering(
+                                t_starts,
+                                t_ends,
+                                ray_indices,
+                                n_rays=len(chunk_rays.origins),
+                                rgb_sigma_fn=rgb_sigma_fn,
+                                render_bkgd=render_bkgd,
+                            )
+                    colors.append(rgb)
+                if device.type == "cuda":
+                    torch.cuda.synchronize(device)
+                elapsed[mode] += time.time() - tic
+                mse = F.mse_loss(torch.cat(colors, dim=0), pixels)
+                psnrs[mode].append((-10.0 * torch.log10(mse)).item())
+
+        for mode in n_evals:
+            print(
+                f"{scene} | {mode} | evals={n_evals[mode]} | "
+                f"time={elapsed[mode]:.2f}s | "
+                f"psnr={np.mean(psnrs[mode]):.2f}"
+            )
+        reduction = 1 - n_evals["streaming"] / n_evals["sampling + rendering"]
+        print(f"{scene} | network evaluations reduced by {reduction:.1%}")
+
+
+if __name__ == "__main__":
+    main()
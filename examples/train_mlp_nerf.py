@@ -57,6 +57,13 @@ parser.add_argument(
     type=int,
     default=4096,
 )
+parser.add_argument(
+    "--test_max_samples",
+    type=int,
+    default=None,
+    help="if set, evaluate in chunks of about this many samples "
+    "instead of test_chunk_size rays",
+)
 args = parser.parse_args()
 
 # training parameters
@@ -222,6 +229,7 @@ for step in range(max_steps + 1):
                     render_bkgd=render_bkgd,
                     # test options
                     test_chunk_size=args.test_chunk_size,
+                    test_max_samples=args.test_max_samples,
                 )
                 mse = F.mse_loss(rgb, pixels)
                 psnr = -10.0 * torch.log(mse) / np.log(10.0)
@@ -58,6 +58,13 @@ parser.add_argument(
     type=int,
     default=4096,
 )
+parser.add_argument(
+    "--test_max_samples",
+    type=int,
+    default=None,
+    help="if set, evaluate in chunks of about this many samples "
+    "instead of test_chunk_size rays",
+)
 args = parser.parse_args()
 
 # training parameters
@@ -205,6 +212,7 @@ for step in range(max_steps + 1):
                     alpha_thre=0.01,
                     # test options
                     test_chunk_size=args.test_chunk_size,
+                    test_max_samples=args.test_max_samples,
                     # t-nerf options
                     timestamps=timestamps,
                 )
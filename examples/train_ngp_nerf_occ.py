@@ -18,6 +18,7 @@ from radiance_fields.ngp import NGPRadianceField
 from examples.utils import (
     MIPNERF360_UNBOUNDED_SCENES,
     NERF_SYNTHETIC_SCENES,
+    MarchingWorkspace,
     render_image_with_occgrid,
     render_image_with_occgrid_test,
     set_random_seed,
@@ -221,6 +222,7 @@ for step in range(max_steps + 1):
 
         psnrs = []
         lpips = []
+        workspace = MarchingWorkspace()
         with torch.no_grad():
             for i in tqdm.tqdm(range(len(test_dataset))):
                 data = test_dataset[i]
@@ -241,6 +243,7 @@ for step in range(max_steps + 1):
                     render_bkgd=render_bkgd,
                     cone_angle=cone_angle,
                     alpha_thre=alpha_thre,
+                    workspace=workspace,
                 )
                 mse = F.mse_loss(rgb, pixels)
                 psnr = -10.0 * torch.log(mse) / np.log(10.0)
@@ -260,3 +263,4 @@ for step in range(max_steps + 1):
         psnr_avg = sum(psnrs) / len(psnrs)
         lpips_avg = sum(lpips) / len(lpips)
         print(f"evaluation: psnr_avg={psnr_avg}, lpips_avg={lpips_avg}")
+        print(f"workspace allocations per frame: {workspace.allocs_per_frame}")
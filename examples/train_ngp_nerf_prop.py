@@ -25,6 +25,7 @@ from examples.utils import (
     LLFF_NDC_SCENES,
     NERF_SYNTHETIC_SCENES,
     render_image_with_propnet,
+    render_image_with_propnet_streaming,
     set_random_seed,
 )
 from nerfacc.estimators.prop_net import (
@@ -60,6 +61,13 @@ parser.add_argument(
     type=int,
     default=8192,
 )
+parser.add_argument(
+    "--test_max_bytes",
+    type=int,
+    default=None,
+    help="if set, evaluate in tiles that fit in this many bytes "
+    "instead of chunks of test_chunk_size rays",
+)
 parser.add_argument(
     "--sampling_type",
     type=str,
@@ -365,22 +373,40 @@ for step in range(start_step, max_steps + 1):
                     cm.requeue()
 
                 # rendering
-                rgb, acc, depth, _, _ = render_image_with_propnet(
-                    radiance_field,
-                    proposal_networks,
-                    estimator,
-                    rays,
-                    # rendering options
-                    num_samples=num_samples,
-                    num_samples_per_prop=num_samples_per_prop,
-                    near_plane=near_plane,
-                    far_plane=far_plane,
-                    sampling_type=prop_sampling_type,
-                    opaque_bkgd=opaque_bkgd,
-                    render_bkgd=render_bkgd,
-                    # test options
-                    test_chunk_size=args.test_chunk_size,
-                )
+                if args.test_max_bytes is not None:
+                    rgb, acc, depth = render_image_with_propnet_streaming(
+                        radiance_field,
+                        proposal_networks,
+                        estimator,
+                        rays,
+                        # rendering options
+                        num_samples=num_samples,
+                        num_samples_per_prop=num_samples_per_prop,
+                        near_plane=near_plane,
+                        far_plane=far_plane,
+                        sampling_type=prop_sampling_type,
+                        opaque_bkgd=opaque_bkgd,
+                        render_bkgd=render_bkgd,
+                        # test options
+                        max_bytes=args.test_max_bytes,
+                    )
+                else:
+                    rgb, acc, depth, _, _ = render_image_with_propnet(
+                        radiance_field,
+                        proposal_networks,
+                        estimator,
+                        rays,
+                        # rendering options
+                        num_samples=num_samples,
+                        num_samples_per_prop=num_samples_per_prop,
+                        near_plane=near_plane,
+                        far_plane=far_plane,
+                        sampling_type=prop_sampling_type,
+                        opaque_bkgd=opaque_bkgd,
+                        render_bkgd=render_bkgd,
+                        # test options
+                        test_chunk_size=args.test_chunk_size,
+                    )
                 mse = F.mse_loss(rgb, pixels)
                 psnr = -10.0 * torch.log(mse) / np.log(10.0)
                 psnrs.append(psnr.item())
@@ -2,8 +2,16 @@
 Copyright (c) 2022 Ruilong Li, UC Berkeley.
 """
 
+import multiprocessing
+import os
 import random
-from typing import Optional, Sequence
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple, Union
 
 try:
     from typing import Literal
@@ -68,10 +76,16 @@ def render_image_with_occgrid(
     alpha_thre: float = 0.0,
     # test options
     test_chunk_size: int = 8192,
+    test_max_samples: Optional[int] = None,
     # only useful for dnerf
     timestamps: Optional[torch.Tensor] = None,
 ):
-    """Render the pixels of an image."""
+    """Render the pixels of an image.
+
+    In evaluation, the rays are rendered in chunks of `test_chunk_size` rays,
+    or, if `test_max_samples` is given, in chunks of about `test_max_samples`
+    samples (see :func:`occgrid_chunks_by_samples`).
+    """
     rays_shape = rays.origins.shape
     if len(rays_shape) == 3:
         height, width, _ = rays_shape
@@ -114,14 +128,26 @@ def render_image_with_occgrid(
             rgbs, sigmas = radiance_field(positions, t_dirs)
         return rgbs, sigmas.squeeze(-1)
 
+    if radiance_field.training:
+        chunks = [(0, num_rays)]
+    elif test_max_samples is not None:
+        chunks = occgrid_chunks_by_samples(
+            estimator,
+            rays,
+            test_max_samples,
+            near_plane=near_plane,
+            far_plane=far_plane,
+            render_step_size=render_step_size,
+            cone_angle=cone_angle,
+        )
+    else:
+        chunks = [
+            (i, min(i + test_chunk_size, num_rays))
+            for i in range(0, num_rays, test_chunk_size)
+        ]
     results = []
-    chunk = (
-        torch.iinfo(torch.int32).max
-        if radiance_field.training
-        else test_chunk_size
-    )
-    for i in range(0, num_rays, chunk):
-        chunk_rays = namedtuple_map(lambda r: r[i : i + chunk], rays)
+    for start, end in chunks:
+        chunk_rays = namedtuple_map(lambda r: r[start:end], rays)
         ray_indices, t_starts, t_ends = estimator.sampling(
             chunk_rays.origins,
             chunk_rays.viewdirs,
@@ -155,6 +181,60 @@ def render_image_with_occgrid(
     )
 
 
+@torch.no_grad()
+def occgrid_chunks_by_samples(
+    estimator: OccGridEstimator,
+    rays: Rays,
+    max_samples: int,
+    near_plane: float = 0.0,
+    far_plane: float = 1e10,
+    render_step_size: float = 1e-3,
+    cone_angle: float = 0.0,
+    count_chunk_size: int = 1024,
+) -> List[Tuple[int, int]]:
+    """Split the flattened rays into contiguous chunks of about `max_samples`
+    samples each.
+
+    The number of samples per ray varies by orders of magnitude between empty
+    space and dense geometry, so a fixed number of rays per chunk either
+    underuses the memory or runs out of it. The samples per ray are counted
+    with a traversal of the occupancy grid, which does not evaluate the
+    radiance field. They upper bound the samples of
+    :meth:`OccGridEstimator.sampling`, which only drops samples.
+
+    The traversal is run on `count_chunk_size` rays at a time and only their
+    counts are kept, so the memory of this pre-pass is bounded by the
+    samples of a chunk of rays rather than of the whole image.
+
+    Returns:
+        The (start, end) ray indices of the chunks. A chunk has less than
+        `max_samples` samples plus the samples of its last ray.
+    """
+    chunk_cnts = []
+    for i in range(0, rays.origins.shape[0], count_chunk_size):
+        rays_o = rays.origins[i : i + count_chunk_size]
+        near_planes = torch.full_like(rays_o[..., 0], fill_value=near_plane)
+        far_planes = torch.full_like(rays_o[..., 0], fill_value=far_plane)
+        _, samples, _ = traverse_grids(
+            rays_o,
+            rays.viewdirs[i : i + count_chunk_size],
+            estimator.binaries,
+            estimator.aabbs,
+            near_planes=near_planes,
+            far_planes=far_planes,
+            step_size=render_step_size,
+            cone_angle=cone_angle,
+            mips=estimator.mips,
+        )
+        chunk_cnts.append(samples.chunk_cnts)
+    # Assign each ray to the chunk in which its first sample falls.
+    chunk_cnts = torch.cat(chunk_cnts)
+    chunk_ids = (torch.cumsum(chunk_cnts, dim=0) - chunk_cnts) // max_samples
+    _, rays_per_chunk = torch.unique_consecutive(chunk_ids, return_counts=True)
+    ends = torch.cumsum(rays_per_chunk, dim=0).tolist()
+    return list(zip([0] + ends[:-1], ends))
+
+
 def render_image_with_propnet(
     # scene
     radiance_field: torch.nn.Module,
@@ -185,26 +265,6 @@ def render_image_with_propnet(
     else:
         num_rays, _ = rays_shape
 
-    def prop_sigma_fn(t_starts, t_ends, proposal_network):
-        t_origins = chunk_rays.origins[..., None, :]
-        t_dirs = chunk_rays.viewdirs[..., None, :]
-        positions = t_origins + t_dirs * (t_starts + t_ends)[..., None] / 2.0
-        sigmas = proposal_network(positions)
-        if opaque_bkgd:
-            sigmas[..., -1, :] = torch.inf
-        return sigmas.squeeze(-1)
-
-    def rgb_sigma_fn(t_starts, t_ends, ray_indices):
-        t_origins = chunk_rays.origins[..., None, :]
-        t_dirs = chunk_rays.viewdirs[..., None, :].repeat_interleave(
-            t_starts.shape[-1], dim=-2
-        )
-        positions = t_origins + t_dirs * (t_starts + t_ends)[..., None] / 2.0
-        rgb, sigmas = radiance_field(positions, t_dirs)
-        if opaque_bkgd:
-            sigmas[..., -1, :] = torch.inf
-        return rgb, sigmas.squeeze(-1)
-
     results = []
     chunk = (
         torch.iinfo(torch.int32).max
@@ -213,27 +273,28 @@ def render_image_with_propnet(
     )
     for i in range(0, num_rays, chunk):
         chunk_rays = namedtuple_map(lambda r: r[i : i + chunk], rays)
-        t_starts, t_ends = estimator.sampling(
-            prop_sigma_fns=[
-                lambda *args: prop_sigma_fn(*args, p) for p in proposal_networks
-            ],
-            prop_samples=num_samples_per_prop,
+        (
+            rgb,
+            opacity,
+            depth,
+            extra,
+            t_starts,
+            t_ends,
+        ) = _render_chunk_with_propnet(
+            radiance_field,
+            proposal_networks,
+            estimator,
+            chunk_rays,
             num_samples=num_samples,
-            n_rays=chunk_rays.origins.shape[0],
+            num_samples_per_prop=num_samples_per_prop,
             near_plane=near_plane,
             far_plane=far_plane,
             sampling_type=sampling_type,
+            opaque_bkgd=opaque_bkgd,
+            render_bkgd=render_bkgd,
             stratified=radiance_field.training,
             requires_grad=proposal_requires_grad,
         )
-        rgb, opacity, depth, extra = rendering(
-            t_starts,
-            t_ends,
-            ray_indices=None,
-            n_rays=None,
-            rgb_sigma_fn=rgb_sigma_fn,
-            render_bkgd=render_bkgd,
-        )
         ray_indices = torch.arange(0, t_starts.shape[0], device=t_starts.device).repeat_interleave(t_starts.shape[1]).flatten()
         unique_indices, inverse = torch.unique(ray_indices, sorted=True, return_inverse=True)
         binnums = torch.bincount(inverse)
@@ -263,6 +324,241 @@ def render_image_with_propnet(
     )
 
 
+def _render_chunk_with_propnet(
+    # scene
+    radiance_field: torch.nn.Module,
+    proposal_networks: Sequence[torch.nn.Module],
+    estimator: PropNetEstimator,
+    chunk_rays: Rays,
+    # rendering options
+    num_samples: int,
+    num_samples_per_prop: Sequence[int],
+    near_plane: Optional[float],
+    far_plane: Optional[float],
+    sampling_type: Literal["uniform", "lindisp"],
+    opaque_bkgd: bool,
+    render_bkgd: Optional[torch.Tensor],
+    stratified: bool,
+    requires_grad: bool,
+):
+    """Sample and render a chunk of flattened rays with the proposal networks.
+
+    Returns rgb, opacity, depth, the extras of :func:`nerfacc.rendering` and
+    the (t_starts, t_ends) of the samples.
+    """
+
+    def prop_sigma_fn(t_starts, t_ends, proposal_network):
+        t_origins = chunk_rays.origins[..., None, :]
+        t_dirs = chunk_rays.viewdirs[..., None, :]
+        positions = t_origins + t_dirs * (t_starts + t_ends)[..., None] / 2.0
+        sigmas = proposal_network(positions)
+        if opaque_bkgd:
+            sigmas[..., -1, :] = torch.inf
+        return sigmas.squeeze(-1)
+
+    def rgb_sigma_fn(t_starts, t_ends, ray_indices):
+        t_origins = chunk_rays.origins[..., None, :]
+        t_dirs = chunk_rays.viewdirs[..., None, :].repeat_interleave(
+            t_starts.shape[-1], dim=-2
+        )
+        positions = t_origins + t_dirs * (t_starts + t_ends)[..., None] / 2.0
+        rgb, sigmas = radiance_field(positions, t_dirs)
+        if opaque_bkgd:
+            sigmas[..., -1, :] = torch.inf
+        return rgb, sigmas.squeeze(-1)
+
+    t_starts, t_ends = estimator.sampling(
+        prop_sigma_fns=[
+            lambda *args, p=p: prop_sigma_fn(*args, p)
+            for p in proposal_networks
+        ],
+        prop_samples=num_samples_per_prop,
+        num_samples=num_samples,
+        n_rays=chunk_rays.origins.shape[0],
+        near_plane=near_plane,
+        far_plane=far_plane,
+        sampling_type=sampling_type,
+        stratified=stratified,
+        requires_grad=requires_grad,
+    )
+    rgb, opacity, depth, extras = rendering(
+        t_starts,
+        t_ends,
+        ray_indices=None,
+        n_rays=None,
+        rgb_sigma_fn=rgb_sigma_fn,
+        render_bkgd=render_bkgd,
+    )
+    return rgb, opacity, depth, extras, t_starts, t_ends
+
+
+@torch.no_grad()
+def iter_render_tiles_with_propnet(
+    # scene
+    radiance_field: torch.nn.Module,
+    proposal_networks: Sequence[torch.nn.Module],
+    estimator: PropNetEstimator,
+    rays: Rays,
+    # rendering options
+    num_samples: int,
+    num_samples_per_prop: Sequence[int],
+    near_plane: Optional[float] = None,
+    far_plane: Optional[float] = None,
+    sampling_type: Literal["uniform", "lindisp"] = "lindisp",
+    opaque_bkgd: bool = True,
+    render_bkgd: Optional[torch.Tensor] = None,
+    # test options
+    max_bytes: int = 1 << 30,
+    bytes_per_sample: Optional[int] = None,
+) -> Iterator[Tuple[int, int, torch.Tensor, torch.Tensor, torch.Tensor]]:
+    """Render the flattened rays of an image tile by tile, for evaluation.
+
+    Yields `(start, end, rgb, opacity, depth)` for the rays `start:end`. Only
+    one tile is alive at a time, and the tiles are sized so that their samples
+    take about `max_bytes`, whatever the resolution of the image.
+
+    Args:
+        max_bytes: Memory budget of a tile.
+        bytes_per_sample: Peak memory used per sample by the radiance field
+            and the rendering. If None, it is measured on the first tile on
+            CUDA, and assumed to be 4 KiB on other devices.
+    """
+    rays = namedtuple_map(lambda r: r.reshape(-1, r.shape[-1]), rays)
+    num_rays = rays.origins.shape[0]
+    device = rays.origins.device
+    # the samples of every stage are alive at the end of the sampling.
+    samples_per_ray = num_samples + sum(num_samples_per_prop)
+
+    def render_tile(chunk_rays: Rays):
+        rgb, opacity, depth, _, _, _ = _render_chunk_with_propnet(
+            radiance_field,
+            proposal_networks,
+            estimator,
+            chunk_rays,
+            num_samples=num_samples,
+            num_samples_per_prop=num_samples_per_prop,
+            near_plane=near_plane,
+            far_plane=far_plane,
+            sampling_type=sampling_type,
+            opaque_bkgd=opaque_bkgd,
+            render_bkgd=render_bkgd,
+            stratified=False,
+            requires_grad=False,
+        )
+        return rgb, opacity, depth
+
+    start = 0
+    if bytes_per_sample is None and device.type == "cuda":
+        # Measure the peak memory of a small probe tile.
+        probe_rays = min(num_rays, 256)
+        torch.cuda.synchronize(device)
+        base = torch.cuda.memory_allocated(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        outputs = render_tile(namedtuple_map(lambda r: r[:probe_rays], rays))
+        peak = torch.cuda.max_memory_allocated(device) - base
+        bytes_per_sample = max(peak // (probe_rays * samples_per_ray), 1)
+        yield (0, probe_rays, *outputs)
+        start = probe_rays
+    elif bytes_per_sample is None:
+        bytes_per_sample = 4096
+
+    chunk = max(max_bytes // (bytes_per_sample * samples_per_ray), 1)
+    for start in range(start, num_rays, chunk):
+        end = min(start + chunk, num_rays)
+        outputs = render_tile(namedtuple_map(lambda r: r[start:end], rays))
+        yield (start, end, *outputs)
+
+
+@torch.no_grad()
+def render_image_with_propnet_streaming(
+    # scene
+    radiance_field: torch.nn.Module,
+    proposal_networks: Sequence[torch.nn.Module],
+    estimator: PropNetEstimator,
+    rays: Rays,
+    out: Optional[Union[torch.Tensor, np.ndarray]] = None,
+    **kwargs,
+):
+    """Render the pixels of an image for evaluation, with bounded memory.
+
+    Takes the arguments of :func:`iter_render_tiles_with_propnet`. The tiles
+    are written into `out` as they come, instead of being concatenated at the
+    end.
+
+    Args:
+        out: Output buffer of shape (..., 5) holding rgb, opacity and depth,
+            with `...` the shape of the rays. Can be a numpy memmap, e.g. from
+            `np.lib.format.open_memmap`, to stream the image to disk. If None,
+            a tensor is allocated on the device of the rays.
+
+    Returns:
+        rgb, opacity and depth, as views of `out`.
+    """
+    rays_shape = rays.origins.shape
+    if out is None:
+        out = torch.empty(
+            (*rays_shape[:-1], 5),
+            dtype=rays.origins.dtype,
+            device=rays.origins.device,
+        )
+    assert out.shape == (*rays_shape[:-1], 5), "out must be of shape (..., 5)"
+    flat_out = out.reshape(-1, 5)
+    for start, end, rgb, opacity, depth in iter_render_tiles_with_propnet(
+        radiance_field, proposal_networks, estimator, rays, **kwargs
+    ):
+        tile = torch.cat([rgb, opacity, depth], dim=-1)
+        if isinstance(flat_out, np.ndarray):
+            tile = tile.cpu().numpy()
+        flat_out[start:end] = tile
+    return out[..., :3], out[..., 3:4], out[..., 4:5]
+
+
+class MarchingWorkspace:
+    """Buffers of :func:`render_image_with_occgrid_test` kept across the
+    marching rounds and across frames.
+
+    Each buffer is flat and grows by doubling, so repeated renders of a camera
+    path stop allocating after the first few frames. The allocations made
+    while rendering each frame are recorded in `allocs_per_frame`.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+        self.allocs_per_frame: List[int] = []
+
+    def new_frame(self):
+        self.allocs_per_frame.append(0)
+
+    def buffer(
+        self,
+        name: str,
+        shape: Sequence[int],
+        dtype: torch.dtype,
+        device: torch.device,
+    ) -> torch.Tensor:
+        """An uninitialized tensor of `shape` backed by the buffer `name`."""
+        numel = int(np.prod(shape))
+        buf = self._buffers.get(name)
+        if buf is None or buf.dtype != dtype or buf.device != device:
+            buf = None
+        if buf is None or buf.numel() < numel:
+            capacity = numel if buf is None else max(numel, 2 * buf.numel())
+            buf = torch.empty(capacity, dtype=dtype, device=device)
+            self._buffers[name] = buf
+            if self.allocs_per_frame:
+                self.allocs_per_frame[-1] += 1
+        return buf[:numel].view(shape)
+
+    def masked_select(
+        self, name: str, src: torch.Tensor, mask: torch.Tensor
+    ) -> torch.Tensor:
+        """`src[mask]` for flat tensors, written into the buffer `name`."""
+        # The output is resized in place, which only keeps the storage when
+        # the buffer can hold all of `src`.
+        out = self.buffer(name, src.shape, src.dtype, src.device)[:0]
+        return torch.masked_select(src, mask, out=out)
+
+
 @torch.no_grad()
 def render_image_with_occgrid_test(
     max_samples: int,
@@ -280,8 +576,18 @@ def render_image_with_occgrid_test(
     early_stop_eps: float = 1e-4,
     # only useful for dnerf
     timestamps: Optional[torch.Tensor] = None,
+    workspace: Optional[MarchingWorkspace] = None,
 ):
-    """Render the pixels of an image."""
+    """Render the pixels of an image.
+
+    The rays are marched in rounds of a few samples per alive ray. Pass the
+    same `workspace` to consecutive calls to reuse its buffers.
+    """
+    if workspace is None:
+        workspace = MarchingWorkspace()
+    workspace.new_frame()
+    ws = workspace
+
     rays_shape = rays.origins.shape
     if len(rays_shape) == 3:
         height, width, _ = rays_shape
@@ -292,42 +598,20 @@ def render_image_with_occgrid_test(
     else:
         num_rays, _ = rays_shape
 
-    def rgb_sigma_fn(t_starts, t_ends, ray_indices):
-        t_origins = rays.origins[ray_indices]
-        t_dirs = rays.viewdirs[ray_indices]
-        positions = (
-            t_origins + t_dirs * (t_starts[:, None] + t_ends[:, None]) / 2.0
-        )
-        if timestamps is not None:
-            # dnerf
-            t = (
-                timestamps[ray_indices]
-                if radiance_field.training
-                else timestamps.expand_as(positions[:, :1])
-            )
-            rgbs, sigmas = radiance_field(positions, t, t_dirs)
-        else:
-            rgbs, sigmas = radiance_field(positions, t_dirs)
-        return rgbs, sigmas.squeeze(-1)
-
     device = rays.origins.device
-    opacity = torch.zeros(num_rays, 1, device=device)
-    depth = torch.zeros(num_rays, 1, device=device)
-    rgb = torch.zeros(num_rays, 3, device=device)
-
-    ray_mask = torch.ones(num_rays, device=device).bool()
+    dtype = rays.origins.dtype
+    # [rgb, opacity, depth] of each ray.
+    state = ws.buffer("state", (num_rays, 5), dtype, device).zero_()
 
     # 1 for synthetic scenes, 4 for real scenes
     min_samples = 1 if cone_angle == 0 else 4
 
-    iter_samples = total_samples = 0
+    iter_samples = 0
+    total_samples = torch.zeros((), dtype=torch.long, device=device)
 
     rays_o = rays.origins
     rays_d = rays.viewdirs
 
-    near_planes = torch.full_like(rays_o[..., 0], fill_value=near_plane)
-    far_planes = torch.full_like(rays_o[..., 0], fill_value=far_plane)
-
     t_mins, t_maxs, hits = ray_aabb_intersect(rays_o, rays_d, estimator.aabbs)
 
     n_grids = estimator.binaries.size(0)
@@ -342,12 +626,48 @@ def render_image_with_occgrid_test(
 
     opc_thre = 1 - early_stop_eps
 
-    while iter_samples < max_samples:
+    # The alive rays are compacted at the end of every round: their ids,
+    # origins, directions, near planes, intersections and accumulated state
+    # are gathered into the front of ping-pong buffers of the workspace, so a
+    # round costs in proportion to the rays that are still alive.
+    ray_ids = torch.arange(
+        num_rays, out=ws.buffer("ray_ids", (num_rays,), torch.long, device)
+    )
+    alive = ray_ids
+    n_alive = num_rays
+    near_planes = ws.buffer("near_planes", (num_rays,), dtype, device)
+    near_planes.fill_(near_plane)
+    far_planes = ws.buffer("far_planes", (num_rays,), dtype, device)
+    far_planes.fill_(far_plane)
+    alive_state = ws.buffer("alive_state", (num_rays, 5), dtype, device)
+    alive_state.zero_()
+    parity = 0
+
+    def compact(name, x, keep):
+        out = ws.buffer(
+            f"{name}_{parity}", (keep.shape[0], *x.shape[1:]), x.dtype, device
+        )
+        return torch.index_select(x, 0, keep, out=out)
 
-        n_alive = ray_mask.sum().item()
-        if n_alive == 0:
-            break
+    def rgb_sigma_fn(t_starts, t_ends, ray_indices):
+        t_origins = rays_o[ray_indices]
+        t_dirs = rays_d[ray_indices]
+        positions = (
+            t_origins + t_dirs * (t_starts[:, None] + t_ends[:, None]) / 2.0
+        )
+        if timestamps is not None:
+            # dnerf
+            t = (
+                timestamps[alive[ray_indices]]
+                if radiance_field.training
+                else timestamps.expand_as(positions[:, :1])
+            )
+            rgbs, sigmas = radiance_field(positions, t, t_dirs)
+        else:
+            rgbs, sigmas = radiance_field(positions, t_dirs)
+        return rgbs, sigmas.squeeze(-1)
 
+    while iter_samples < max_samples and n_alive > 0:
         # the number of samples to add on each ray
         n_samples = max(min(num_rays // n_alive, 64), min_samples)
         iter_samples += n_samples
@@ -355,85 +675,226 @@ def render_image_with_occgrid_test(
         # ray marching
         (intervals, samples, termination_planes) = traverse_grids(
             # rays
-            rays_o,  # [n_rays, 3]
-            rays_d,  # [n_rays, 3]
+            rays_o,  # [n_alive, 3]
+            rays_d,  # [n_alive, 3]
             # grids
             estimator.binaries,  # [m, resx, resy, resz]
             estimator.aabbs,  # [m, 6]
             # options
-            near_planes,  # [n_rays]
-            far_planes,  # [n_rays]
+            near_planes,  # [n_alive]
+            far_planes[:n_alive],  # [n_alive]
             render_step_size,
             cone_angle,
             n_samples,
             True,
-            ray_mask,
+            None,
             # pre-compute intersections
-            t_sorted,  # [n_rays, m*2]
-            t_indices,  # [n_rays, m*2]
-            hits,  # [n_rays, m]
+            t_sorted,  # [n_alive, m*2]
+            t_indices,  # [n_alive, m*2]
+            hits,  # [n_alive, m]
+            # empty space skipping
+            estimator.mips,
+        )
+        t_starts = ws.masked_select(
+            "t_starts", intervals.vals, intervals.is_left
         )
-        t_starts = intervals.vals[intervals.is_left]
-        t_ends = intervals.vals[intervals.is_right]
-        ray_indices = samples.ray_indices[samples.is_valid]
-        packed_info = samples.packed_info
+        t_ends = ws.masked_select("t_ends", intervals.vals, intervals.is_right)
+        # indices into the alive rays
+        ray_indices = ws.masked_select(
+            "ray_indices", samples.ray_indices, samples.is_valid
+        )
+        n = ray_indices.shape[0]
 
         # get rgb and sigma from radiance field
         rgbs, sigmas = rgb_sigma_fn(t_starts, t_ends, ray_indices)
-        # volume rendering using native cuda scan
+        # Weights of this round only. Scaling the per ray sums by the
+        # transmittance of the previous rounds below gives the same result as
+        # passing it as `prefix_trans`, without a per sample gather.
         weights, _, alphas = render_weight_from_density(
             t_starts,
             t_ends,
             sigmas,
             ray_indices=ray_indices,
-            n_rays=num_rays,
-            prefix_trans=1 - opacity[ray_indices].squeeze(-1),
+            n_rays=n_alive,
         )
         if alpha_thre > 0:
             vis_mask = alphas >= alpha_thre
-            ray_indices, rgbs, weights, t_starts, t_ends = (
-                ray_indices[vis_mask],
-                rgbs[vis_mask],
-                weights[vis_mask],
-                t_starts[vis_mask],
-                t_ends[vis_mask],
-            )
+            weights.mul_(vis_mask)
+            total_samples += vis_mask.sum()
+        else:
+            total_samples += n
 
+        values = ws.buffer("values", (n, 5), dtype, device)
+        values[:, :3] = rgbs
+        values[:, 3] = 1.0
+        torch.add(t_starts, t_ends, out=values[:, 4]).mul_(0.5)
+        local = ws.buffer("local", (n_alive, 5), dtype, device).zero_()
         accumulate_along_rays_(
-            weights,
-            values=rgbs,
-            ray_indices=ray_indices,
-            outputs=rgb,
-        )
-        accumulate_along_rays_(
-            weights,
-            values=None,
-            ray_indices=ray_indices,
-            outputs=opacity,
-        )
-        accumulate_along_rays_(
-            weights,
-            values=(t_starts + t_ends)[..., None] / 2.0,
-            ray_indices=ray_indices,
-            outputs=depth,
+            weights, values=values, ray_indices=ray_indices, outputs=local
         )
-        # update near_planes using termination planes
-        near_planes = termination_planes
+        trans = ws.buffer("trans", (n_alive, 1), dtype, device)
+        torch.sub(1.0, alive_state[:, 3:4], out=trans)
+        alive_state.addcmul_(local, trans)
+        state.index_copy_(0, alive, alive_state)
+
         # update rays status
-        ray_mask = torch.logical_and(
-            # early stopping
-            opacity.view(-1) <= opc_thre,
-            # remove rays that have reached the far plane
-            packed_info[:, 1] == n_samples,
-        )
-        total_samples += ray_indices.shape[0]
+        ray_mask = ws.buffer("ray_mask", (n_alive,), torch.bool, device)
+        torch.le(alive_state[:, 3], opc_thre, out=ray_mask)  # early stopping
+        # remove rays that have reached the far plane
+        is_full = ws.buffer("is_full", (n_alive,), torch.bool, device)
+        torch.eq(samples.chunk_cnts, n_samples, out=is_full)
+        ray_mask.logical_and_(is_full)
+        # Compacting the alive rays is the only host read of the round.
+        keep = ws.masked_select("keep", ray_ids[:n_alive], ray_mask)
+        n_alive = keep.shape[0]
+        if n_alive == 0:
+            break
+        parity ^= 1
+        alive = compact("alive", alive, keep)
+        rays_o = compact("rays_o", rays_o, keep)
+        rays_d = compact("rays_d", rays_d, keep)
+        # update near_planes using termination planes
+        near_planes = compact("near_planes", termination_planes, keep)
+        alive_state = compact("alive_state", alive_state, keep)
+        t_sorted = compact("t_sorted", t_sorted, keep)
+        hits = compact("hits", hits, keep)
+        if n_grids > 1:
+            t_indices = compact("t_indices", t_indices, keep)
+        else:
+            t_indices = t_indices[:n_alive]
 
+    rgb, depth = state[:, :3], state[:, 4:]
+    opacity = state[:, 3:4].clone()
     rgb = rgb + render_bkgd * (1.0 - opacity)
-    depth = depth / opacity.clamp_min(torch.finfo(rgbs.dtype).eps)
+    depth = depth / opacity.clamp_min(torch.finfo(dtype).eps)
 
     return (
         rgb.view((*rays_shape[:-1], -1)),
         opacity.view((*rays_shape[:-1], -1)),
         depth.view((*rays_shape[:-1], -1)),
-        total_samples,
+        total_samples.item(),
     )
+
+
+# Worker state of `render_frames_cpu`, set once per worker process (or once
+# for all the worker threads).
+_tile_render_fn = None
+
+
+def _init_tile_worker(render_fn: Callable, num_threads: int):
+    global _tile_render_fn
+    torch.set_num_threads(num_threads)
+    _tile_render_fn = render_fn
+
+
+@torch.no_grad()
+def _render_tile(frame_id: int, start: int, rays_type: type, rays_arrays):
+    # Tiles travel as numpy arrays: cheaper to pickle than tensors, and they
+    # do not hold on to shared memory file descriptors.
+    rays = rays_type(*(torch.from_numpy(x) for x in rays_arrays))
+    rgb, opacity, depth = _tile_render_fn(rays)[:3]
+    outputs = torch.cat([rgb, opacity, depth], dim=-1)
+    return frame_id, start, outputs.numpy()
+
+
+def render_frames_cpu(
+    render_fn: Callable,
+    frames: Sequence[Rays],
+    out_dir: str,
+    tile_size: int = 16384,
+    num_workers: Optional[int] = None,
+    threads_per_worker: int = 1,
+    executor: Literal["process", "thread"] = "process",
+) -> List[str]:
+    """Render the frames tile by tile on a pool of CPU workers, for offline
+    baking of image sequences (e.g., turntables).
+
+    Each frame is written to `out_dir/{frame_id:04d}.npy`, a float32 array of
+    shape (..., 5) holding rgb, opacity and depth. The file is memory-mapped
+    and every tile is written into it as soon as it is finished. It is renamed
+    from `.partial.npy` once the frame is complete; complete frames are
+    skipped, so an interrupted bake can be resumed.
+
+    Args:
+        render_fn: Renders a batch of rays on CPU and returns the rgb (N, 3),
+            opacity (N, 1) and depth (N, 1) first, e.g., a `functools.partial`
+            of `render_image_with_occgrid`. It must be picklable for the
+            "process" executor.
+        frames: The rays of each frame, with shapes (..., 3).
+        out_dir: Directory of the outputs.
+        tile_size: Number of rays per tile.
+        num_workers: Number of workers. Default: cpu_count // threads_per_worker.
+        threads_per_worker: Number of torch threads of each worker.
+        executor: "process" runs each worker in its own (spawned) process.
+            "thread" runs the workers in this process; torch releases the GIL
+            in its ops and each worker thread runs its ops with
+            `threads_per_worker` OpenMP threads.
+
+    Returns:
+        The paths of the frames.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    if num_workers is None:
+        num_workers = max(os.cpu_count() // threads_per_worker, 1)
+    if executor == "process":
+        pool = ProcessPoolExecutor(
+            num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_tile_worker,
+            initargs=(render_fn, threads_per_worker),
+        )
+    elif executor == "thread":
+        _init_tile_worker(render_fn, threads_per_worker)
+        pool = ThreadPoolExecutor(num_workers)
+    else:
+        raise ValueError(f"Unknown executor: {executor}")
+
+    paths = [os.path.join(out_dir, f"{i:04d}.npy") for i in range(len(frames))]
+    # frame_id -> [memmap of shape (n_rays, 5), number of unfinished rays]
+    outputs = {}
+
+    def tasks():
+        for frame_id, rays in enumerate(frames):
+            if os.path.exists(paths[frame_id]):
+                continue
+            rays_shape = rays.origins.shape
+            rays = namedtuple_map(lambda r: r.reshape(-1, r.shape[-1]), rays)
+            num_rays = rays.origins.shape[0]
+            buffer = np.lib.format.open_memmap(
+                paths[frame_id][: -len(".npy")] + ".partial.npy",
+                mode="w+",
+                dtype=np.float32,
+                shape=(*rays_shape[:-1], 5),
+            )
+            outputs[frame_id] = [buffer.reshape(num_rays, 5), num_rays]
+            for start in range(0, num_rays, tile_size):
+                tile = [
+                    r[start : start + tile_size].cpu().numpy() for r in rays
+                ]
+                yield frame_id, start, type(rays), tile
+
+    def write(future):
+        frame_id, start, tile = future.result()
+        output = outputs[frame_id]
+        output[0][start : start + len(tile)] = tile
+        output[1] -= len(tile)
+        if output[1] == 0:
+            output[0].flush()
+            del outputs[frame_id]
+            path = paths[frame_id]
+            os.replace(path[: -len(".npy")] + ".partial.npy", path)
+
+    # Keep a bounded number of tiles in flight so that the pending rays and
+    # results do not pile up in memory.
+    max_in_flight = 2 * num_workers
+    with pool:
+        pending = set()
+        for task in tasks():
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(future)
+            pending.add(pool.submit(_render_tile, *task))
+        for future in wait(pending).done:
+            write(future)
+    return paths
@@ -1,9 +1,14 @@
 """
 Copyright (c) 2022 Ruilong Li, UC Berkeley.
 """
-from .data_specs import RayIntervals, RaySamples
+from .data_specs import PackedRays, RayIntervals, RaySamples
+from .determinism import (
+    are_deterministic_algorithms_enabled,
+    use_deterministic_algorithms,
+)
 from .estimators.occ_grid import OccGridEstimator
 from .estimators.prop_net import PropNetEstimator
+from .estimators.sparse_occ_grid import SparseOccGridEstimator
 from .grid import ray_aabb_intersect, traverse_grids
 from .pack import pack_info
 from .pdf import importance_sampling, searchsorted
@@ -39,8 +44,12 @@ __all__ = [
     "searchsorted",
     "RayIntervals",
     "RaySamples",
+    "PackedRays",
     "ray_aabb_intersect",
     "traverse_grids",
     "OccGridEstimator",
     "PropNetEstimator",
+    "SparseOccGridEstimator",
+    "use_deterministic_algorithms",
+    "are_deterministic_algorithms_enabled",
 ]
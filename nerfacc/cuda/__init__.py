@@ -2,19 +2,245 @@
 Copyright (c) 2022 Ruilong Li, UC Berkeley.
 """
 
-from typing import Any, Callable
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import torch
+
+from ..determinism import are_deterministic_algorithms_enabled
+
+_SCAN_OPS = (
+    "inclusive_sum",
+    "exclusive_sum",
+    "inclusive_prod_forward",
+    "inclusive_prod_backward",
+    "exclusive_prod_forward",
+    "exclusive_prod_backward",
+)
+_GRID_OPS = ("ray_aabb_intersect", "traverse_grids")
+_PDF_OPS = ("importance_sampling", "searchsorted")
+_RENDER_OPS = ("rendering_forward", "rendering_backward")
+_CAMERA_OPS = ("opencv_lens_undistortion", "opencv_lens_undistortion_fisheye")
+
+
+class _RaySegmentsSpec:
+    """Python stand-in of the C++ `RaySegmentsSpec`, used by the
+    "torch-reference" backend when the extension is not available."""
+
+    def __init__(self):
+        self.vals = None
+        self.is_left = None
+        self.is_right = None
+        self.is_valid = None
+        self.chunk_starts = None
+        self.chunk_cnts = None
+        self.ray_indices = None
+
+
+class Backend:
+    """A set of implementations of the ops in `nerfacc.cuda`.
+
+    Args:
+        name: Name of the backend.
+        device_types: Device types the backend accepts tensors on. None
+            means any device.
+        ops: Names of the ops the backend implements.
+        loader: Returns the module providing the ops, or None if the
+            backend is not available on this machine. Called once, lazily.
+        nondeterministic_ops: Names of the ops whose outputs are not bitwise
+            reproducible. They are skipped in the deterministic mode (see
+            :func:`nerfacc.use_deterministic_algorithms`).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        device_types: Optional[Tuple[str, ...]],
+        ops: Tuple[str, ...],
+        loader: Callable[[], Any],
+        nondeterministic_ops: Tuple[str, ...] = (),
+    ):
+        self.name = name
+        self.device_types = device_types
+        self.ops = ops
+        self.nondeterministic_ops = nondeterministic_ops
+        self._loader = loader
+        self._module = None
+        self._loaded = False
+
+    @property
+    def module(self) -> Any:
+        if not self._loaded:
+            self._module = self._loader()
+            self._loaded = True
+        return self._module
+
+    def is_available(self) -> bool:
+        return self.module is not None
+
+    def supports(self, name: str, device: Optional[torch.device]) -> bool:
+        """Whether this backend can run op `name` on `device`."""
+        if name not in self.ops:
+            return False
+        if (
+            name in self.nondeterministic_ops
+            and are_deterministic_algorithms_enabled()
+        ):
+            return False
+        if device is not None and self.device_types is not None:
+            if device.type not in self.device_types:
+                return False
+        return self.is_available()
+
+    def __repr__(self) -> str:
+        return f"Backend(name={self.name!r})"
+
+
+def _load_cuda_ext():
+    # pylint: disable=import-outside-toplevel
+    from ._backend import load_extension
+
+    ext = load_extension()
+    if ext is None or not getattr(ext, "with_cuda", lambda: True)():
+        return None
+    return ext
+
+
+def _load_cpu_ext():
+    # pylint: disable=import-outside-toplevel
+    from ._backend import load_extension
+
+    return load_extension()
+
+
+def _load_torch_reference():
+    # pylint: disable=import-outside-toplevel
+    from .. import grid, scan
+
+    return SimpleNamespace(
+        RaySegmentsSpec=_RaySegmentsSpec,
+        ray_aabb_intersect=grid._ray_aabb_intersect,
+        inclusive_sum=scan._inclusive_sum_torch,
+        exclusive_sum=scan._exclusive_sum_torch,
+        inclusive_prod_forward=scan._inclusive_prod_forward_torch,
+        inclusive_prod_backward=scan._inclusive_prod_backward_torch,
+        exclusive_prod_forward=scan._exclusive_prod_forward_torch,
+        exclusive_prod_backward=scan._exclusive_prod_backward_torch,
+    )
+
+
+# In the order of priority.
+_BACKENDS: List[Backend] = [
+    Backend(
+        "cuda-ext",
+        ("cuda",),
+        ("RaySegmentsSpec",) + _GRID_OPS + _SCAN_OPS + _PDF_OPS + _CAMERA_OPS,
+        _load_cuda_ext,
+        # the scans are parallelized with a reduction order that may vary.
+        nondeterministic_ops=_SCAN_OPS,
+    ),
+    Backend(
+        "cpu-ext",
+        ("cpu",),
+        ("RaySegmentsSpec",) + _GRID_OPS + _SCAN_OPS + _PDF_OPS + _RENDER_OPS,
+        _load_cpu_ext,
+    ),
+    Backend(
+        "torch-reference",
+        None,
+        ("RaySegmentsSpec", "ray_aabb_intersect") + _SCAN_OPS,
+        _load_torch_reference,
+    ),
+]
+
+
+def _find_device(args: Tuple, kwargs: Dict) -> Optional[torch.device]:
+    """The device of the first tensor (or RaySegmentsSpec) argument."""
+    for arg in list(args) + list(kwargs.values()):
+        if isinstance(arg, torch.Tensor):
+            return arg.device
+        vals = getattr(arg, "vals", None)
+        if isinstance(vals, torch.Tensor):
+            return vals.device
+    return None
+
+
+def _select_backend(name: str, device: Optional[torch.device]) -> Backend:
+    for backend in _BACKENDS:
+        if backend.supports(name, device):
+            return backend
+    available = [b.name for b in _BACKENDS if b.is_available()]
+    raise RuntimeError(
+        f"NerfAcc: `{name}` is not supported on device {device}. "
+        f"Available backends: {available}. Please build the extension "
+        "(`pip install nerfacc` with the CUDA toolkit) for full support."
+    )
 
 
 def _make_lazy_cuda_func(name: str) -> Callable:
     def call_cuda(*args, **kwargs):
-        # pylint: disable=import-outside-toplevel
-        from ._backend import _C
-
-        return getattr(_C, name)(*args, **kwargs)
+        device = _find_device(args, kwargs)
+        backend = _select_backend(name, device)
+        return getattr(backend.module, name)(*args, **kwargs)
 
+    call_cuda.__name__ = name
     return call_cuda
 
 
+def get_backend(name: str, device: Optional[torch.device] = None) -> str:
+    """The name of the backend that runs op `name` for inputs on `device`.
+
+    Raises a RuntimeError if no available backend supports it.
+    """
+    if device is not None:
+        device = torch.device(device)
+    return _select_backend(name, device).name
+
+
+def is_supported(name: str, device: Optional[torch.device] = None) -> bool:
+    """Whether any available backend runs op `name` for inputs on `device`."""
+    if device is not None:
+        device = torch.device(device)
+    return any(b.supports(name, device) for b in _BACKENDS)
+
+
+def available_backends() -> Dict[str, Tuple[str, ...]]:
+    """The available backends (in the order of priority) and the ops they
+    implement.
+
+    Example:
+
+    .. code-block:: python
+
+        >>> nerfacc.cuda.available_backends()
+        {'cpu-ext': ('RaySegmentsSpec', 'ray_aabb_intersect', ...),
+         'torch-reference': ('RaySegmentsSpec', 'ray_aabb_intersect', ...)}
+
+    """
+    return {b.name: b.ops for b in _BACKENDS if b.is_available()}
+
+
+def is_available(device: Optional[torch.device] = None) -> bool:
+    """Check if the compiled extension can process tensors on `device`.
+
+    Args:
+        device: The device of the inputs. If None, only checks whether the
+            extension has been compiled.
+    """
+    if device is not None:
+        device = torch.device(device)
+    return any(
+        b.is_available()
+        and (
+            device is None
+            or b.device_types is None
+            or device.type in b.device_types
+        )
+        for b in _BACKENDS
+        if b.name != "torch-reference"
+    )
+
+
 # data specs
 RaySegmentsSpec = _make_lazy_cuda_func("RaySegmentsSpec")
 
@@ -34,6 +260,10 @@ exclusive_prod_backward = _make_lazy_cuda_func("exclusive_prod_backward")
 importance_sampling = _make_lazy_cuda_func("importance_sampling")
 searchsorted = _make_lazy_cuda_func("searchsorted")
 
+# render
+rendering_forward = _make_lazy_cuda_func("rendering_forward")
+rendering_backward = _make_lazy_cuda_func("rendering_backward")
+
 # camera
 opencv_lens_undistortion = _make_lazy_cuda_func("opencv_lens_undistortion")
 opencv_lens_undistortion_fisheye = _make_lazy_cuda_func(
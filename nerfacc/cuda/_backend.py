@@ -2,25 +2,31 @@
 Copyright (c) 2022 Ruilong Li, UC Berkeley.
 """
 
+import contextlib
 import glob
+import hashlib
+import importlib.util
 import json
 import os
 import shutil
-from subprocess import DEVNULL, call
+import subprocess
+import sys
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 from rich.console import Console
-from torch.utils.cpp_extension import _get_build_directory, load
 
 PATH = os.path.dirname(os.path.abspath(__file__))
 
 
 def cuda_toolkit_available():
     """Check if the nvcc is avaiable on the machine."""
-    try:
-        call(["nvcc"], stdout=DEVNULL, stderr=DEVNULL)
-        return True
-    except FileNotFoundError:
-        return False
+    return shutil.which("nvcc") is not None
 
 
 def cuda_toolkit_version():
@@ -37,53 +43,199 @@ def cuda_toolkit_version():
     return cuda_version
 
 
-name = "nerfacc_cuda"
-build_dir = _get_build_directory(name, verbose=False)
-extra_include_paths = []
-extra_cflags = ["-O3"]
-extra_cuda_cflags = ["-O3"]
+def jit_enabled() -> bool:
+    """JIT compilation can be disabled by setting `NERFACC_NO_JIT=1`."""
+    return os.getenv("NERFACC_NO_JIT", "0") != "1"
 
-_C = None
-sources = list(glob.glob(os.path.join(PATH, "csrc/*.cu"))) + list(
-    glob.glob(os.path.join(PATH, "csrc/*.cpp"))
-)
 
-try:
-    # try to import the compiled module (via setup.py)
-    from nerfacc import csrc as _C
-except ImportError:
-    # if failed, try with JIT compilation
+def _openmp_flags():
+    """Compiler flags to enable OpenMP for the CPU kernels (if torch has it)."""
+    from torch.__config__ import parallel_info
+
+    info = parallel_info()
+    if (
+        "backend: OpenMP" in info
+        and "OpenMP not found" not in info
+        and sys.platform != "darwin"
+    ):
+        return ["-DAT_PARALLEL_OPENMP", "-fopenmp"]
+    return []
+
+
+def _compiler_version(compiler: str) -> str:
+    """The version string of the host C++ compiler."""
+    try:
+        return subprocess.check_output(
+            [compiler, "--version"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return compiler
+
+
+def _cache_key(sources, headers, build_args) -> str:
+    """Hash of everything that affects the compiled extension: the sources,
+    the compiler flags and the versions of python, torch and the toolchain.
+    """
+    import torch
+
+    hasher = hashlib.sha256()
+    for path in sorted(sources) + sorted(headers):
+        hasher.update(os.path.relpath(path, PATH).encode())
+        with open(path, "rb") as f:
+            hasher.update(f.read())
+    toolchain = [
+        sys.version,
+        torch.__version__,
+        str(torch.version.cuda),
+        cuda_toolkit_version() if cuda_toolkit_available() else "",
+        _compiler_version(os.environ.get("CXX", "c++")),
+    ]
+    hasher.update(json.dumps([build_args, toolchain]).encode())
+    return hasher.hexdigest()
+
+
+def cache_dir() -> str:
+    """Root directory of the JIT builds. Can be set by `NERFACC_CACHE_DIR`."""
+    from torch.utils.cpp_extension import get_default_build_root
+
+    return os.getenv(
+        "NERFACC_CACHE_DIR", os.path.join(get_default_build_root(), "nerfacc")
+    )
+
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+    """An inter-process lock, so that only one process builds the extension."""
+    with open(path, "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _import_library(name: str, path: str):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _jit_load():
+    """JIT compile (or load the cached build of) the extension.
+
+    Builds are cached in `cache_dir()` under a hash of the sources, flags and
+    toolchain, so a change to any of them triggers a fresh build. A build
+    happens in a temporary directory which is renamed into place once it
+    succeeds, under a file lock: concurrent processes build only once, and a
+    crashed build never gets loaded.
+    """
+    from torch.utils.cpp_extension import LIB_EXT, load
+
+    cpu_sources = list(glob.glob(os.path.join(PATH, "csrc/*.cpp"))) + list(
+        glob.glob(os.path.join(PATH, "csrc/cpu/*.cpp"))
+    )
+    cuda_sources = list(glob.glob(os.path.join(PATH, "csrc/*.cu")))
+    headers = list(glob.glob(os.path.join(PATH, "csrc/include/*")))
     if cuda_toolkit_available():
-        if os.listdir(build_dir) != []:
-            # If the build exists, we assume the extension has been built
-            # and we can load it.
-
-            _C = load(
-                name=name,
-                sources=sources,
-                extra_cflags=extra_cflags,
-                extra_cuda_cflags=extra_cuda_cflags,
-                extra_include_paths=extra_include_paths,
-            )
-        else:
-            # Build from scratch. Remove the build directory just to be safe: pytorch jit might stuck
-            # if the build directory exists.
-            shutil.rmtree(build_dir)
-            with Console().status(
-                "[bold yellow]NerfAcc: Setting up CUDA (This may take a few minutes the first time)",
-                spinner="bouncingBall",
-            ):
-                _C = load(
+        name = "nerfacc_cuda"
+        sources = cuda_sources + cpu_sources
+        extra_cflags = ["-O3", "-DWITH_CUDA"] + _openmp_flags()
+        extra_cuda_cflags = ["-O3", "-DWITH_CUDA"]
+        message = "[bold yellow]NerfAcc: Setting up CUDA (This may take a few minutes the first time)"
+    else:
+        # Without the CUDA toolkit we still build the CPU kernels.
+        name = "nerfacc_cpu"
+        sources = cpu_sources
+        extra_cflags = ["-O3"] + _openmp_flags()
+        extra_cuda_cflags = None
+        message = "[bold yellow]NerfAcc: Setting up CPU kernels (This may take a minute the first time)"
+    extra_ldflags = ["-fopenmp"] if "-fopenmp" in extra_cflags else []
+
+    key = _cache_key(
+        sources, headers, [extra_cflags, extra_cuda_cflags, extra_ldflags]
+    )
+    # The module name has to be unique per build: python can not import two
+    # different libraries under the same name.
+    name = f"{name}_{key[:16]}"
+    root = cache_dir()
+    build_dir = os.path.join(root, name)
+    library = os.path.join(build_dir, name + LIB_EXT)
+    if os.path.exists(library):
+        return _import_library(name, library)
+
+    os.makedirs(root, exist_ok=True)
+    with _file_lock(build_dir + ".lock"):
+        # Another process may have finished the build while we waited.
+        if os.path.exists(library):
+            return _import_library(name, library)
+        tmp_dir = tempfile.mkdtemp(prefix=f".{name}.", dir=root)
+        os.chmod(tmp_dir, 0o755)
+        try:
+            with Console().status(message, spinner="bouncingBall"):
+                module = load(
                     name=name,
                     sources=sources,
                     extra_cflags=extra_cflags,
                     extra_cuda_cflags=extra_cuda_cflags,
-                    extra_include_paths=extra_include_paths,
+                    extra_include_paths=[],
+                    extra_ldflags=extra_ldflags,
+                    build_directory=tmp_dir,
+                    with_cuda=extra_cuda_cflags is not None,
                 )
-    else:
-        Console().print(
-            "[yellow]NerfAcc: No CUDA toolkit found. NerfAcc will be disabled.[/yellow]"
-        )
+            if os.path.exists(build_dir):
+                # a leftover of an interrupted publish.
+                shutil.rmtree(build_dir)
+            os.rename(tmp_dir, build_dir)
+        finally:
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+    return module
+
+
+_extension = None
+_extension_loaded = False
+_lock = threading.Lock()
+
+
+def load_extension():
+    """Load the compiled extension, or None if it is not available.
+
+    The extension is looked up on the first call only: first the module
+    compiled via setup.py, then (unless disabled) a JIT build. Nothing is
+    probed or compiled when `nerfacc` is imported.
+    """
+    global _extension, _extension_loaded
+    if _extension_loaded:
+        return _extension
+    with _lock:
+        if _extension_loaded:
+            return _extension
+        try:
+            # try to import the compiled module (via setup.py)
+            from nerfacc import csrc as _extension
+        except ImportError:
+            if jit_enabled():
+                try:
+                    _extension = _jit_load()
+                except Exception as e:  # pylint: disable=broad-except
+                    # e.g. no C++ compiler: other backends take over.
+                    Console().print(
+                        f"[yellow]NerfAcc: Failed to build the extension ({type(e).__name__}). "
+                        "Falling back to the pure PyTorch implementations where available.[/yellow]"
+                    )
+        _extension_loaded = True
+    return _extension
+
+
+def __getattr__(name):
+    # `_C` used to be compiled when importing this module. Keep it as a lazy
+    # alias of load_extension().
+    if name == "_C":
+        return load_extension()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
-__all__ = ["_C"]
+__all__ = ["load_extension"]
@@ -111,7 +111,7 @@ __global__ void opencv_lens_undistortion(
 }  // namespace
 
 
-torch::Tensor opencv_lens_undistortion(
+torch::Tensor opencv_lens_undistortion_cuda(
     const torch::Tensor& uv,      // [..., 2]
     const torch::Tensor& params,  // [..., 5] or [..., 12]
     const float eps,
@@ -146,7 +146,7 @@ torch::Tensor opencv_lens_undistortion(
     return uv_out;
 }
 
-torch::Tensor opencv_lens_undistortion_fisheye(
+torch::Tensor opencv_lens_undistortion_fisheye_cuda(
     const torch::Tensor& uv,      // [..., 2]
     const torch::Tensor& params,  // [..., 4]
     const float criteria_eps,
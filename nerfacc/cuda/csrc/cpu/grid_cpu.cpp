@@ -0,0 +1,765 @@
+/*
+ * Copyright (c) 2022 Ruilong Li, UC Berkeley.
+ */
+
+#include <cmath>
+#include <limits>
+
+#include "../include/data_spec.hpp"
+#include "../include/data_spec_packed_cpu.hpp"
+#include "../include/utils_cpu.hpp"
+
+namespace {
+namespace host {
+
+// Rays are expensive to traverse, so keep the tasks small.
+static constexpr int64_t TRAVERSE_GRAIN_SIZE = 16;
+
+inline float clampf(const float f, const float a, const float b)
+{
+    return fmaxf(a, fminf(f, b));
+}
+
+inline int32_t clampi(const int32_t f, const int32_t a, const int32_t b)
+{
+    return std::max(a, std::min(f, b));
+}
+
+// float -> int conversion that saturates like the CUDA one (NaN -> 0).
+inline int32_t float2int(const float f)
+{
+    if (std::isnan(f)) return 0;
+    if (f >= 2147483647.0f) return std::numeric_limits<int32_t>::max();
+    if (f <= -2147483648.0f) return std::numeric_limits<int32_t>::min();
+    return static_cast<int32_t>(f);
+}
+
+inline float _calc_dt(
+    const float t, const float cone_angle,
+    const float dt_min, const float dt_max)
+{
+    return clampf(t * cone_angle, dt_min, dt_max);
+}
+
+struct SingleRaySpec {
+    SingleRaySpec(
+        const float *rays_o, const float *rays_d, float tmin, float tmax) :
+        origin{rays_o[0], rays_o[1], rays_o[2]},
+        dir{rays_d[0], rays_d[1], rays_d[2]},
+        inv_dir{1.0f/rays_d[0], 1.0f/rays_d[1], 1.0f/rays_d[2]},
+        tmin{tmin},
+        tmax{tmax}
+    { }
+
+    float origin[3];
+    float dir[3];
+    float inv_dir[3];
+    float tmin;
+    float tmax;
+};
+
+// Same as device::ray_aabb_intersect() in utils_grid.cuh.
+inline bool ray_aabb_intersect(
+    const SingleRaySpec &ray, const float *aabb,
+    // outputs
+    float &tmin, float &tmax)
+{
+    for (int k = 0; k < 3; ++k) {
+        float tmin_temp, tmax_temp;
+        if (ray.inv_dir[k] >= 0) {
+            tmin_temp = (aabb[k] - ray.origin[k]) * ray.inv_dir[k];
+            tmax_temp = (aabb[k + 3] - ray.origin[k]) * ray.inv_dir[k];
+        } else {
+            tmin_temp = (aabb[k + 3] - ray.origin[k]) * ray.inv_dir[k];
+            tmax_temp = (aabb[k] - ray.origin[k]) * ray.inv_dir[k];
+        }
+        if (k == 0) {
+            tmin = tmin_temp;
+            tmax = tmax_temp;
+            continue;
+        }
+        if (tmin > tmax_temp || tmin_temp > tmax) return false;
+        if (tmin_temp > tmin) tmin = tmin_temp;
+        if (tmax_temp < tmax) tmax = tmax_temp;
+    }
+
+    if (tmax <= 0) return false;
+
+    tmin = fmaxf(tmin, ray.tmin);
+    tmax = fminf(tmax, ray.tmax);
+    return true;
+}
+
+// Same as device::setup_traversal() in utils_grid.cuh.
+inline void setup_traversal(
+    const SingleRaySpec &ray, const float tmin, const float tmax, const float eps,
+    const float *aabb, const int32_t *resolution,
+    // outputs
+    float *delta, float *tdist,
+    int32_t *step_index, int32_t *current_index, int32_t *final_index)
+{
+    for (int k = 0; k < 3; ++k) {
+        const float res = static_cast<float>(resolution[k]);
+        const float aabb_min = aabb[k];
+        const float aabb_max = aabb[k + 3];
+        const float voxel_size = (aabb_max - aabb_min) / res;
+        const float ray_start = ray.origin[k] + ray.dir[k] * (tmin + eps);
+        const float ray_end = ray.origin[k] + ray.dir[k] * (tmax - eps);
+
+        // get voxel index of start and end within grid
+        current_index[k] = clampi(
+            float2int((ray_start - aabb_min) / (aabb_max - aabb_min) * res),
+            0, resolution[k] - 1);
+        final_index[k] = clampi(
+            float2int((ray_end - aabb_min) / (aabb_max - aabb_min) * res),
+            0, resolution[k] - 1);
+
+        const int32_t start_index = current_index[k] + (ray.dir[k] > 0 ? 1 : 0);
+        const float tmax_k = ((aabb_min +
+            ((static_cast<float>(start_index) * voxel_size) - ray_start)) * ray.inv_dir[k]) + tmin;
+        tdist[k] = (ray.dir[k] == 0.0f) ? tmax : tmax_k;
+
+        const float step_float =
+            (ray.dir[k] == 0.0f) ? 0.0f : (ray.dir[k] > 0.0f ? 1.0f : -1.0f);
+        step_index[k] = static_cast<int32_t>(step_float);
+
+        const float delta_temp = voxel_size * ray.inv_dir[k] * step_float;
+        delta[k] = (ray.dir[k] == 0.0f) ? tmax : delta_temp;
+    }
+}
+
+// Same as device::single_traversal() in utils_grid.cuh.
+inline bool single_traversal(
+    float *tdist, int32_t *current_index,
+    const int32_t *overflow_index, const int32_t *step_index, const float *delta)
+{
+    int k;
+    if ((tdist[0] < tdist[1]) && (tdist[0] < tdist[2])) {
+        k = 0;  // X-axis traversal.
+    } else if (tdist[1] < tdist[2]) {
+        k = 1;  // Y-axis traversal.
+    } else {
+        k = 2;  // Z-axis traversal.
+    }
+    current_index[k] += step_index[k];
+    tdist[k] += delta[k];
+    return current_index[k] != overflow_index[k];
+}
+
+// Spread the lowest 21 bits of v to every third bit.
+inline uint64_t morton_spread(uint64_t v)
+{
+    v &= 0x1fffff;
+    v = (v | v << 32) & 0x1f00000000ffffull;
+    v = (v | v << 16) & 0x1f0000ff0000ffull;
+    v = (v | v << 8) & 0x100f00f00f00f00full;
+    v = (v | v << 4) & 0x10c30c30c30c30c3ull;
+    v = (v | v << 2) & 0x1249249249249249ull;
+    return v;
+}
+
+// Morton (Z-curve) code of a cell, the bits of x being the most significant.
+inline uint64_t morton_encode(const int32_t *index)
+{
+    return (morton_spread(index[0]) << 2) | (morton_spread(index[1]) << 1)
+        | morton_spread(index[2]);
+}
+
+// Occupancy of a cell, either from the dense binaries, from 8^3 bricks if
+// brick_table is given: brick_table [n_grids, resx/8, resy/8, resz/8] holds
+// the index of the brick of each block of cells in bricks [n_bricks, 8, 8, 8],
+// or a negative value if the block is empty, or from the bits of morton_bits
+// [n_grids, res^3 / 8], packed in Morton order, least significant bit first.
+inline bool is_occupied(
+    const int64_t level, const int32_t *index, const int32_t *resolution,
+    const bool *binaries, const int32_t *brick_table, const bool *bricks,
+    const uint8_t *morton_bits)
+{
+    if (morton_bits != nullptr) {
+        const int64_t n_bytes =
+            static_cast<int64_t>(resolution[0]) * resolution[1] * resolution[2] >> 3;
+        const uint64_t code = morton_encode(index);
+        return (morton_bits[level * n_bytes + (code >> 3)] >> (code & 7)) & 1;
+    }
+    if (brick_table == nullptr) {
+        return binaries[
+            static_cast<int64_t>(index[0]) * resolution[1] * resolution[2]
+            + index[1] * resolution[2]
+            + index[2]
+            + level * resolution[0] * resolution[1] * resolution[2]];
+    }
+    const int64_t bres[3] = {
+        resolution[0] >> 3, resolution[1] >> 3, resolution[2] >> 3};
+    const int32_t brick = brick_table[
+        (index[0] >> 3) * bres[1] * bres[2]
+        + (index[1] >> 3) * bres[2]
+        + (index[2] >> 3)
+        + level * bres[0] * bres[1] * bres[2]];
+    if (brick < 0) return false;
+    return bricks[
+        static_cast<int64_t>(brick) * 512
+        + (index[0] & 7) * 64 + (index[1] & 7) * 8 + (index[2] & 7)];
+}
+
+// Log2 of the size (1, 2, 4 or 8) of the largest empty block of cells that
+// contains an empty cell, from mips: the 2x, 4x and 8x OR-reduced dense
+// binaries [n_grids, resx/2^s, resy/2^s, resz/2^s], flattened one after
+// another for s = 1, 2, 3.
+inline int32_t empty_block_shift(
+    const int64_t level, const int32_t *index, const int32_t *resolution,
+    const int32_t n_grids, const bool *mips)
+{
+    if (mips == nullptr) return 0;
+    int64_t offsets[4] = {0, 0, 0, 0};
+    for (int32_t s = 1; s < 3; ++s) {
+        offsets[s + 1] = offsets[s] + n_grids
+            * static_cast<int64_t>(resolution[0] >> s)
+            * (resolution[1] >> s) * (resolution[2] >> s);
+    }
+    // from the coarsest to the finest mip.
+    for (int32_t s = 3; s > 0; --s) {
+        const int64_t res[3] = {
+            resolution[0] >> s, resolution[1] >> s, resolution[2] >> s};
+        const bool occupied = mips[
+            offsets[s]
+            + level * res[0] * res[1] * res[2]
+            + (index[0] >> s) * res[1] * res[2]
+            + (index[1] >> s) * res[2]
+            + (index[2] >> s)];
+        if (!occupied) return s;
+    }
+    return 0;
+}
+
+// Jump at once from an empty cell to the first cell past the empty block of
+// 2^shift cells around it, for a constant step size: the traversal state is
+// advanced as by the cell-by-cell single_traversal() calls, and t_last is
+// marched to the last step before the block exit. Returns false if the ray
+// leaves the grid within the block.
+inline bool jump_empty_block(
+    const int32_t shift, const float this_tmax, const float step_size,
+    float *tdist, int32_t *current_index,
+    const int32_t *overflow_index, const int32_t *step_index, const float *delta,
+    float &t_last)
+{
+    // the axis the ray leaves the block (or the grid) through, and when.
+    int32_t exit_axis = -1;
+    int32_t n_cross[3] = {0, 0, 0};
+    float t_exit = 0.0f;
+    for (int k = 0; k < 3; ++k) {
+        if (step_index[k] == 0) continue;
+        const int32_t block = current_index[k] >> shift;
+        const int32_t edge = step_index[k] > 0
+            ? std::min((block + 1) << shift, overflow_index[k])
+            : std::max((block << shift) - 1, overflow_index[k]);
+        n_cross[k] = (edge - current_index[k]) * step_index[k];
+        const float t = tdist[k] + static_cast<float>(n_cross[k] - 1) * delta[k];
+        // ties go to the last axis, as in single_traversal().
+        if (exit_axis < 0 || t <= t_exit) {
+            exit_axis = k;
+            t_exit = t;
+        }
+    }
+    if (exit_axis < 0) return false;
+
+    // march until t_mid is right after the exit of the last empty cell.
+    const float t_march = fminf(t_exit, this_tmax);
+    if (step_size <= 0.0f) {
+        t_last = t_march;
+    } else if (t_last + step_size * 0.5f < t_march) {
+        float n = ceilf((t_march - t_last - step_size * 0.5f) / step_size);
+        // guard against the rounding of the division.
+        if (n > 1.0f && t_last + (n - 1.0f) * step_size + step_size * 0.5f >= t_march)
+            n -= 1.0f;
+        t_last += n * step_size;
+        while (t_last + step_size * 0.5f < t_march) t_last += step_size;
+    }
+
+    // the other axes are crossed as long as they come before the exit.
+    for (int k = 0; k < 3; ++k) {
+        if (k == exit_axis || step_index[k] == 0 || tdist[k] >= t_exit) continue;
+        const int32_t m = std::min(
+            n_cross[k] - 1,
+            static_cast<int32_t>(ceilf((t_exit - tdist[k]) / delta[k])));
+        current_index[k] += m * step_index[k];
+        tdist[k] += static_cast<float>(m) * delta[k];
+    }
+    current_index[exit_axis] += n_cross[exit_axis] * step_index[exit_axis];
+    tdist[exit_axis] = t_exit + delta[exit_axis];
+    return current_index[exit_axis] != overflow_index[exit_axis];
+}
+
+/* Ray traversal within multiple voxel grids for a single ray.
+
+This is a line-by-line port of device::traverse_grids_kernel() in grid.cu, see
+there for the details. Rays are independent, so the caller distributes them
+over threads.
+*/
+inline void traverse_grids_single_ray(
+    const int64_t tid,
+    // rays
+    const float *rays_o,  // [n_rays, 3]
+    const float *rays_d,  // [n_rays, 3]
+    const bool *rays_mask, // [n_rays]
+    // grids
+    const int32_t n_grids,
+    const int32_t *resolution,
+    const bool *binaries, // [n_grids, resx, resy, resz]
+    const int32_t *brick_table, // [n_grids, resx/8, resy/8, resz/8]
+    const bool *bricks,   // [n_bricks, 8, 8, 8]
+    const uint8_t *morton_bits, // [n_grids, res^3 / 8]
+    const bool *mips,     // 2x, 4x and 8x OR-reduced binaries
+    const float *aabbs,   // [n_grids, 6]
+    // sorted intersections
+    const bool *hits,         // [n_rays, n_grids]
+    const float *t_sorted,    // [n_rays, n_grids * 2]
+    const int64_t *t_indices, // [n_rays, n_grids * 2]
+    // options
+    const float *near_planes,  // [n_rays]
+    const float *far_planes,   // [n_rays]
+    const float step_size,
+    const float cone_angle,
+    const int32_t traverse_steps_limit,
+    // outputs
+    const bool first_pass,
+    PackedRaySegmentsSpec &intervals,
+    PackedRaySegmentsSpec &samples,
+    float *terminate_planes)
+{
+    const float eps = 1e-6f;
+
+    if (rays_mask != nullptr && !rays_mask[tid]) return;
+
+    // skip rays that are empty.
+    if (intervals.chunk_cnts != nullptr)
+        if (!first_pass && intervals.chunk_cnts[tid] == 0) return;
+    if (samples.chunk_cnts != nullptr)
+        if (!first_pass && samples.chunk_cnts[tid] == 0) return;
+
+    int64_t chunk_start = 0, chunk_start_bin = 0;
+    if (!first_pass) {
+        if (intervals.chunk_cnts != nullptr)
+            chunk_start = intervals.chunk_starts[tid];
+        if (samples.chunk_cnts != nullptr)
+            chunk_start_bin = samples.chunk_starts[tid];
+    }
+    const float near_plane = near_planes[tid];
+    const float far_plane = far_planes[tid];
+
+    const SingleRaySpec ray = SingleRaySpec(
+        rays_o + tid * 3, rays_d + tid * 3, near_plane, far_plane);
+
+    const int64_t base_hits = tid * n_grids;
+    const int64_t base_t_sorted = tid * n_grids * 2;
+
+    // loop over all intersections along the ray.
+    int64_t n_intervals = 0;
+    int64_t n_samples = 0;
+    float t_last = near_plane;
+    bool continuous = false;
+    for (int64_t i = base_t_sorted; i < base_t_sorted + n_grids * 2 - 1; i++) {
+        // whether this is the entering or leaving for this level of grid.
+        const bool is_entering = t_indices[i] < n_grids;
+        int64_t level = t_indices[i] % n_grids;
+
+        if (!hits[base_hits + level]) {
+            continue; // this grid is not hit.
+        }
+        if (!is_entering) {
+            // we are leaving this grid. Are we inside the next grid?
+            const bool next_is_entering = t_indices[i + 1] < n_grids;
+            if (next_is_entering) continue; // we are outside next grid.
+            level = t_indices[i + 1] % n_grids;
+            if (!hits[base_hits + level]) {
+                continue; // this grid is not hit.
+            }
+        }
+
+        const float this_tmin = fmaxf(t_sorted[i], near_plane);
+        const float this_tmax = fminf(t_sorted[i + 1], far_plane);
+        if (this_tmin >= this_tmax) continue; // this interval is invalid. e.g. (0.0f, 0.0f)
+
+        if (!continuous) {
+            if (step_size <= 0.0f) { // march to this_tmin.
+                t_last = this_tmin;
+            } else {
+                const float dt = _calc_dt(t_last, cone_angle, step_size, 1e10f);
+                while (true) { // march until t_mid is right after this_tmin.
+                    if (t_last + dt * 0.5f >= this_tmin) break;
+                    t_last += dt;
+                }
+            }
+        }
+
+        // init: pre-compute variables needed for traversal
+        float tdist[3], delta[3];
+        int32_t step_index[3], current_index[3], final_index[3];
+        setup_traversal(
+            ray, this_tmin, this_tmax, eps,
+            aabbs + level * 6, resolution,
+            // outputs
+            delta, tdist, step_index, current_index, final_index);
+
+        const int32_t overflow_index[3] = {
+            final_index[0] + step_index[0],
+            final_index[1] + step_index[1],
+            final_index[2] + step_index[2]};
+        while (traverse_steps_limit <= 0 || n_samples < traverse_steps_limit) {
+            float t_traverse = std::min(tdist[0], std::min(tdist[1], tdist[2]));
+            t_traverse = fminf(t_traverse, this_tmax);
+            if (!is_occupied(level, current_index, resolution, binaries, brick_table, bricks, morton_bits)) {
+                // skip the cell that is empty, and the other cells of the
+                // largest empty block around it without looking them up.
+                const int32_t shift = empty_block_shift(
+                    level, current_index, resolution, n_grids, mips);
+                if (shift > 0 && cone_angle == 0.0f) {
+                    // the step size is constant: jump over the block at once.
+                    continuous = false;
+                    if (!jump_empty_block(
+                            shift, this_tmax, step_size, tdist, current_index,
+                            overflow_index, step_index, delta, t_last))
+                        break;
+                    continue;
+                }
+                // with cone stepping dt grows with t, so march cell by cell.
+                const int32_t block[3] = {
+                    current_index[0] >> shift,
+                    current_index[1] >> shift,
+                    current_index[2] >> shift};
+                bool overflow = false, left_block = false;
+                while (true) {
+                    if (step_size <= 0.0f) { // march to t_traverse.
+                        t_last = t_traverse;
+                    } else {
+                        const float dt = _calc_dt(t_last, cone_angle, step_size, 1e10f);
+                        while (true) { // march until t_mid is right after t_traverse.
+                            if (t_last + dt * 0.5f >= t_traverse) break;
+                            t_last += dt;
+                        }
+                    }
+                    if (shift == 0) break;
+                    if (!single_traversal(tdist, current_index, overflow_index, step_index, delta)) {
+                        overflow = true;
+                        break;
+                    }
+                    if ((current_index[0] >> shift) != block[0]
+                        || (current_index[1] >> shift) != block[1]
+                        || (current_index[2] >> shift) != block[2]) {
+                        left_block = true;
+                        break;
+                    }
+                    t_traverse = std::min(tdist[0], std::min(tdist[1], tdist[2]));
+                    t_traverse = fminf(t_traverse, this_tmax);
+                }
+                continuous = false;
+                if (overflow) break;
+                // the traversal already stepped into the next cell.
+                if (left_block) continue;
+            } else {
+                // this cell is not empty, so we need to traverse it.
+                while (traverse_steps_limit <= 0 || n_samples < traverse_steps_limit) {
+                    float t_next;
+                    if (step_size <= 0.0f) {
+                        t_next = t_traverse;
+                    } else {  // march until t_mid is right after t_traverse.
+                        const float dt = _calc_dt(t_last, cone_angle, step_size, 1e10f);
+                        if (t_last + dt * 0.5f >= t_traverse) break;
+                        t_next = t_last + dt;
+                    }
+
+                    // writeout the interval.
+                    if (intervals.chunk_cnts != nullptr) {
+                        if (!continuous) {
+                            if (!first_pass) {  // left side of the intervel
+                                const int64_t idx = chunk_start + n_intervals;
+                                intervals.vals[idx] = t_last;
+                                intervals.ray_indices[idx] = tid;
+                                intervals.is_left[idx] = true;
+                            }
+                            n_intervals++;
+                            if (!first_pass) {  // right side of the intervel
+                                const int64_t idx = chunk_start + n_intervals;
+                                intervals.vals[idx] = t_next;
+                                intervals.ray_indices[idx] = tid;
+                                intervals.is_right[idx] = true;
+                            }
+                            n_intervals++;
+                        } else {
+                            if (!first_pass) {  // right side of the intervel
+                                const int64_t idx = chunk_start + n_intervals;
+                                intervals.vals[idx] = t_next;
+                                intervals.ray_indices[idx] = tid;
+                                intervals.is_left[idx - 1] = true;
+                                intervals.is_right[idx] = true;
+                            }
+                            n_intervals++;
+                        }
+                    }
+
+                    // writeout the sample.
+                    if (samples.chunk_cnts != nullptr) {
+                        if (!first_pass) {
+                            const int64_t idx = chunk_start_bin + n_samples;
+                            samples.vals[idx] = (t_next + t_last) * 0.5f;
+                            samples.ray_indices[idx] = tid;
+                            samples.is_valid[idx] = true;
+                        }
+                    }
+
+                    n_samples++;
+                    continuous = true;
+                    t_last = t_next;
+                    if (t_next >= t_traverse) break;
+                }
+            }
+
+            if (!single_traversal(tdist, current_index, overflow_index, step_index, delta)) {
+                break;
+            }
+        }
+    }
+    if (terminate_planes != nullptr)
+        terminate_planes[tid] = t_last;
+
+    if (intervals.chunk_cnts != nullptr)
+        intervals.chunk_cnts[tid] = n_intervals;
+    if (samples.chunk_cnts != nullptr)
+        samples.chunk_cnts[tid] = n_samples;
+}
+
+inline void traverse_grids_all_rays(
+    const torch::Tensor &rays_o,
+    const torch::Tensor &rays_d,
+    const bool *rays_mask,
+    const torch::Tensor &binaries,
+    const torch::Tensor &brick_table,
+    const torch::Tensor &bricks,
+    const torch::Tensor &morton_bits,
+    const torch::Tensor &mips,
+    const torch::Tensor &aabbs,
+    const torch::Tensor &t_sorted,
+    const torch::Tensor &t_indices,
+    const torch::Tensor &hits,
+    const torch::Tensor &near_planes,
+    const torch::Tensor &far_planes,
+    const float step_size,
+    const float cone_angle,
+    const int32_t traverse_steps_limit,
+    const bool first_pass,
+    RaySegmentsSpec &intervals,
+    RaySegmentsSpec &samples,
+    float *terminate_planes)
+{
+    const int64_t n_rays = rays_o.size(0);
+    const bool use_bricks = brick_table.numel() > 0;
+    const bool use_morton = morton_bits.numel() > 0;
+    int32_t n_grids, resolution[3];
+    if (use_morton) {
+        // cubic grids with a power of 2 resolution.
+        n_grids = morton_bits.size(0);
+        int32_t res = 1;
+        while (static_cast<int64_t>(res) * res * res < morton_bits.size(1) * 8)
+            res <<= 1;
+        resolution[0] = resolution[1] = resolution[2] = res;
+    } else if (use_bricks) {
+        n_grids = brick_table.size(0);
+        for (int i = 0; i < 3; ++i)
+            resolution[i] = static_cast<int32_t>(brick_table.size(i + 1) * 8);
+    } else {
+        n_grids = binaries.size(0);
+        for (int i = 0; i < 3; ++i)
+            resolution[i] = static_cast<int32_t>(binaries.size(i + 1));
+    }
+
+    PackedRaySegmentsSpec packed_intervals(intervals);
+    PackedRaySegmentsSpec packed_samples(samples);
+    const float *rays_o_ptr = rays_o.data_ptr<float>();
+    const float *rays_d_ptr = rays_d.data_ptr<float>();
+    const bool *binaries_ptr =
+        use_bricks || use_morton ? nullptr : binaries.data_ptr<bool>();
+    const int32_t *brick_table_ptr = use_bricks ? brick_table.data_ptr<int32_t>() : nullptr;
+    const bool *bricks_ptr = use_bricks ? bricks.data_ptr<bool>() : nullptr;
+    const uint8_t *morton_bits_ptr =
+        use_morton ? morton_bits.data_ptr<uint8_t>() : nullptr;
+    const bool *mips_ptr = mips.numel() > 0 ? mips.data_ptr<bool>() : nullptr;
+    const float *aabbs_ptr = aabbs.data_ptr<float>();
+    const bool *hits_ptr = hits.data_ptr<bool>();
+    const float *t_sorted_ptr = t_sorted.data_ptr<float>();
+    const int64_t *t_indices_ptr = t_indices.data_ptr<int64_t>();
+    const float *near_planes_ptr = near_planes.data_ptr<float>();
+    const float *far_planes_ptr = far_planes.data_ptr<float>();
+
+    // parallelize over rays
+    at::parallel_for(0, n_rays, TRAVERSE_GRAIN_SIZE, [&](int64_t begin, int64_t end) {
+        for (int64_t tid = begin; tid < end; ++tid) {
+            traverse_grids_single_ray(
+                tid,
+                rays_o_ptr, rays_d_ptr, rays_mask,
+                n_grids, resolution, binaries_ptr, brick_table_ptr, bricks_ptr, morton_bits_ptr, mips_ptr, aabbs_ptr,
+                hits_ptr, t_sorted_ptr, t_indices_ptr,
+                near_planes_ptr, far_planes_ptr,
+                step_size, cone_angle, traverse_steps_limit,
+                first_pass, packed_intervals, packed_samples, terminate_planes);
+        }
+    });
+}
+
+} // namespace host
+} // namespace
+
+
+std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids_cpu(
+    // rays
+    const torch::Tensor rays_o, // [n_rays, 3]
+    const torch::Tensor rays_d, // [n_rays, 3]
+    const torch::Tensor rays_mask,   // [n_rays]
+    // grids
+    const torch::Tensor binaries,  // [n_grids, resx, resy, resz]
+    const torch::Tensor brick_table,  // [n_grids, resx/8, resy/8, resz/8] or empty
+    const torch::Tensor bricks,  // [n_bricks, 8, 8, 8]
+    const torch::Tensor morton_bits,  // [n_grids, res^3 / 8] or empty
+    const torch::Tensor mips,  // 2x, 4x and 8x OR-reduced binaries or empty
+    const torch::Tensor aabbs,     // [n_grids, 6]
+    // intersections
+    const torch::Tensor t_sorted,  // [n_rays, n_grids * 2]
+    const torch::Tensor t_indices,  // [n_rays, n_grids * 2]
+    const torch::Tensor hits,    // [n_rays, n_grids]
+    // options
+    const torch::Tensor near_planes,
+    const torch::Tensor far_planes,
+    const float step_size,
+    const float cone_angle,
+    const bool compute_intervals,
+    const bool compute_samples,
+    const bool compute_terminate_planes,
+    const int32_t traverse_steps_limit, // <= 0 means no limit
+    const bool over_allocate) // over allocate the memory for intervals and samples
+{
+    CHECK_CPU_INPUT(rays_o);
+    CHECK_CPU_INPUT(rays_d);
+    CHECK_CPU_INPUT(rays_mask);
+    CHECK_CPU_INPUT(binaries);
+    CHECK_CPU_INPUT(brick_table);
+    CHECK_CPU_INPUT(bricks);
+    CHECK_CPU_INPUT(morton_bits);
+    CHECK_CPU_INPUT(mips);
+    CHECK_CPU_INPUT(aabbs);
+    CHECK_CPU_INPUT(t_sorted);
+    CHECK_CPU_INPUT(t_indices);
+    CHECK_CPU_INPUT(hits);
+    CHECK_CPU_INPUT(near_planes);
+    CHECK_CPU_INPUT(far_planes);
+    if (over_allocate) {
+        TORCH_CHECK(traverse_steps_limit > 0, "traverse_steps_limit must be > 0 when over_allocate is true");
+    }
+
+    const int64_t n_rays = rays_o.size(0);
+
+    // outputs
+    RaySegmentsSpec intervals, samples;
+    torch::Tensor terminate_planes;
+    if (compute_terminate_planes)
+        terminate_planes = torch::empty({n_rays}, rays_o.options());
+    float *terminate_planes_ptr =
+        compute_terminate_planes ? terminate_planes.data_ptr<float>() : nullptr;
+
+    if (over_allocate) {
+        // over allocate the memory so that we can traverse the grids in a single pass.
+        if (compute_intervals) {
+            intervals.chunk_cnts = torch::full({n_rays}, traverse_steps_limit * 2, rays_o.options().dtype(torch::kLong)) * rays_mask;
+            intervals.memalloc_data_from_chunk(true, true);
+        }
+        if (compute_samples) {
+            samples.chunk_cnts = torch::full({n_rays}, traverse_steps_limit, rays_o.options().dtype(torch::kLong)) * rays_mask;
+            samples.memalloc_data_from_chunk(false, true, true);
+        }
+
+        host::traverse_grids_all_rays(
+            rays_o, rays_d, rays_mask.data_ptr<bool>(),
+            binaries, brick_table, bricks, morton_bits, mips, aabbs, t_sorted, t_indices, hits,
+            near_planes, far_planes, step_size, cone_angle, traverse_steps_limit,
+            false, intervals, samples, terminate_planes_ptr);
+
+        // update the chunk starts with the actual chunk_cnts from traversal.
+        intervals.compute_chunk_start();
+        samples.compute_chunk_start();
+    } else {
+        // To allocate the accurate memory we need to traverse the grids twice.
+        // The first pass is to count the number of segments along each ray.
+        // The second pass is to fill the segments.
+        if (compute_intervals)
+            intervals.chunk_cnts = torch::empty({n_rays}, rays_o.options().dtype(torch::kLong));
+        if (compute_samples)
+            samples.chunk_cnts = torch::empty({n_rays}, rays_o.options().dtype(torch::kLong));
+        host::traverse_grids_all_rays(
+            rays_o, rays_d, nullptr /* rays_mask */,
+            binaries, brick_table, bricks, morton_bits, mips, aabbs, t_sorted, t_indices, hits,
+            near_planes, far_planes, step_size, cone_angle, traverse_steps_limit,
+            true, intervals, samples, nullptr /* terminate_planes */);
+
+        // second pass to record the segments.
+        if (compute_intervals)
+            intervals.memalloc_data_from_chunk(true, true);
+        if (compute_samples)
+            samples.memalloc_data_from_chunk(false, false, true);
+        host::traverse_grids_all_rays(
+            rays_o, rays_d, nullptr /* rays_mask */,
+            binaries, brick_table, bricks, morton_bits, mips, aabbs, t_sorted, t_indices, hits,
+            near_planes, far_planes, step_size, cone_angle, traverse_steps_limit,
+            false, intervals, samples, terminate_planes_ptr);
+    }
+
+    return {intervals, samples, terminate_planes};
+}
+
+
+std::vector<torch::Tensor> ray_aabb_intersect_cpu(
+    const torch::Tensor rays_o, // [n_rays, 3]
+    const torch::Tensor rays_d, // [n_rays, 3]
+    const torch::Tensor aabbs,  // [n_aabbs, 6]
+    const float near_plane,
+    const float far_plane,
+    const float miss_value)
+{
+    CHECK_CPU_INPUT(rays_o);
+    CHECK_CPU_INPUT(rays_d);
+    CHECK_CPU_INPUT(aabbs);
+
+    const int64_t n_rays = rays_o.size(0);
+    const int64_t n_aabbs = aabbs.size(0);
+
+    // outputs
+    torch::Tensor t_mins = torch::empty({n_rays, n_aabbs}, rays_o.options());
+    torch::Tensor t_maxs = torch::empty({n_rays, n_aabbs}, rays_o.options());
+    torch::Tensor hits = torch::empty({n_rays, n_aabbs}, rays_d.options().dtype(torch::kBool));
+
+    const float *rays_o_ptr = rays_o.data_ptr<float>();
+    const float *rays_d_ptr = rays_d.data_ptr<float>();
+    const float *aabbs_ptr = aabbs.data_ptr<float>();
+    float *t_mins_ptr = t_mins.data_ptr<float>();
+    float *t_maxs_ptr = t_maxs.data_ptr<float>();
+    bool *hits_ptr = hits.data_ptr<bool>();
+
+    // parallelize over rays
+    at::parallel_for(0, n_rays, host::ray_grain_size(n_rays, n_rays * n_aabbs), [&](int64_t begin, int64_t end) {
+        for (int64_t ray_id = begin; ray_id < end; ++ray_id) {
+            const host::SingleRaySpec ray = host::SingleRaySpec(
+                rays_o_ptr + ray_id * 3, rays_d_ptr + ray_id * 3, near_plane, far_plane);
+            for (int64_t aabb_id = 0; aabb_id < n_aabbs; ++aabb_id) {
+                const int64_t tid = ray_id * n_aabbs + aabb_id;
+                float t_min, t_max;
+                const bool hit = host::ray_aabb_intersect(ray, aabbs_ptr + aabb_id * 6, t_min, t_max);
+                if (hit) {
+                    t_mins_ptr[tid] = t_min;
+                    t_maxs_ptr[tid] = t_max;
+                } else {
+                    t_mins_ptr[tid] = miss_value;
+                    t_maxs_ptr[tid] = miss_value;
+                }
+                hits_ptr[tid] = hit;
+            }
+        }
+    });
+
+    return {t_mins, t_maxs, hits};
+}
@@ -0,0 +1,290 @@
+/*
+ * Copyright (c) 2022 Ruilong Li, UC Berkeley.
+ */
+
+#include "../include/data_spec.hpp"
+#include "../include/data_spec_packed_cpu.hpp"
+#include "../include/utils_cpu.hpp"
+
+namespace {
+namespace host {
+
+// Same as device::upper_bound() in pdf.cu.
+template <typename scalar_t>
+inline int64_t upper_bound(const scalar_t *data_ss, int64_t start, int64_t end, const scalar_t val)
+{
+    while (start < end)
+    {
+        const int64_t mid = start + ((end - start) >> 1);
+        const scalar_t mid_val = data_ss[mid];
+        if (!(mid_val > val)) start = mid + 1;
+        else end = mid;
+    }
+    return start;
+}
+
+inline int64_t binary_search_chunk_id(
+    const int64_t item_id,
+    const int64_t n_chunks,
+    const int64_t *chunk_starts)
+{
+    int64_t start = 0;
+    int64_t end = n_chunks;
+    while (start < end)
+    {
+        const int64_t mid = start + ((end - start) >> 1);
+        const int64_t mid_val = chunk_starts[mid];
+        if (!(mid_val > item_id)) start = mid + 1;
+        else end = mid;
+    }
+    return start;
+}
+
+// The range [base, last] of the edges of a ray.
+inline void ray_edge_range(
+    const PackedRaySegmentsSpec &segments, const int64_t ray_id,
+    int64_t &base, int64_t &last)
+{
+    if (segments.is_batched) {
+        base = ray_id * segments.n_edges_per_ray;
+        last = base + segments.n_edges_per_ray - 1;
+    } else {
+        base = segments.chunk_starts[ray_id];
+        last = base + segments.chunk_cnts[ray_id] - 1;
+    }
+}
+
+/* Inverse transform sampling followed by computing the intervals of a ray.
+
+Same as device::importance_sampling_kernel() and device::compute_intervels_kernel()
+in pdf.cu, but a single thread handles all the samples of a ray, so the two
+steps are fused. The stratified jittering is one random number per ray.
+*/
+inline void importance_sampling_single_ray(
+    const int64_t ray_id,
+    const PackedRaySegmentsSpec &ray_segments,
+    const float *cdfs,
+    const float *biases,  // [n_rays] or nullptr
+    PackedRaySegmentsSpec &samples,
+    PackedRaySegmentsSpec &intervals)
+{
+    int64_t n_samples, base_sample, base_out;
+    if (samples.is_batched) {
+        n_samples = samples.n_edges_per_ray;
+        base_sample = ray_id * samples.n_edges_per_ray;
+        base_out = ray_id * intervals.n_edges_per_ray;
+    } else {
+        n_samples = samples.chunk_cnts[ray_id];
+        base_sample = samples.chunk_starts[ray_id];
+        base_out = intervals.chunk_starts[ray_id];
+    }
+    if (n_samples <= 0) return;
+
+    int64_t base, last;
+    ray_edge_range(ray_segments, ray_id, base, last);
+
+    // step 1. compute the samples.
+    const float u_floor = cdfs[base];
+    const float u_ceil = cdfs[last];
+    const float u_step = (u_ceil - u_floor) / n_samples;
+    const float bias = biases != nullptr ? biases[ray_id] : 0.5f;
+    for (int64_t sid = 0; sid < n_samples; ++sid) {
+        const int64_t idx = base_sample + sid;
+        const float u = u_floor + (sid + bias) * u_step;
+
+        // searchsorted with "right" option:
+        // i.e. cdfs[p - 1] <= u < cdfs[p]
+        const int64_t p = upper_bound<float>(cdfs, base, last, u);
+        const int64_t p0 = std::max(std::min(p - 1, last), base);
+        const int64_t p1 = std::max(std::min(p, last), base);
+
+        const float u_lower = cdfs[p0];
+        const float u_upper = cdfs[p1];
+        const float t_lower = ray_segments.vals[p0];
+        const float t_upper = ray_segments.vals[p1];
+
+        float t;
+        if (u_upper - u_lower < 1e-10f) {
+            t = (t_lower + t_upper) * 0.5f;
+        } else {
+            const float scaling = (t_upper - t_lower) / (u_upper - u_lower);
+            t = (u - u_lower) * scaling + t_lower;
+        }
+        samples.vals[idx] = t;
+        if (!samples.is_batched) samples.ray_indices[idx] = ray_id;
+    }
+
+    // step 2. compute the intervals: n_samples + 1 edges.
+    const float t_min = ray_segments.vals[base];
+    const float t_max = ray_segments.vals[last];
+    const float *ts = samples.vals + base_sample;
+    for (int64_t sid = 0; sid <= n_samples; ++sid) {
+        float t_edge;
+        if (n_samples == 1) {
+            // a single sample spans the whole ray.
+            t_edge = sid == 0 ? t_min : t_max;
+        } else if (sid == 0) {
+            const float half_width = (ts[1] - ts[0]) * 0.5f;
+            t_edge = fmaxf(ts[0] - half_width, t_min);
+        } else if (sid == n_samples) {
+            const float half_width = (ts[sid - 1] - ts[sid - 2]) * 0.5f;
+            t_edge = fminf(ts[sid - 1] + half_width, t_max);
+        } else {
+            t_edge = (ts[sid] + ts[sid - 1]) * 0.5f;
+        }
+        const int64_t idx = base_out + sid;
+        intervals.vals[idx] = t_edge;
+        if (!intervals.is_batched) {
+            intervals.ray_indices[idx] = ray_id;
+            intervals.is_left[idx] = sid < n_samples;
+            intervals.is_right[idx] = sid > 0;
+        }
+    }
+}
+
+inline void importance_sampling_all_rays(
+    RaySegmentsSpec &ray_segments,
+    const torch::Tensor &cdfs,
+    const bool stratified,
+    RaySegmentsSpec &samples,
+    RaySegmentsSpec &intervals)
+{
+    PackedRaySegmentsSpec packed_segments(ray_segments);
+    PackedRaySegmentsSpec packed_samples(samples);
+    PackedRaySegmentsSpec packed_intervals(intervals);
+
+    const int64_t n_rays = packed_samples.is_batched
+        ? packed_samples.n_edges / std::max<int64_t>(packed_samples.n_edges_per_ray, 1)
+        : packed_samples.n_rays;
+
+    // For jittering: one random number per ray from the default CPU generator.
+    torch::Tensor biases;
+    if (stratified) biases = torch::rand({n_rays}, cdfs.options());
+    const float *biases_ptr = stratified ? biases.data_ptr<float>() : nullptr;
+    const float *cdfs_ptr = cdfs.data_ptr<float>();
+
+    // parallelize over rays
+    at::parallel_for(0, n_rays, ray_grain_size(n_rays, packed_samples.n_edges), [&](int64_t begin, int64_t end) {
+        for (int64_t ray_id = begin; ray_id < end; ++ray_id) {
+            importance_sampling_single_ray(
+                ray_id, packed_segments, cdfs_ptr, biases_ptr,
+                packed_samples, packed_intervals);
+        }
+    });
+}
+
+} // namespace host
+} // namespace
+
+
+// Return flattend RaySegmentsSpec because n_intervels_per_ray is defined per ray.
+std::vector<RaySegmentsSpec> importance_sampling_cpu(
+    RaySegmentsSpec ray_segments,       // [..., n_edges_per_ray] or flattend
+    torch::Tensor cdfs,                 // [..., n_edges_per_ray] or flattend
+    torch::Tensor n_intervels_per_ray,  // [...] or flattend
+    bool stratified)
+{
+    ray_segments.check();
+    CHECK_CPU_INPUT(ray_segments.vals);
+    CHECK_CPU_INPUT(cdfs);
+    CHECK_CPU_INPUT(n_intervels_per_ray);
+    TORCH_CHECK(cdfs.numel() == ray_segments.vals.numel());
+
+    // output samples
+    RaySegmentsSpec samples;
+    samples.chunk_cnts = n_intervels_per_ray.to(n_intervels_per_ray.options().dtype(torch::kLong));
+    samples.memalloc_data_from_chunk(false, false); // no need boolen masks, no need to zero init.
+
+    // output ray segments
+    RaySegmentsSpec intervals;
+    intervals.chunk_cnts = (
+      (samples.chunk_cnts + 1) * (samples.chunk_cnts > 0)).to(samples.chunk_cnts.options());
+    intervals.memalloc_data_from_chunk(true, true); // need the boolen masks, need to zero init.
+
+    host::importance_sampling_all_rays(ray_segments, cdfs, stratified, samples, intervals);
+
+    return {intervals, samples};
+}
+
+
+// Return batched RaySegmentsSpec because n_intervels_per_ray is same across rays.
+std::vector<RaySegmentsSpec> importance_sampling_cpu(
+    RaySegmentsSpec ray_segments,       // [..., n_edges_per_ray] or flattend
+    torch::Tensor cdfs,                 // [..., n_edges_per_ray] or flattend
+    int64_t n_intervels_per_ray,
+    bool stratified)
+{
+    ray_segments.check();
+    CHECK_CPU_INPUT(ray_segments.vals);
+    CHECK_CPU_INPUT(cdfs);
+    TORCH_CHECK(cdfs.numel() == ray_segments.vals.numel());
+
+    RaySegmentsSpec samples, intervals;
+    if (ray_segments.vals.ndimension() > 1){  // batched input
+        auto data_size = ray_segments.vals.sizes().vec();
+        data_size.back() = n_intervels_per_ray;
+        samples.vals = torch::empty(data_size, cdfs.options());
+        data_size.back() = n_intervels_per_ray + 1;
+        intervals.vals = torch::empty(data_size, cdfs.options());
+    } else { // flattend input
+        int64_t n_rays = ray_segments.chunk_cnts.numel();
+        samples.vals = torch::empty({n_rays, n_intervels_per_ray}, cdfs.options());
+        intervals.vals = torch::empty({n_rays, n_intervels_per_ray + 1}, cdfs.options());
+    }
+
+    host::importance_sampling_all_rays(ray_segments, cdfs, stratified, samples, intervals);
+
+    return {intervals, samples};
+}
+
+
+// Find two indices {left, right} for each item in query,
+// such that: key.vals[left] <= query.vals < key.vals[right]
+std::vector<torch::Tensor> searchsorted_cpu(
+    RaySegmentsSpec query,
+    RaySegmentsSpec key)
+{
+    query.check();
+    key.check();
+    CHECK_CPU_INPUT(query.vals);
+    CHECK_CPU_INPUT(key.vals);
+
+    // outputs
+    const int64_t n_edges = query.vals.numel();
+
+    torch::Tensor ids_left = torch::empty(
+        query.vals.sizes(), query.vals.options().dtype(torch::kLong));
+    torch::Tensor ids_right = torch::empty(
+        query.vals.sizes(), query.vals.options().dtype(torch::kLong));
+
+    host::PackedRaySegmentsSpec packed_query(query);
+    host::PackedRaySegmentsSpec packed_key(key);
+    int64_t *ids_left_ptr = ids_left.data_ptr<int64_t>();
+    int64_t *ids_right_ptr = ids_right.data_ptr<int64_t>();
+
+    // parallelize over outputs
+    at::parallel_for(0, n_edges, at::internal::GRAIN_SIZE / 16, [&](int64_t begin, int64_t end) {
+        for (int64_t tid = begin; tid < end; ++tid) {
+            int64_t ray_id;
+            if (packed_query.is_batched) {
+                ray_id = tid / packed_query.n_edges_per_ray;
+            } else if (packed_query.ray_indices == nullptr) {
+                ray_id = host::binary_search_chunk_id(tid, packed_query.n_rays, packed_query.chunk_starts) - 1;
+            } else {
+                ray_id = packed_query.ray_indices[tid];
+            }
+
+            int64_t base, last;
+            host::ray_edge_range(packed_key, ray_id, base, last);
+
+            // searchsorted with "right" option:
+            // i.e. key.vals[p - 1] <= query.vals[tid] < key.vals[p]
+            const int64_t p = host::upper_bound<float>(packed_key.vals, base, last, packed_query.vals[tid]);
+            const int64_t offset = packed_query.is_batched ? base : 0;
+            ids_left_ptr[tid] = std::max(std::min(p - 1, last), base) - offset;
+            ids_right_ptr[tid] = std::max(std::min(p, last), base) - offset;
+        }
+    });
+
+    return {ids_left, ids_right};
+}
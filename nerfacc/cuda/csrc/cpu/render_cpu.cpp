@@ -0,0 +1,290 @@
+/*
+ * Copyright (c) 2022 Ruilong Li, UC Berkeley.
+ */
+
+#include <ATen/AccumulateType.h>
+
+#include "../include/utils_cpu.hpp"
+
+namespace {
+namespace host {
+
+/* Volume rendering of the samples of each ray in a single pass.
+ *
+ * With densities (`from_alpha == false`):
+ *     alpha_i = 1 - exp(-sigma_i * delta_i),
+ *     T_i = exp(-sum_{j<i} sigma_j * delta_j),
+ * with opacities (`from_alpha == true`):
+ *     T_i = prod_{j<i} (1 - alpha_j),
+ * and then w_i = T_i * alpha_i is accumulated into the colors (w_i * c_i),
+ * the opacities (w_i) and the depths (w_i * (t_start_i + t_end_i) / 2).
+ */
+template <typename scalar_t>
+void render_forward(
+    const int64_t n_rays,
+    const int64_t n_samples,
+    const int64_t n_dims,
+    const int64_t *chunk_starts,
+    const int64_t *chunk_cnts,
+    const scalar_t *t_starts,
+    const scalar_t *t_ends,
+    const scalar_t *densities,
+    const scalar_t *values,
+    const bool from_alpha,
+    scalar_t *colors,
+    scalar_t *opacities,
+    scalar_t *depths,
+    scalar_t *weights,
+    scalar_t *trans,
+    scalar_t *alphas)
+{
+    using acc_t = at::acc_type<scalar_t, false>;
+
+    at::parallel_for(0, n_rays, ray_grain_size(n_rays, n_samples), [&](int64_t begin, int64_t end) {
+        std::vector<acc_t> color(n_dims);
+        for (int64_t ray_id = begin; ray_id < end; ++ray_id) {
+            const int64_t start = chunk_starts[ray_id];
+            const int64_t cnt = chunk_cnts[ray_id];
+
+            std::fill(color.begin(), color.end(), acc_t(0));
+            acc_t opacity = 0, depth = 0;
+            // from_alpha: the running transmittance; else: the running optical depth.
+            acc_t carry = from_alpha ? acc_t(1) : acc_t(0);
+            for (int64_t i = start; i < start + cnt; ++i) {
+                acc_t T, alpha;
+                if (from_alpha) {
+                    alpha = densities[i];
+                    T = carry;
+                    carry *= acc_t(1) - alpha;
+                } else {
+                    const acc_t sigma_dt = acc_t(densities[i]) * (t_ends[i] - t_starts[i]);
+                    alpha = acc_t(1) - std::exp(-sigma_dt);
+                    T = std::exp(-carry);
+                    carry += sigma_dt;
+                    alphas[i] = static_cast<scalar_t>(alpha);
+                }
+                const acc_t w = T * alpha;
+                trans[i] = static_cast<scalar_t>(T);
+                weights[i] = static_cast<scalar_t>(w);
+
+                const scalar_t *value = values + i * n_dims;
+                for (int64_t d = 0; d < n_dims; ++d) color[d] += w * value[d];
+                opacity += w;
+                depth += w * (t_starts[i] + t_ends[i]) * acc_t(0.5);
+            }
+
+            for (int64_t d = 0; d < n_dims; ++d)
+                colors[ray_id * n_dims + d] = static_cast<scalar_t>(color[d]);
+            opacities[ray_id] = static_cast<scalar_t>(opacity);
+            depths[ray_id] = static_cast<scalar_t>(depth);
+        }
+    });
+}
+
+/* Gradient of render_forward() w.r.t. the densities (or opacities) and values.
+ *
+ * With G^w_i, G^T_i and G^a_i the total gradients w.r.t. w_i, T_i and alpha_i
+ * (including the gradients through w_i = T_i * alpha_i):
+ *     dL/dsigma_k = delta_k * (G^a_k * (1 - alpha_k) - sum_{i>k} G^T_i * T_i),
+ *     dL/dalpha_k = G^a_k - T_k * R_k,
+ *     R_k = G^T_{k+1} + (1 - alpha_{k+1}) * R_{k+1},   R_{last} = 0.
+ * Both are computed with a reverse scan over the samples of a ray, without
+ * dividing by (1 - alpha).
+ */
+template <typename scalar_t>
+void render_backward(
+    const int64_t n_rays,
+    const int64_t n_samples,
+    const int64_t n_dims,
+    const int64_t *chunk_starts,
+    const int64_t *chunk_cnts,
+    const scalar_t *t_starts,
+    const scalar_t *t_ends,
+    const scalar_t *values,
+    const scalar_t *trans,
+    const scalar_t *alphas,
+    const scalar_t *grad_colors,     // [n_rays, n_dims]
+    const scalar_t *grad_opacities,  // [n_rays]
+    const scalar_t *grad_depths,     // [n_rays]
+    const scalar_t *grad_weights,    // [n_samples] or nullptr
+    const scalar_t *grad_trans,      // [n_samples] or nullptr
+    const scalar_t *grad_alphas,     // [n_samples] or nullptr
+    const bool from_alpha,
+    scalar_t *grad_densities,
+    scalar_t *grad_values)
+{
+    using acc_t = at::acc_type<scalar_t, false>;
+
+    at::parallel_for(0, n_rays, ray_grain_size(n_rays, n_samples), [&](int64_t begin, int64_t end) {
+        for (int64_t ray_id = begin; ray_id < end; ++ray_id) {
+            const int64_t start = chunk_starts[ray_id];
+            const int64_t cnt = chunk_cnts[ray_id];
+            const scalar_t *grad_color = grad_colors + ray_id * n_dims;
+
+            acc_t carry = 0;
+            for (int64_t i = start + cnt - 1; i >= start; --i) {
+                const acc_t T = trans[i];
+                const acc_t alpha = alphas[i];
+                const acc_t w = T * alpha;
+
+                const scalar_t *value = values + i * n_dims;
+                acc_t grad_w = grad_opacities[ray_id]
+                    + grad_depths[ray_id] * (t_starts[i] + t_ends[i]) * acc_t(0.5);
+                for (int64_t d = 0; d < n_dims; ++d) {
+                    grad_w += acc_t(grad_color[d]) * value[d];
+                    grad_values[i * n_dims + d] = static_cast<scalar_t>(w * grad_color[d]);
+                }
+                if (grad_weights != nullptr) grad_w += grad_weights[i];
+
+                acc_t grad_alpha = grad_w * T;
+                acc_t grad_T = grad_w * alpha;
+                if (grad_alphas != nullptr) grad_alpha += grad_alphas[i];
+                if (grad_trans != nullptr) grad_T += grad_trans[i];
+
+                if (from_alpha) {
+                    // carry == R_i
+                    grad_densities[i] = static_cast<scalar_t>(grad_alpha - T * carry);
+                    carry = grad_T + (acc_t(1) - alpha) * carry;
+                } else {
+                    // carry == sum_{j>i} G^T_j * T_j
+                    const acc_t grad_sigma_dt = grad_alpha * (acc_t(1) - alpha) - carry;
+                    grad_densities[i] = static_cast<scalar_t>(grad_sigma_dt * (t_ends[i] - t_starts[i]));
+                    carry += grad_T * T;
+                }
+            }
+        }
+    });
+}
+
+inline void check_render_inputs(
+    const torch::Tensor &chunk_starts,
+    const torch::Tensor &chunk_cnts,
+    const torch::Tensor &t_starts,
+    const torch::Tensor &t_ends,
+    const torch::Tensor &values)
+{
+    CHECK_CPU_INPUT(chunk_starts);
+    CHECK_CPU_INPUT(chunk_cnts);
+    CHECK_CPU_INPUT(t_starts);
+    CHECK_CPU_INPUT(t_ends);
+    CHECK_CPU_INPUT(values);
+    TORCH_CHECK(chunk_starts.scalar_type() == torch::kLong, "chunk_starts must be int64");
+    TORCH_CHECK(chunk_cnts.scalar_type() == torch::kLong, "chunk_cnts must be int64");
+    TORCH_CHECK(chunk_starts.size(0) == chunk_cnts.size(0));
+    TORCH_CHECK(t_starts.ndimension() == 1);
+    TORCH_CHECK(t_ends.sizes() == t_starts.sizes());
+    TORCH_CHECK(values.ndimension() == 2 && values.size(0) == t_starts.size(0));
+}
+
+template <typename scalar_t>
+inline const scalar_t *optional_data_ptr(const c10::optional<torch::Tensor> &x)
+{
+    if (!x.has_value() || !x->defined()) return nullptr;
+    CHECK_CPU_INPUT((*x));
+    return x->data_ptr<scalar_t>();
+}
+
+} // namespace host
+} // namespace
+
+
+// Returns {colors, opacities, depths, weights, trans, alphas}. The depths are
+// not normalized by the opacities. The alphas are only computed (and returned)
+// with densities.
+std::vector<torch::Tensor> rendering_forward_cpu(
+    torch::Tensor chunk_starts,  // [n_rays]
+    torch::Tensor chunk_cnts,    // [n_rays]
+    torch::Tensor t_starts,      // [n_samples]
+    torch::Tensor t_ends,        // [n_samples]
+    torch::Tensor densities,     // [n_samples] sigmas, or alphas if from_alpha
+    torch::Tensor values,        // [n_samples, D]
+    bool from_alpha)
+{
+    host::check_render_inputs(chunk_starts, chunk_cnts, t_starts, t_ends, values);
+    CHECK_CPU_INPUT(densities);
+    TORCH_CHECK(densities.sizes() == t_starts.sizes());
+
+    const int64_t n_rays = chunk_cnts.size(0);
+    const int64_t n_samples = t_starts.size(0);
+    const int64_t n_dims = values.size(1);
+
+    torch::Tensor colors = torch::empty({n_rays, n_dims}, values.options());
+    torch::Tensor opacities = torch::empty({n_rays, 1}, values.options());
+    torch::Tensor depths = torch::empty({n_rays, 1}, values.options());
+    torch::Tensor weights = torch::empty_like(densities);
+    torch::Tensor trans = torch::empty_like(densities);
+    torch::Tensor alphas = from_alpha ? torch::Tensor() : torch::empty_like(densities);
+
+    AT_DISPATCH_FLOATING_TYPES(values.scalar_type(), "rendering_forward_cpu", [&] {
+        host::render_forward<scalar_t>(
+            n_rays, n_samples, n_dims,
+            chunk_starts.data_ptr<int64_t>(),
+            chunk_cnts.data_ptr<int64_t>(),
+            t_starts.data_ptr<scalar_t>(),
+            t_ends.data_ptr<scalar_t>(),
+            densities.data_ptr<scalar_t>(),
+            values.data_ptr<scalar_t>(),
+            from_alpha,
+            colors.data_ptr<scalar_t>(),
+            opacities.data_ptr<scalar_t>(),
+            depths.data_ptr<scalar_t>(),
+            weights.data_ptr<scalar_t>(),
+            trans.data_ptr<scalar_t>(),
+            from_alpha ? nullptr : alphas.data_ptr<scalar_t>());
+    });
+    return {colors, opacities, depths, weights, trans, alphas};
+}
+
+// Returns {grad_densities, grad_values}.
+std::vector<torch::Tensor> rendering_backward_cpu(
+    torch::Tensor chunk_starts,    // [n_rays]
+    torch::Tensor chunk_cnts,      // [n_rays]
+    torch::Tensor t_starts,        // [n_samples]
+    torch::Tensor t_ends,          // [n_samples]
+    torch::Tensor values,          // [n_samples, D]
+    torch::Tensor trans,           // [n_samples]
+    torch::Tensor alphas,          // [n_samples]
+    torch::Tensor grad_colors,     // [n_rays, D]
+    torch::Tensor grad_opacities,  // [n_rays, 1]
+    torch::Tensor grad_depths,     // [n_rays, 1]
+    c10::optional<torch::Tensor> grad_weights,  // [n_samples]
+    c10::optional<torch::Tensor> grad_trans,    // [n_samples]
+    c10::optional<torch::Tensor> grad_alphas,   // [n_samples]
+    bool from_alpha)
+{
+    host::check_render_inputs(chunk_starts, chunk_cnts, t_starts, t_ends, values);
+    CHECK_CPU_INPUT(trans);
+    CHECK_CPU_INPUT(alphas);
+    CHECK_CPU_INPUT(grad_colors);
+    CHECK_CPU_INPUT(grad_opacities);
+    CHECK_CPU_INPUT(grad_depths);
+
+    const int64_t n_rays = chunk_cnts.size(0);
+    const int64_t n_samples = t_starts.size(0);
+    const int64_t n_dims = values.size(1);
+
+    torch::Tensor grad_densities = torch::empty_like(trans);
+    torch::Tensor grad_values = torch::empty_like(values);
+
+    AT_DISPATCH_FLOATING_TYPES(values.scalar_type(), "rendering_backward_cpu", [&] {
+        host::render_backward<scalar_t>(
+            n_rays, n_samples, n_dims,
+            chunk_starts.data_ptr<int64_t>(),
+            chunk_cnts.data_ptr<int64_t>(),
+            t_starts.data_ptr<scalar_t>(),
+            t_ends.data_ptr<scalar_t>(),
+            values.data_ptr<scalar_t>(),
+            trans.data_ptr<scalar_t>(),
+            alphas.data_ptr<scalar_t>(),
+            grad_colors.data_ptr<scalar_t>(),
+            grad_opacities.data_ptr<scalar_t>(),
+            grad_depths.data_ptr<scalar_t>(),
+            host::optional_data_ptr<scalar_t>(grad_weights),
+            host::optional_data_ptr<scalar_t>(grad_trans),
+            host::optional_data_ptr<scalar_t>(grad_alphas),
+            from_alpha,
+            grad_densities.data_ptr<scalar_t>(),
+            grad_values.data_ptr<scalar_t>());
+    });
+    return {grad_densities, grad_values};
+}
@@ -0,0 +1,313 @@
+/*
+ * Copyright (c) 2022 Ruilong Li, UC Berkeley.
+ */
+
+#include <ATen/AccumulateType.h>
+
+#include "../include/utils_cpu.hpp"
+
+namespace {
+namespace host {
+
+inline void check_scan_inputs(
+    const torch::Tensor &chunk_starts,
+    const torch::Tensor &chunk_cnts,
+    const torch::Tensor &inputs)
+{
+    CHECK_CPU_INPUT(chunk_starts);
+    CHECK_CPU_INPUT(chunk_cnts);
+    CHECK_CPU_INPUT(inputs);
+    TORCH_CHECK(chunk_starts.ndimension() == 1);
+    TORCH_CHECK(chunk_cnts.ndimension() == 1);
+    TORCH_CHECK(inputs.ndimension() == 1);
+    TORCH_CHECK(chunk_starts.size(0) == chunk_cnts.size(0));
+    TORCH_CHECK(chunk_starts.scalar_type() == torch::kLong, "chunk_starts must be int64");
+    TORCH_CHECK(chunk_cnts.scalar_type() == torch::kLong, "chunk_cnts must be int64");
+}
+
+/* Scan (sum or product) within each chunk of a flattened tensor.
+ *
+ * Each chunk is scanned sequentially by a single thread, and the chunks are
+ * distributed over threads with at::parallel_for. With `reverse` the chunk is
+ * scanned from its last element to its first, which is what the backward pass
+ * of the sum scans needs.
+ */
+template <typename scalar_t, bool is_prod>
+void chunk_scan(
+    const int64_t n_rays,
+    const int64_t n_edges,
+    const int64_t *chunk_starts,
+    const int64_t *chunk_cnts,
+    const scalar_t *inputs,
+    const bool exclusive,
+    const bool reverse,
+    const bool normalize,
+    scalar_t *outputs)
+{
+    using acc_t = at::acc_type<scalar_t, false>;
+    const acc_t init = is_prod ? acc_t(1) : acc_t(0);
+
+    at::parallel_for(0, n_rays, ray_grain_size(n_rays, n_edges), [&](int64_t begin, int64_t end) {
+        for (int64_t ray_id = begin; ray_id < end; ++ray_id) {
+            const int64_t start = chunk_starts[ray_id];
+            const int64_t cnt = chunk_cnts[ray_id];
+            if (cnt <= 0) continue;
+
+            acc_t total = init;
+            for (int64_t k = 0; k < cnt; ++k) {
+                const int64_t i = reverse ? start + cnt - 1 - k : start + k;
+                if (exclusive) {
+                    outputs[i] = static_cast<scalar_t>(total);
+                }
+                total = is_prod ? total * inputs[i] : total + inputs[i];
+                if (!exclusive) {
+                    outputs[i] = static_cast<scalar_t>(total);
+                }
+            }
+
+            // Normalize with the total value: should only be used by scan_sum
+            if (normalize) {
+                const acc_t denom = std::max<acc_t>(total, acc_t(1e-10));
+                for (int64_t i = start; i < start + cnt; ++i) {
+                    outputs[i] = static_cast<scalar_t>(outputs[i] / denom);
+                }
+            }
+        }
+    });
+}
+
+/* Gradient of the product scans within each chunk.
+ *
+ * For the inclusive product y_j = x_0 * ... * x_j we have
+ *     dL/dx_i = (x_0 * ... * x_{i-1}) * R_i,
+ *     R_i = g_i + x_{i+1} * R_{i+1},   R_{last} = g_{last}.
+ * For the exclusive product y_j = x_0 * ... * x_{j-1} we have
+ *     dL/dx_i = y_i * S_i,
+ *     S_i = g_{i+1} + x_{i+1} * S_{i+1},   S_{last} = 0.
+ *
+ * Unlike the CUDA kernels, this never divides by the inputs, so the gradient
+ * stays exact when some of the inputs are zero.
+ */
+template <typename scalar_t>
+void chunk_prod_backward(
+    const int64_t n_rays,
+    const int64_t n_edges,
+    const int64_t *chunk_starts,
+    const int64_t *chunk_cnts,
+    const scalar_t *inputs,
+    const scalar_t *outputs,
+    const scalar_t *grad_outputs,
+    const bool exclusive,
+    scalar_t *grad_inputs)
+{
+    using acc_t = at::acc_type<scalar_t, false>;
+
+    at::parallel_for(0, n_rays, ray_grain_size(n_rays, n_edges), [&](int64_t begin, int64_t end) {
+        for (int64_t ray_id = begin; ray_id < end; ++ray_id) {
+            const int64_t start = chunk_starts[ray_id];
+            const int64_t cnt = chunk_cnts[ray_id];
+            if (cnt <= 0) continue;
+            const int64_t last = start + cnt - 1;
+
+            acc_t carry = exclusive ? acc_t(0) : acc_t(grad_outputs[last]);
+            for (int64_t i = last; i >= start; --i) {
+                if (i < last) {
+                    carry = exclusive
+                        ? grad_outputs[i + 1] + inputs[i + 1] * carry
+                        : grad_outputs[i] + inputs[i + 1] * carry;
+                }
+                // product of all the inputs before i.
+                const acc_t prefix = exclusive
+                    ? acc_t(outputs[i])
+                    : (i == start ? acc_t(1) : acc_t(outputs[i - 1]));
+                grad_inputs[i] = static_cast<scalar_t>(prefix * carry);
+            }
+        }
+    });
+}
+
+} // namespace host
+} // namespace
+
+
+torch::Tensor inclusive_sum_cpu(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs,
+    bool normalize,
+    bool backward)
+{
+    host::check_scan_inputs(chunk_starts, chunk_cnts, inputs);
+    if (backward)
+        TORCH_CHECK(!normalize, "backward does not support normalize yet.");
+
+    int64_t n_rays = chunk_cnts.size(0);
+    int64_t n_edges = inputs.size(0);
+
+    torch::Tensor outputs = torch::empty_like(inputs);
+    if (n_edges == 0) {
+        return outputs;
+    }
+
+    AT_DISPATCH_FLOATING_TYPES(inputs.scalar_type(), "inclusive_sum_cpu", [&] {
+        host::chunk_scan<scalar_t, false>(
+            n_rays, n_edges,
+            chunk_starts.data_ptr<int64_t>(),
+            chunk_cnts.data_ptr<int64_t>(),
+            inputs.data_ptr<scalar_t>(),
+            false, backward, normalize,
+            outputs.data_ptr<scalar_t>());
+    });
+    return outputs;
+}
+
+torch::Tensor exclusive_sum_cpu(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs,
+    bool normalize,
+    bool backward)
+{
+    host::check_scan_inputs(chunk_starts, chunk_cnts, inputs);
+    if (backward)
+        TORCH_CHECK(!normalize, "backward does not support normalize yet.");
+
+    int64_t n_rays = chunk_cnts.size(0);
+    int64_t n_edges = inputs.size(0);
+
+    torch::Tensor outputs = torch::empty_like(inputs);
+    if (n_edges == 0) {
+        return outputs;
+    }
+
+    AT_DISPATCH_FLOATING_TYPES(inputs.scalar_type(), "exclusive_sum_cpu", [&] {
+        host::chunk_scan<scalar_t, false>(
+            n_rays, n_edges,
+            chunk_starts.data_ptr<int64_t>(),
+            chunk_cnts.data_ptr<int64_t>(),
+            inputs.data_ptr<scalar_t>(),
+            true, backward, normalize,
+            outputs.data_ptr<scalar_t>());
+    });
+    return outputs;
+}
+
+torch::Tensor inclusive_prod_forward_cpu(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs)
+{
+    host::check_scan_inputs(chunk_starts, chunk_cnts, inputs);
+
+    int64_t n_rays = chunk_cnts.size(0);
+    int64_t n_edges = inputs.size(0);
+
+    torch::Tensor outputs = torch::empty_like(inputs);
+    if (n_edges == 0) {
+        return outputs;
+    }
+
+    AT_DISPATCH_FLOATING_TYPES(inputs.scalar_type(), "inclusive_prod_forward_cpu", [&] {
+        host::chunk_scan<scalar_t, true>(
+            n_rays, n_edges,
+            chunk_starts.data_ptr<int64_t>(),
+            chunk_cnts.data_ptr<int64_t>(),
+            inputs.data_ptr<scalar_t>(),
+            false, false, false,
+            outputs.data_ptr<scalar_t>());
+    });
+    return outputs;
+}
+
+torch::Tensor inclusive_prod_backward_cpu(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs,
+    torch::Tensor outputs,
+    torch::Tensor grad_outputs)
+{
+    host::check_scan_inputs(chunk_starts, chunk_cnts, inputs);
+    CHECK_CPU_INPUT(outputs);
+    CHECK_CPU_INPUT(grad_outputs);
+
+    int64_t n_rays = chunk_cnts.size(0);
+    int64_t n_edges = inputs.size(0);
+
+    torch::Tensor grad_inputs = torch::empty_like(grad_outputs);
+    if (n_edges == 0) {
+        return grad_inputs;
+    }
+
+    AT_DISPATCH_FLOATING_TYPES(inputs.scalar_type(), "inclusive_prod_backward_cpu", [&] {
+        host::chunk_prod_backward<scalar_t>(
+            n_rays, n_edges,
+            chunk_starts.data_ptr<int64_t>(),
+            chunk_cnts.data_ptr<int64_t>(),
+            inputs.data_ptr<scalar_t>(),
+            outputs.data_ptr<scalar_t>(),
+            grad_outputs.data_ptr<scalar_t>(),
+            false,
+            grad_inputs.data_ptr<scalar_t>());
+    });
+    return grad_inputs;
+}
+
+torch::Tensor exclusive_prod_forward_cpu(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs)
+{
+    host::check_scan_inputs(chunk_starts, chunk_cnts, inputs);
+
+    int64_t n_rays = chunk_cnts.size(0);
+    int64_t n_edges = inputs.size(0);
+
+    torch::Tensor outputs = torch::empty_like(inputs);
+    if (n_edges == 0) {
+        return outputs;
+    }
+
+    AT_DISPATCH_FLOATING_TYPES(inputs.scalar_type(), "exclusive_prod_forward_cpu", [&] {
+        host::chunk_scan<scalar_t, true>(
+            n_rays, n_edges,
+            chunk_starts.data_ptr<int64_t>(),
+            chunk_cnts.data_ptr<int64_t>(),
+            inputs.data_ptr<scalar_t>(),
+            true, false, false,
+            outputs.data_ptr<scalar_t>());
+    });
+    return outputs;
+}
+
+torch::Tensor exclusive_prod_backward_cpu(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs,
+    torch::Tensor outputs,
+    torch::Tensor grad_outputs)
+{
+    host::check_scan_inputs(chunk_starts, chunk_cnts, inputs);
+    CHECK_CPU_INPUT(outputs);
+    CHECK_CPU_INPUT(grad_outputs);
+
+    int64_t n_rays = chunk_cnts.size(0);
+    int64_t n_edges = inputs.size(0);
+
+    torch::Tensor grad_inputs = torch::empty_like(grad_outputs);
+    if (n_edges == 0) {
+        return grad_inputs;
+    }
+
+    AT_DISPATCH_FLOATING_TYPES(inputs.scalar_type(), "exclusive_prod_backward_cpu", [&] {
+        host::chunk_prod_backward<scalar_t>(
+            n_rays, n_edges,
+            chunk_starts.data_ptr<int64_t>(),
+            chunk_cnts.data_ptr<int64_t>(),
+            inputs.data_ptr<scalar_t>(),
+            outputs.data_ptr<scalar_t>(),
+            grad_outputs.data_ptr<scalar_t>(),
+            true,
+            grad_inputs.data_ptr<scalar_t>());
+    });
+    return grad_inputs;
+}
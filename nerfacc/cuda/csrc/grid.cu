@@ -27,6 +27,157 @@ inline __device__ float _calc_dt(
     return clamp(t * cone_angle, dt_min, dt_max);
 }
 
+// Spread the lowest 21 bits of v to every third bit.
+inline __device__ uint64_t morton_spread(uint64_t v)
+{
+    v &= 0x1fffff;
+    v = (v | v << 32) & 0x1f00000000ffffull;
+    v = (v | v << 16) & 0x1f0000ff0000ffull;
+    v = (v | v << 8) & 0x100f00f00f00f00full;
+    v = (v | v << 4) & 0x10c30c30c30c30c3ull;
+    v = (v | v << 2) & 0x1249249249249249ull;
+    return v;
+}
+
+// Morton (Z-curve) code of a cell, the bits of x being the most significant.
+inline __device__ uint64_t morton_encode(const int3 index)
+{
+    return (morton_spread(index.x) << 2) | (morton_spread(index.y) << 1)
+        | morton_spread(index.z);
+}
+
+// Occupancy of a cell, either from the dense binaries, from 8^3 bricks if
+// brick_table is given: brick_table [n_grids, resx/8, resy/8, resz/8] holds
+// the index of the brick of each block of cells in bricks [n_bricks, 8, 8, 8],
+// or a negative value if the block is empty, or from the bits of morton_bits
+// [n_grids, res^3 / 8], packed in Morton order, least significant bit first.
+inline __device__ bool is_occupied(
+    const int64_t level, const int3 index, const int3 resolution,
+    const bool *binaries, const int32_t *brick_table, const bool *bricks,
+    const uint8_t *morton_bits)
+{
+    if (morton_bits != nullptr) {
+        const int64_t n_bytes =
+            static_cast<int64_t>(resolution.x) * resolution.y * resolution.z >> 3;
+        const uint64_t code = morton_encode(index);
+        return (morton_bits[level * n_bytes + (code >> 3)] >> (code & 7)) & 1;
+    }
+    if (brick_table == nullptr) {
+        return binaries[
+            static_cast<int64_t>(index.x) * resolution.y * resolution.z
+            + index.y * resolution.z
+            + index.z
+            + level * resolution.x * resolution.y * resolution.z];
+    }
+    const int64_t bresx = resolution.x >> 3;
+    const int64_t bresy = resolution.y >> 3;
+    const int64_t bresz = resolution.z >> 3;
+    const int32_t brick = brick_table[
+        (index.x >> 3) * bresy * bresz
+        + (index.y >> 3) * bresz
+        + (index.z >> 3)
+        + level * bresx * bresy * bresz];
+    if (brick < 0) return false;
+    return bricks[
+        static_cast<int64_t>(brick) * 512
+        + (index.x & 7) * 64 + (index.y & 7) * 8 + (index.z & 7)];
+}
+
+// Log2 of the size (1, 2, 4 or 8) of the largest empty block of cells that
+// contains an empty cell, from mips: the 2x, 4x and 8x OR-reduced dense
+// binaries [n_grids, resx/2^s, resy/2^s, resz/2^s], flattened one after
+// another for s = 1, 2, 3.
+inline __device__ int32_t empty_block_shift(
+    const int64_t level, const int3 index, const int3 resolution,
+    const int32_t n_grids, const bool *mips)
+{
+    if (mips == nullptr) return 0;
+    int64_t offsets[4] = {0, 0, 0, 0};
+    for (int32_t s = 1; s < 3; ++s) {
+        offsets[s + 1] = offsets[s] + n_grids
+            * static_cast<int64_t>(resolution.x >> s)
+            * (resolution.y >> s) * (resolution.z >> s);
+    }
+    // from the coarsest to the finest mip.
+    for (int32_t s = 3; s > 0; --s) {
+        const int64_t resx = resolution.x >> s;
+        const int64_t resy = resolution.y >> s;
+        const int64_t resz = resolution.z >> s;
+        const bool occupied = mips[
+            offsets[s]
+            + level * resx * resy * resz
+            + (index.x >> s) * resy * resz
+            + (index.y >> s) * resz
+            + (index.z >> s)];
+        if (!occupied) return s;
+    }
+    return 0;
+}
+
+// Jump at once from an empty cell to the first cell past the empty block of
+// 2^shift cells around it, for a constant step size: the traversal state is
+// advanced as by the cell-by-cell single_traversal() calls, and t_last is
+// marched to the last step before the block exit. Returns false if the ray
+// leaves the grid within the block.
+inline __device__ bool jump_empty_block(
+    const int32_t shift, const float this_tmax, const float step_size,
+    float3 &tdist3, int3 &current_index3,
+    const int3 overflow_index3, const int3 step_index3, const float3 delta3,
+    float &t_last)
+{
+    float *tdist = &tdist3.x;
+    int32_t *current_index = &current_index3.x;
+    const int32_t *overflow_index = &overflow_index3.x;
+    const int32_t *step_index = &step_index3.x;
+    const float *delta = &delta3.x;
+
+    // the axis the ray leaves the block (or the grid) through, and when.
+    int32_t exit_axis = -1;
+    int32_t n_cross[3] = {0, 0, 0};
+    float t_exit = 0.0f;
+    for (int k = 0; k < 3; ++k) {
+        if (step_index[k] == 0) continue;
+        const int32_t block = current_index[k] >> shift;
+        const int32_t edge = step_index[k] > 0
+            ? min((block + 1) << shift, overflow_index[k])
+            : max((block << shift) - 1, overflow_index[k]);
+        n_cross[k] = (edge - current_index[k]) * step_index[k];
+        const float t = tdist[k] + static_cast<float>(n_cross[k] - 1) * delta[k];
+        // ties go to the last axis, as in single_traversal().
+        if (exit_axis < 0 || t <= t_exit) {
+            exit_axis = k;
+            t_exit = t;
+        }
+    }
+    if (exit_axis < 0) return false;
+
+    // march until t_mid is right after the exit of the last empty cell.
+    const float t_march = fminf(t_exit, this_tmax);
+    if (step_size <= 0.0f) {
+        t_last = t_march;
+    } else if (t_last + step_size * 0.5f < t_march) {
+        float n = ceilf((t_march - t_last - step_size * 0.5f) / step_size);
+        // guard against the rounding of the division.
+        if (n > 1.0f && t_last + (n - 1.0f) * step_size + step_size * 0.5f >= t_march)
+            n -= 1.0f;
+        t_last += n * step_size;
+        while (t_last + step_size * 0.5f < t_march) t_last += step_size;
+    }
+
+    // the other axes are crossed as long as they come before the exit.
+    for (int k = 0; k < 3; ++k) {
+        if (k == exit_axis || step_index[k] == 0 || tdist[k] >= t_exit) continue;
+        const int32_t m = min(
+            n_cross[k] - 1,
+            static_cast<int32_t>(ceilf((t_exit - tdist[k]) / delta[k])));
+        current_index[k] += m * step_index[k];
+        tdist[k] += static_cast<float>(m) * delta[k];
+    }
+    current_index[exit_axis] += n_cross[exit_axis] * step_index[exit_axis];
+    tdist[exit_axis] = t_exit + delta[exit_axis];
+    return current_index[exit_axis] != overflow_index[exit_axis];
+}
+
 /* Ray traversal within multiple voxel grids. 
 
 About rays:
@@ -75,6 +226,10 @@ __global__ void traverse_grids_kernel(
     int32_t n_grids,
     int3 resolution,
     bool *binaries, // [n_grids, resx, resy, resz]
+    int32_t *brick_table, // [n_grids, resx/8, resy/8, resz/8]
+    bool *bricks,   // [n_bricks, 8, 8, 8]
+    uint8_t *morton_bits, // [n_grids, res^3 / 8]
+    bool *mips,     // 2x, 4x and 8x OR-reduced binaries
     float *aabbs,   // [n_grids, 6]
     // sorted intersections
     bool *hits,         // [n_rays, n_grids]
@@ -184,25 +339,54 @@ __global__ void traverse_grids_kernel(
             while (traverse_steps_limit <= 0 || n_samples < traverse_steps_limit) {
                 float t_traverse = min(tdist.x, min(tdist.y, tdist.z));
                 t_traverse = fminf(t_traverse, this_tmax);
-                int64_t cell_id = (
-                    current_index.x * resolution.y * resolution.z
-                    + current_index.y * resolution.z
-                    + current_index.z
-                    + level * resolution.x * resolution.y * resolution.z
-                );
-
-                if (!binaries[cell_id]) {
-                    // skip the cell that is empty.
-                    if (step_size <= 0.0f) { // march to t_traverse.
-                        t_last = t_traverse;
-                    } else {
-                        float dt = _calc_dt(t_last, cone_angle, step_size, 1e10f);
-                        while (true) { // march until t_mid is right after t_traverse.
-                            if (t_last + dt * 0.5f >= t_traverse) break;
-                            t_last += dt;
+                if (!is_occupied(level, current_index, resolution, binaries, brick_table, bricks, morton_bits)) {
+                    // skip the cell that is empty, and the other cells of the
+                    // largest empty block around it without looking them up.
+                    const int32_t shift = empty_block_shift(
+                        level, current_index, resolution, n_grids, mips);
+                    if (shift > 0 && cone_angle == 0.0f) {
+                        // the step size is constant: jump over the block at once.
+                        continuous = false;
+                        if (!jump_empty_block(
+                                shift, this_tmax, step_size, tdist, current_index,
+                                overflow_index, step_index, delta, t_last))
+                            break;
+                        continue;
+                    }
+                    // with cone stepping dt grows with t, so march cell by cell.
+                    const int3 block = make_int3(
+                        current_index.x >> shift,
+                        current_index.y >> shift,
+                        current_index.z >> shift);
+                    bool overflow = false, left_block = false;
+                    while (true) {
+                        if (step_size <= 0.0f) { // march to t_traverse.
+                            t_last = t_traverse;
+                        } else {
+                            float dt = _calc_dt(t_last, cone_angle, step_size, 1e10f);
+                            while (true) { // march until t_mid is right after t_traverse.
+                                if (t_last + dt * 0.5f >= t_traverse) break;
+                                t_last += dt;
+                            }
                         }
+                        if (shift == 0) break;
+                        if (!single_traversal(tdist, current_index, overflow_index, step_index, delta)) {
+                            overflow = true;
+                            break;
+                        }
+                        if ((current_index.x >> shift) != block.x
+                            || (current_index.y >> shift) != block.y
+                            || (current_index.z >> shift) != block.z) {
+                            left_block = true;
+                            break;
+                        }
+                        t_traverse = min(tdist.x, min(tdist.y, tdist.z));
+                        t_traverse = fminf(t_traverse, this_tmax);
                     }
                     continuous = false;
+                    if (overflow) break;
+                    // the traversal already stepped into the next cell.
+                    if (left_block) continue;
                 } else {
                     // this cell is not empty, so we need to traverse it.
                     while (traverse_steps_limit <= 0 || n_samples < traverse_steps_limit) {
@@ -262,8 +446,8 @@ __global__ void traverse_grids_kernel(
                 }
 
                 // printf(
-                //     "[traverse], t_last=%f, t_traverse=%f, cell_id=%d, current_index=(%d, %d, %d)\n",
-                //     t_last, t_traverse, cell_id, current_index.x, current_index.y, current_index.z
+                //     "[traverse], t_last=%f, t_traverse=%f, current_index=(%d, %d, %d)\n",
+                //     t_last, t_traverse, current_index.x, current_index.y, current_index.z
                 // );
 
                 if (!single_traversal(tdist, current_index, overflow_index, step_index, delta)) {
@@ -317,13 +501,17 @@ __global__ void ray_aabb_intersect_kernel(
 }  // namespace
 
 
-std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids(
+std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids_cuda(
     // rays
     const torch::Tensor rays_o, // [n_rays, 3]
     const torch::Tensor rays_d, // [n_rays, 3]
     const torch::Tensor rays_mask,   // [n_rays]
     // grids
     const torch::Tensor binaries,  // [n_grids, resx, resy, resz]
+    const torch::Tensor brick_table,  // [n_grids, resx/8, resy/8, resz/8] or empty
+    const torch::Tensor bricks,  // [n_bricks, 8, 8, 8]
+    const torch::Tensor morton_bits,  // [n_grids, res^3 / 8] or empty
+    const torch::Tensor mips,  // 2x, 4x and 8x OR-reduced binaries or empty
     const torch::Tensor aabbs,     // [n_grids, 6]
     // intersections
     const torch::Tensor t_sorted,  // [n_rays, n_grids]
@@ -346,8 +534,30 @@ std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids(
     }
 
     int32_t n_rays = rays_o.size(0);
-    int32_t n_grids = binaries.size(0);
-    int3 resolution = make_int3(binaries.size(1), binaries.size(2), binaries.size(3));
+    const bool use_bricks = brick_table.numel() > 0;
+    const bool use_morton = morton_bits.numel() > 0;
+    int32_t n_grids;
+    int3 resolution;
+    if (use_morton) {
+        // cubic grids with a power of 2 resolution.
+        n_grids = morton_bits.size(0);
+        int32_t res = 1;
+        while (static_cast<int64_t>(res) * res * res < morton_bits.size(1) * 8)
+            res <<= 1;
+        resolution = make_int3(res, res, res);
+    } else if (use_bricks) {
+        n_grids = brick_table.size(0);
+        resolution = make_int3(
+            brick_table.size(1) * 8, brick_table.size(2) * 8, brick_table.size(3) * 8);
+    } else {
+        n_grids = binaries.size(0);
+        resolution = make_int3(binaries.size(1), binaries.size(2), binaries.size(3));
+    }
+    bool *binaries_ptr = use_bricks || use_morton ? nullptr : binaries.data_ptr<bool>();
+    int32_t *brick_table_ptr = use_bricks ? brick_table.data_ptr<int32_t>() : nullptr;
+    bool *bricks_ptr = use_bricks ? bricks.data_ptr<bool>() : nullptr;
+    uint8_t *morton_bits_ptr = use_morton ? morton_bits.data_ptr<uint8_t>() : nullptr;
+    bool *mips_ptr = mips.numel() > 0 ? mips.data_ptr<bool>() : nullptr;
 
     at::cuda::CUDAStream stream = at::cuda::getCurrentCUDAStream();
     int32_t max_threads = 512; 
@@ -381,7 +591,11 @@ std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids(
             // grids
             n_grids,
             resolution,
-            binaries.data_ptr<bool>(), // [n_grids, resx, resy, resz]
+            binaries_ptr,    // [n_grids, resx, resy, resz]
+            brick_table_ptr, // [n_grids, resx/8, resy/8, resz/8]
+            bricks_ptr,      // [n_bricks, 8, 8, 8]
+            morton_bits_ptr, // [n_grids, res^3 / 8]
+            mips_ptr,        // 2x, 4x and 8x OR-reduced binaries
             aabbs.data_ptr<float>(),   // [n_grids, 6]
             // sorted intersections
             hits.data_ptr<bool>(),         // [n_rays, n_grids]
@@ -419,7 +633,11 @@ std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids(
             // grids
             n_grids,
             resolution,
-            binaries.data_ptr<bool>(), // [n_grids, resx, resy, resz]
+            binaries_ptr,    // [n_grids, resx, resy, resz]
+            brick_table_ptr, // [n_grids, resx/8, resy/8, resz/8]
+            bricks_ptr,      // [n_bricks, 8, 8, 8]
+            morton_bits_ptr, // [n_grids, res^3 / 8]
+            mips_ptr,        // 2x, 4x and 8x OR-reduced binaries
             aabbs.data_ptr<float>(),   // [n_grids, 6]
             // sorted intersections
             hits.data_ptr<bool>(),         // [n_rays, n_grids]
@@ -451,7 +669,11 @@ std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids(
             // grids
             n_grids,
             resolution,
-            binaries.data_ptr<bool>(), // [n_grids, resx, resy, resz]
+            binaries_ptr,    // [n_grids, resx, resy, resz]
+            brick_table_ptr, // [n_grids, resx/8, resy/8, resz/8]
+            bricks_ptr,      // [n_bricks, 8, 8, 8]
+            morton_bits_ptr, // [n_grids, res^3 / 8]
+            mips_ptr,        // 2x, 4x and 8x OR-reduced binaries
             aabbs.data_ptr<float>(),   // [n_grids, 6]
             // sorted intersections
             hits.data_ptr<bool>(),         // [n_rays, n_grids]
@@ -474,7 +696,7 @@ std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids(
 }
 
 
-std::vector<torch::Tensor> ray_aabb_intersect(
+std::vector<torch::Tensor> ray_aabb_intersect_cuda(
     const torch::Tensor rays_o, // [n_rays, 3]
     const torch::Tensor rays_d, // [n_rays, 3]
     const torch::Tensor aabbs,  // [n_aabbs, 6]
@@ -1,7 +1,12 @@
 #pragma once
 
 #include <torch/extension.h>
-#include "utils_cuda.cuh"
+
+// Device-agnostic checks: the spec is shared by the CUDA and the CPU kernels.
+#define CHECK_SPEC_INPUT(x)                                      \
+    TORCH_CHECK(x.device() == vals.device(),                     \
+                #x " must be on the same device as vals");      \
+    TORCH_CHECK(x.is_contiguous(), #x " must be contiguous")
 
 struct RaySegmentsSpec {
   torch::Tensor vals;        // [n_edges] or [n_rays, n_edges_per_ray]
@@ -14,37 +19,37 @@ struct RaySegmentsSpec {
   torch::Tensor is_valid;     // [n_edges] have n_bins true values
 
   inline void check() {
-    CHECK_INPUT(vals);
     TORCH_CHECK(vals.defined());
+    TORCH_CHECK(vals.is_contiguous(), "vals must be contiguous");
 
     // batched tensor [..., n_edges_per_ray]
     if (vals.ndimension() > 1) return;
 
     // flattend tensor [n_edges]
-    CHECK_INPUT(chunk_starts);
-    CHECK_INPUT(chunk_cnts);
     TORCH_CHECK(chunk_starts.defined());
     TORCH_CHECK(chunk_cnts.defined());
+    CHECK_SPEC_INPUT(chunk_starts);
+    CHECK_SPEC_INPUT(chunk_cnts);
     TORCH_CHECK(chunk_starts.ndimension() == 1);
     TORCH_CHECK(chunk_cnts.ndimension() == 1);
     TORCH_CHECK(chunk_starts.numel() == chunk_cnts.numel());
     if (ray_indices.defined()) {
-      CHECK_INPUT(ray_indices);
+      CHECK_SPEC_INPUT(ray_indices);
       TORCH_CHECK(ray_indices.ndimension() == 1);
       TORCH_CHECK(vals.numel() == ray_indices.numel());
     }
     if (is_left.defined()) {
-      CHECK_INPUT(is_left);
+      CHECK_SPEC_INPUT(is_left);
       TORCH_CHECK(is_left.ndimension() == 1);
       TORCH_CHECK(vals.numel() == is_left.numel());
     }
     if (is_right.defined()) {
-      CHECK_INPUT(is_right);
+      CHECK_SPEC_INPUT(is_right);
       TORCH_CHECK(is_right.ndimension() == 1);
       TORCH_CHECK(vals.numel() == is_right.numel());
     }
     if (is_valid.defined()) {
-      CHECK_INPUT(is_valid);
+      CHECK_SPEC_INPUT(is_valid);
       TORCH_CHECK(is_valid.ndimension() == 1);
       TORCH_CHECK(vals.numel() == is_valid.numel());
     }
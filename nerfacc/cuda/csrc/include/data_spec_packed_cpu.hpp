@@ -0,0 +1,48 @@
+/*
+ * Copyright (c) 2022 Ruilong Li, UC Berkeley.
+ */
+
+#pragma once
+
+#include <torch/extension.h>
+
+#include "data_spec.hpp"
+
+namespace {
+namespace host {
+
+// Host-side counterpart of device::PackedRaySegmentsSpec.
+struct PackedRaySegmentsSpec {
+    PackedRaySegmentsSpec(RaySegmentsSpec& spec) :
+        vals(spec.vals.defined() ? spec.vals.data_ptr<float>() : nullptr),
+        is_batched(spec.vals.defined() ? spec.vals.dim() > 1 : false),
+        // for flattened tensor
+        chunk_starts(spec.chunk_starts.defined() ? spec.chunk_starts.data_ptr<int64_t>() : nullptr),
+        chunk_cnts(spec.chunk_cnts.defined() ? spec.chunk_cnts.data_ptr<int64_t>(): nullptr),
+        ray_indices(spec.ray_indices.defined() ? spec.ray_indices.data_ptr<int64_t>() : nullptr),
+        is_left(spec.is_left.defined() ? spec.is_left.data_ptr<bool>() : nullptr),
+        is_right(spec.is_right.defined() ? spec.is_right.data_ptr<bool>() : nullptr),
+        is_valid(spec.is_valid.defined() ? spec.is_valid.data_ptr<bool>() : nullptr),
+        // for dimensions
+        n_edges(spec.vals.defined() ? spec.vals.numel() : 0),
+        n_rays(spec.chunk_cnts.defined() ? spec.chunk_cnts.size(0) : 0),  // for flattened tensor
+        n_edges_per_ray(spec.vals.defined() ? spec.vals.size(-1) : 0)   // for batched tensor
+    { }
+
+    float* vals;
+    bool is_batched;
+
+    int64_t* chunk_starts;
+    int64_t* chunk_cnts;
+    int64_t* ray_indices;
+    bool* is_left;
+    bool* is_right;
+    bool* is_valid;
+
+    int64_t n_edges;
+    int64_t n_rays;
+    int64_t n_edges_per_ray;
+};
+
+} // namespace host
+} // namespace
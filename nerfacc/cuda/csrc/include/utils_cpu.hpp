@@ -0,0 +1,30 @@
+/*
+ * Copyright (c) 2022 Ruilong Li, UC Berkeley.
+ */
+
+#pragma once
+
+#include <torch/extension.h>
+#include <ATen/Parallel.h>
+
+
+#define CHECK_CPU(x) TORCH_CHECK(x.device().is_cpu(), #x " must be a CPU tensor")
+#define CHECK_CONTIGUOUS(x) \
+    TORCH_CHECK(x.is_contiguous(), #x " must be contiguous")
+#define CHECK_CPU_INPUT(x) \
+    CHECK_CPU(x);          \
+    CHECK_CONTIGUOUS(x)
+
+namespace {
+namespace host {
+
+// Grain size (in rays) for at::parallel_for such that each task touches
+// roughly at::internal::GRAIN_SIZE elements.
+inline int64_t ray_grain_size(const int64_t n_rays, const int64_t n_items)
+{
+    const int64_t items_per_ray = std::max<int64_t>(n_items / std::max<int64_t>(n_rays, 1), 1);
+    return std::max<int64_t>(at::internal::GRAIN_SIZE / items_per_ray, 1);
+}
+
+} // namespace host
+} // namespace
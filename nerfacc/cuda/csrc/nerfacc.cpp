@@ -1,37 +1,83 @@
-// This file contains only Python bindings
+// This file contains the Python bindings and the device dispatching.
 #include "include/data_spec.hpp"
 
 #include <torch/extension.h>
 
 
+#ifdef WITH_CUDA
+#define DISPATCH_CUDA(fn, ...) return fn##_cuda(__VA_ARGS__)
+#else
+#define DISPATCH_CUDA(fn, ...) \
+    AT_ERROR(#fn ": NerfAcc is not compiled with CUDA support.")
+#endif
+#define DISPATCH_CPU_NOT_IMPLEMENTED(fn) \
+    AT_ERROR(#fn ": CPU tensors are not supported yet.")
+#define DISPATCH_CUDA_NOT_IMPLEMENTED(fn) \
+    AT_ERROR(#fn ": CUDA tensors are not supported yet.")
+
+
 // scan
-torch::Tensor inclusive_sum(
+#ifdef WITH_CUDA
+torch::Tensor inclusive_sum_cuda(
     torch::Tensor chunk_starts,
     torch::Tensor chunk_cnts,
     torch::Tensor inputs,
     bool normalize,
     bool backward);
-torch::Tensor exclusive_sum(
+torch::Tensor exclusive_sum_cuda(
     torch::Tensor chunk_starts,
     torch::Tensor chunk_cnts,
     torch::Tensor inputs,
     bool normalize,
     bool backward);
-torch::Tensor inclusive_prod_forward(
+torch::Tensor inclusive_prod_forward_cuda(
     torch::Tensor chunk_starts,
     torch::Tensor chunk_cnts,
     torch::Tensor inputs);
-torch::Tensor inclusive_prod_backward(
+torch::Tensor inclusive_prod_backward_cuda(
     torch::Tensor chunk_starts,
     torch::Tensor chunk_cnts,
     torch::Tensor inputs,
     torch::Tensor outputs,
     torch::Tensor grad_outputs);
-torch::Tensor exclusive_prod_forward(
+torch::Tensor exclusive_prod_forward_cuda(
     torch::Tensor chunk_starts,
     torch::Tensor chunk_cnts,
     torch::Tensor inputs);
-torch::Tensor exclusive_prod_backward(
+torch::Tensor exclusive_prod_backward_cuda(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs,
+    torch::Tensor outputs,
+    torch::Tensor grad_outputs);
+#endif
+torch::Tensor inclusive_sum_cpu(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs,
+    bool normalize,
+    bool backward);
+torch::Tensor exclusive_sum_cpu(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs,
+    bool normalize,
+    bool backward);
+torch::Tensor inclusive_prod_forward_cpu(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs);
+torch::Tensor inclusive_prod_backward_cpu(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs,
+    torch::Tensor outputs,
+    torch::Tensor grad_outputs);
+torch::Tensor exclusive_prod_forward_cpu(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs);
+torch::Tensor exclusive_prod_backward_cpu(
     torch::Tensor chunk_starts,
     torch::Tensor chunk_cnts,
     torch::Tensor inputs,
@@ -39,20 +85,59 @@ torch::Tensor exclusive_prod_backward(
     torch::Tensor grad_outputs);
 
 // grid
-std::vector<torch::Tensor> ray_aabb_intersect(
+#ifdef WITH_CUDA
+std::vector<torch::Tensor> ray_aabb_intersect_cuda(
     const torch::Tensor rays_o, // [n_rays, 3]
     const torch::Tensor rays_d, // [n_rays, 3]
     const torch::Tensor aabbs,  // [n_aabbs, 6]
     const float near_plane,
-    const float far_plane, 
+    const float far_plane,
     const float miss_value);
-std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids(
+std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids_cuda(
+    // rays
+    const torch::Tensor rays_o, // [n_rays, 3]
+    const torch::Tensor rays_d, // [n_rays, 3]
+    const torch::Tensor rays_mask,   // [n_rays]
+    // grids
+    const torch::Tensor binaries,  // [n_grids, resx, resy, resz]
+    const torch::Tensor brick_table,  // [n_grids, resx/8, resy/8, resz/8] or empty
+    const torch::Tensor bricks,  // [n_bricks, 8, 8, 8]
+    const torch::Tensor morton_bits,  // [n_grids, res^3 / 8] or empty
+    const torch::Tensor mips,  // 2x, 4x and 8x OR-reduced binaries or empty
+    const torch::Tensor aabbs,     // [n_grids, 6]
+    // intersections
+    const torch::Tensor t_sorted,  // [n_rays, n_grids * 2]
+    const torch::Tensor t_indices,  // [n_rays, n_grids * 2]
+    const torch::Tensor hits,    // [n_rays, n_grids]
+    // options
+    const torch::Tensor near_planes,
+    const torch::Tensor far_planes,
+    const float step_size,
+    const float cone_angle,
+    const bool compute_intervals,
+    const bool compute_samples,
+    const bool compute_terminate_planes,
+    const int32_t traverse_steps_limit, // <= 0 means no limit
+    const bool over_allocate); // over allocate the memory for intervals and samples
+#endif
+std::vector<torch::Tensor> ray_aabb_intersect_cpu(
+    const torch::Tensor rays_o, // [n_rays, 3]
+    const torch::Tensor rays_d, // [n_rays, 3]
+    const torch::Tensor aabbs,  // [n_aabbs, 6]
+    const float near_plane,
+    const float far_plane,
+    const float miss_value);
+std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids_cpu(
     // rays
     const torch::Tensor rays_o, // [n_rays, 3]
     const torch::Tensor rays_d, // [n_rays, 3]
     const torch::Tensor rays_mask,   // [n_rays]
     // grids
     const torch::Tensor binaries,  // [n_grids, resx, resy, resz]
+    const torch::Tensor brick_table,  // [n_grids, resx/8, resy/8, resz/8] or empty
+    const torch::Tensor bricks,  // [n_bricks, 8, 8, 8]
+    const torch::Tensor morton_bits,  // [n_grids, res^3 / 8] or empty
+    const torch::Tensor mips,  // 2x, 4x and 8x OR-reduced binaries or empty
     const torch::Tensor aabbs,     // [n_grids, 6]
     // intersections
     const torch::Tensor t_sorted,  // [n_rays, n_grids * 2]
@@ -70,31 +155,299 @@ std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids(
     const bool over_allocate); // over allocate the memory for intervals and samples
 
 // pdf
-std::vector<RaySegmentsSpec> importance_sampling(
+#ifdef WITH_CUDA
+std::vector<RaySegmentsSpec> importance_sampling_cuda(
     RaySegmentsSpec ray_segments,
-    torch::Tensor cdfs,                 
-    torch::Tensor n_intervels_per_ray,  
+    torch::Tensor cdfs,
+    torch::Tensor n_intervels_per_ray,
     bool stratified);
-std::vector<RaySegmentsSpec> importance_sampling(
+std::vector<RaySegmentsSpec> importance_sampling_cuda(
     RaySegmentsSpec ray_segments,
-    torch::Tensor cdfs,                  
+    torch::Tensor cdfs,
     int64_t n_intervels_per_ray,
     bool stratified);
-std::vector<torch::Tensor> searchsorted(
+std::vector<torch::Tensor> searchsorted_cuda(
     RaySegmentsSpec query,
     RaySegmentsSpec key);
+#endif
+std::vector<RaySegmentsSpec> importance_sampling_cpu(
+    RaySegmentsSpec ray_segments,
+    torch::Tensor cdfs,
+    torch::Tensor n_intervels_per_ray,
+    bool stratified);
+std::vector<RaySegmentsSpec> importance_sampling_cpu(
+    RaySegmentsSpec ray_segments,
+    torch::Tensor cdfs,
+    int64_t n_intervels_per_ray,
+    bool stratified);
+std::vector<torch::Tensor> searchsorted_cpu(
+    RaySegmentsSpec query,
+    RaySegmentsSpec key);
+
+// render
+std::vector<torch::Tensor> rendering_forward_cpu(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor t_starts,
+    torch::Tensor t_ends,
+    torch::Tensor densities,
+    torch::Tensor values,
+    bool from_alpha);
+std::vector<torch::Tensor> rendering_backward_cpu(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor t_starts,
+    torch::Tensor t_ends,
+    torch::Tensor values,
+    torch::Tensor trans,
+    torch::Tensor alphas,
+    torch::Tensor grad_colors,
+    torch::Tensor grad_opacities,
+    torch::Tensor grad_depths,
+    c10::optional<torch::Tensor> grad_weights,
+    c10::optional<torch::Tensor> grad_trans,
+    c10::optional<torch::Tensor> grad_alphas,
+    bool from_alpha);
 
 // cameras
-torch::Tensor opencv_lens_undistortion(
+#ifdef WITH_CUDA
+torch::Tensor opencv_lens_undistortion_cuda(
     const torch::Tensor& uv,      // [..., 2]
     const torch::Tensor& params,  // [..., 6]
     const float eps,
     const int max_iterations);
-torch::Tensor opencv_lens_undistortion_fisheye(
+torch::Tensor opencv_lens_undistortion_fisheye_cuda(
     const torch::Tensor& uv,      // [..., 2]
     const torch::Tensor& params,  // [..., 4]
     const float criteria_eps,
     const int criteria_iters);
+#endif
+
+
+// dispatch on the device of the inputs
+torch::Tensor inclusive_sum(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs,
+    bool normalize,
+    bool backward)
+{
+    if (inputs.is_cuda()) {
+        DISPATCH_CUDA(inclusive_sum, chunk_starts, chunk_cnts, inputs, normalize, backward);
+    }
+    return inclusive_sum_cpu(chunk_starts, chunk_cnts, inputs, normalize, backward);
+}
+
+torch::Tensor exclusive_sum(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs,
+    bool normalize,
+    bool backward)
+{
+    if (inputs.is_cuda()) {
+        DISPATCH_CUDA(exclusive_sum, chunk_starts, chunk_cnts, inputs, normalize, backward);
+    }
+    return exclusive_sum_cpu(chunk_starts, chunk_cnts, inputs, normalize, backward);
+}
+
+torch::Tensor inclusive_prod_forward(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs)
+{
+    if (inputs.is_cuda()) {
+        DISPATCH_CUDA(inclusive_prod_forward, chunk_starts, chunk_cnts, inputs);
+    }
+    return inclusive_prod_forward_cpu(chunk_starts, chunk_cnts, inputs);
+}
+
+torch::Tensor inclusive_prod_backward(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs,
+    torch::Tensor outputs,
+    torch::Tensor grad_outputs)
+{
+    if (grad_outputs.is_cuda()) {
+        DISPATCH_CUDA(inclusive_prod_backward, chunk_starts, chunk_cnts, inputs, outputs, grad_outputs);
+    }
+    return inclusive_prod_backward_cpu(chunk_starts, chunk_cnts, inputs, outputs, grad_outputs);
+}
+
+torch::Tensor exclusive_prod_forward(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs)
+{
+    if (inputs.is_cuda()) {
+        DISPATCH_CUDA(exclusive_prod_forward, chunk_starts, chunk_cnts, inputs);
+    }
+    return exclusive_prod_forward_cpu(chunk_starts, chunk_cnts, inputs);
+}
+
+torch::Tensor exclusive_prod_backward(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor inputs,
+    torch::Tensor outputs,
+    torch::Tensor grad_outputs)
+{
+    if (grad_outputs.is_cuda()) {
+        DISPATCH_CUDA(exclusive_prod_backward, chunk_starts, chunk_cnts, inputs, outputs, grad_outputs);
+    }
+    return exclusive_prod_backward_cpu(chunk_starts, chunk_cnts, inputs, outputs, grad_outputs);
+}
+
+std::vector<torch::Tensor> ray_aabb_intersect(
+    const torch::Tensor rays_o,
+    const torch::Tensor rays_d,
+    const torch::Tensor aabbs,
+    const float near_plane,
+    const float far_plane,
+    const float miss_value)
+{
+    if (rays_o.is_cuda()) {
+        DISPATCH_CUDA(ray_aabb_intersect, rays_o, rays_d, aabbs, near_plane, far_plane, miss_value);
+    }
+    return ray_aabb_intersect_cpu(rays_o, rays_d, aabbs, near_plane, far_plane, miss_value);
+}
+
+std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids(
+    const torch::Tensor rays_o,
+    const torch::Tensor rays_d,
+    const torch::Tensor rays_mask,
+    const torch::Tensor binaries,
+    const torch::Tensor brick_table,
+    const torch::Tensor bricks,
+    const torch::Tensor morton_bits,
+    const torch::Tensor mips,
+    const torch::Tensor aabbs,
+    const torch::Tensor t_sorted,
+    const torch::Tensor t_indices,
+    const torch::Tensor hits,
+    const torch::Tensor near_planes,
+    const torch::Tensor far_planes,
+    const float step_size,
+    const float cone_angle,
+    const bool compute_intervals,
+    const bool compute_samples,
+    const bool compute_terminate_planes,
+    const int32_t traverse_steps_limit,
+    const bool over_allocate)
+{
+    if (rays_o.is_cuda()) {
+        DISPATCH_CUDA(
+            traverse_grids, rays_o, rays_d, rays_mask, binaries, brick_table, bricks, morton_bits, mips, aabbs,
+            t_sorted, t_indices, hits, near_planes, far_planes, step_size, cone_angle,
+            compute_intervals, compute_samples, compute_terminate_planes,
+            traverse_steps_limit, over_allocate);
+    }
+    return traverse_grids_cpu(
+        rays_o, rays_d, rays_mask, binaries, brick_table, bricks, morton_bits, mips, aabbs,
+        t_sorted, t_indices, hits, near_planes, far_planes, step_size, cone_angle,
+        compute_intervals, compute_samples, compute_terminate_planes,
+        traverse_steps_limit, over_allocate);
+}
+
+std::vector<RaySegmentsSpec> importance_sampling(
+    RaySegmentsSpec ray_segments,
+    torch::Tensor cdfs,
+    torch::Tensor n_intervels_per_ray,
+    bool stratified)
+{
+    if (cdfs.is_cuda()) {
+        DISPATCH_CUDA(importance_sampling, ray_segments, cdfs, n_intervels_per_ray, stratified);
+    }
+    return importance_sampling_cpu(ray_segments, cdfs, n_intervels_per_ray, stratified);
+}
+
+std::vector<RaySegmentsSpec> importance_sampling(
+    RaySegmentsSpec ray_segments,
+    torch::Tensor cdfs,
+    int64_t n_intervels_per_ray,
+    bool stratified)
+{
+    if (cdfs.is_cuda()) {
+        DISPATCH_CUDA(importance_sampling, ray_segments, cdfs, n_intervels_per_ray, stratified);
+    }
+    return importance_sampling_cpu(ray_segments, cdfs, n_intervels_per_ray, stratified);
+}
+
+std::vector<torch::Tensor> searchsorted(
+    RaySegmentsSpec query,
+    RaySegmentsSpec key)
+{
+    if (query.vals.is_cuda()) {
+        DISPATCH_CUDA(searchsorted, query, key);
+    }
+    return searchsorted_cpu(query, key);
+}
+
+std::vector<torch::Tensor> rendering_forward(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor t_starts,
+    torch::Tensor t_ends,
+    torch::Tensor densities,
+    torch::Tensor values,
+    bool from_alpha)
+{
+    if (values.is_cuda()) {
+        DISPATCH_CUDA_NOT_IMPLEMENTED(rendering_forward);
+    }
+    return rendering_forward_cpu(
+        chunk_starts, chunk_cnts, t_starts, t_ends, densities, values, from_alpha);
+}
+
+std::vector<torch::Tensor> rendering_backward(
+    torch::Tensor chunk_starts,
+    torch::Tensor chunk_cnts,
+    torch::Tensor t_starts,
+    torch::Tensor t_ends,
+    torch::Tensor values,
+    torch::Tensor trans,
+    torch::Tensor alphas,
+    torch::Tensor grad_colors,
+    torch::Tensor grad_opacities,
+    torch::Tensor grad_depths,
+    c10::optional<torch::Tensor> grad_weights,
+    c10::optional<torch::Tensor> grad_trans,
+    c10::optional<torch::Tensor> grad_alphas,
+    bool from_alpha)
+{
+    if (values.is_cuda()) {
+        DISPATCH_CUDA_NOT_IMPLEMENTED(rendering_backward);
+    }
+    return rendering_backward_cpu(
+        chunk_starts, chunk_cnts, t_starts, t_ends, values, trans, alphas,
+        grad_colors, grad_opacities, grad_depths,
+        grad_weights, grad_trans, grad_alphas, from_alpha);
+}
+
+torch::Tensor opencv_lens_undistortion(
+    const torch::Tensor& uv,
+    const torch::Tensor& params,
+    const float eps,
+    const int max_iterations)
+{
+    if (uv.is_cuda()) {
+        DISPATCH_CUDA(opencv_lens_undistortion, uv, params, eps, max_iterations);
+    }
+    DISPATCH_CPU_NOT_IMPLEMENTED(opencv_lens_undistortion);
+}
+
+torch::Tensor opencv_lens_undistortion_fisheye(
+    const torch::Tensor& uv,
+    const torch::Tensor& params,
+    const float criteria_eps,
+    const int criteria_iters)
+{
+    if (uv.is_cuda()) {
+        DISPATCH_CUDA(opencv_lens_undistortion_fisheye, uv, params, criteria_eps, criteria_iters);
+    }
+    DISPATCH_CPU_NOT_IMPLEMENTED(opencv_lens_undistortion_fisheye);
+}
 
 
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
@@ -110,6 +463,9 @@ PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
     _REG_FUNC(traverse_grids);
     _REG_FUNC(searchsorted);
 
+    _REG_FUNC(rendering_forward);
+    _REG_FUNC(rendering_backward);
+
     _REG_FUNC(opencv_lens_undistortion);
     _REG_FUNC(opencv_lens_undistortion_fisheye);  // TODO: check this function.
 #undef _REG_FUNC
@@ -117,6 +473,14 @@ PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
     m.def("importance_sampling", py::overload_cast<RaySegmentsSpec, torch::Tensor, torch::Tensor, bool>(&importance_sampling));
     m.def("importance_sampling", py::overload_cast<RaySegmentsSpec, torch::Tensor, int64_t, bool>(&importance_sampling));
 
+    m.def("with_cuda", []() {
+#ifdef WITH_CUDA
+        return true;
+#else
+        return false;
+#endif
+    });
+
     py::class_<RaySegmentsSpec>(m, "RaySegmentsSpec")
         .def(py::init<>())
         .def_readwrite("vals", &RaySegmentsSpec::vals)
@@ -126,4 +490,4 @@ PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
         .def_readwrite("chunk_starts", &RaySegmentsSpec::chunk_starts)
         .def_readwrite("chunk_cnts", &RaySegmentsSpec::chunk_cnts)
         .def_readwrite("ray_indices", &RaySegmentsSpec::ray_indices);
-}
\ No newline at end of file
+}
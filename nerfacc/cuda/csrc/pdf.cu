@@ -291,7 +291,7 @@ __global__ void searchsorted_kernel(
 
 
 // Return flattend RaySegmentsSpec because n_intervels_per_ray is defined per ray.
-std::vector<RaySegmentsSpec> importance_sampling(
+std::vector<RaySegmentsSpec> importance_sampling_cuda(
     RaySegmentsSpec ray_segments,       // [..., n_edges_per_ray] or flattend
     torch::Tensor cdfs,                 // [..., n_edges_per_ray] or flattend 
     torch::Tensor n_intervels_per_ray,  // [...] or flattend
@@ -321,7 +321,7 @@ std::vector<RaySegmentsSpec> importance_sampling(
     // output samples
     RaySegmentsSpec samples;
     samples.chunk_cnts = n_intervels_per_ray.to(n_intervels_per_ray.options().dtype(torch::kLong));
-    samples.memalloc_data(false, false); // no need boolen masks, no need to zero init.
+    samples.memalloc_data_from_chunk(false, false); // no need boolen masks, no need to zero init.
     int64_t n_samples = samples.vals.numel();
 
     // step 1. compute the ray_indices and samples
@@ -341,7 +341,7 @@ std::vector<RaySegmentsSpec> importance_sampling(
     RaySegmentsSpec intervals;
     intervals.chunk_cnts = (
       (samples.chunk_cnts + 1) * (samples.chunk_cnts > 0)).to(samples.chunk_cnts.options());
-    intervals.memalloc_data(true, true); // need the boolen masks, need to zero init.
+    intervals.memalloc_data_from_chunk(true, true); // need the boolen masks, need to zero init.
 
     // step 2. compute the intervals.
     device::compute_intervels_kernel<<<blocks, threads, 0, stream>>>(
@@ -356,7 +356,7 @@ std::vector<RaySegmentsSpec> importance_sampling(
 
 
 // Return batched RaySegmentsSpec because n_intervels_per_ray is same across rays.
-std::vector<RaySegmentsSpec> importance_sampling(
+std::vector<RaySegmentsSpec> importance_sampling_cuda(
     RaySegmentsSpec ray_segments,       // [..., n_edges_per_ray] or flattend
     torch::Tensor cdfs,                 // [..., n_edges_per_ray] or flattend 
     int64_t n_intervels_per_ray,       
@@ -423,7 +423,7 @@ std::vector<RaySegmentsSpec> importance_sampling(
 
 // Find two indices {left, right} for each item in query,
 // such that: key.vals[left] <= query.vals < key.vals[right]
-std::vector<torch::Tensor> searchsorted(
+std::vector<torch::Tensor> searchsorted_cuda(
     RaySegmentsSpec query,
     RaySegmentsSpec key)
 {
@@ -6,7 +6,7 @@
 #include "include/utils_scan.cuh"
 
 
-torch::Tensor inclusive_sum(
+torch::Tensor inclusive_sum_cuda(
     torch::Tensor chunk_starts,
     torch::Tensor chunk_cnts,
     torch::Tensor inputs,
@@ -65,7 +65,7 @@ torch::Tensor inclusive_sum(
     return outputs;
 }
 
-torch::Tensor exclusive_sum(
+torch::Tensor exclusive_sum_cuda(
     torch::Tensor chunk_starts,
     torch::Tensor chunk_cnts,
     torch::Tensor inputs,
@@ -124,7 +124,7 @@ torch::Tensor exclusive_sum(
     return outputs;
 }
 
-torch::Tensor inclusive_prod_forward(
+torch::Tensor inclusive_prod_forward_cuda(
     torch::Tensor chunk_starts,
     torch::Tensor chunk_cnts,
     torch::Tensor inputs) 
@@ -166,7 +166,7 @@ torch::Tensor inclusive_prod_forward(
     return outputs;
 }
 
-torch::Tensor inclusive_prod_backward(
+torch::Tensor inclusive_prod_backward_cuda(
     torch::Tensor chunk_starts,
     torch::Tensor chunk_cnts,
     torch::Tensor inputs,
@@ -214,7 +214,7 @@ torch::Tensor inclusive_prod_backward(
 }
 
 
-torch::Tensor exclusive_prod_forward(
+torch::Tensor exclusive_prod_forward_cuda(
     torch::Tensor chunk_starts,
     torch::Tensor chunk_cnts,
     torch::Tensor inputs) 
@@ -256,7 +256,7 @@ torch::Tensor exclusive_prod_forward(
     return outputs;
 }
 
-torch::Tensor exclusive_prod_backward(
+torch::Tensor exclusive_prod_backward_cuda(
     torch::Tensor chunk_starts,
     torch::Tensor chunk_cnts,
     torch::Tensor inputs,
@@ -2,15 +2,72 @@
 Copyright (c) 2022 Ruilong Li, UC Berkeley.
 """
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Union
 
 import torch
 
 from . import cuda as _C
+from .pack import pack_info
 
 
-@dataclass
-class RaySamples:
+class _ChunkedSegments:
+    """Storage of the chunks of flattened ray segments, shared by
+    :class:`RaySamples` and :class:`RayIntervals`.
+
+    The starts and counts are kept as two contiguous arrays, the layout of
+    `RaySegmentsSpec`, so that converting to and from C++ copies nothing.
+    `packed_info` is only stacked when it is asked for.
+    """
+
+    def _init_chunks(
+        self,
+        packed_info: Optional[Union[torch.Tensor, "PackedRays"]],
+        chunk_starts: Optional[torch.Tensor],
+        chunk_cnts: Optional[torch.Tensor],
+    ) -> None:
+        packed_info = _as_packed_info(packed_info)
+        if packed_info is not None and chunk_starts is None:
+            chunk_starts, chunk_cnts = packed_info.unbind(-1)
+        if chunk_starts is not None:
+            # no-ops (and no copies) on contiguous tensors.
+            chunk_starts = chunk_starts.contiguous()
+            chunk_cnts = chunk_cnts.contiguous()
+        self.chunk_starts = chunk_starts
+        self.chunk_cnts = chunk_cnts
+        self._packed_info = packed_info
+
+    @property
+    def packed_info(self) -> Optional[torch.Tensor]:
+        if self._packed_info is None and self.chunk_starts is not None:
+            self._packed_info = torch.stack(
+                [self.chunk_starts, self.chunk_cnts], -1
+            )
+        return self._packed_info
+
+    @packed_info.setter
+    def packed_info(
+        self, packed_info: Optional[Union[torch.Tensor, "PackedRays"]]
+    ) -> None:
+        self._init_chunks(packed_info, None, None)
+
+    def _to_cpp_chunks(self):
+        """A `RaySegmentsSpec` holding the vals, chunks and ray indices."""
+        spec = _C.RaySegmentsSpec()
+        spec.vals = self.vals.contiguous()
+        if self.chunk_starts is not None:
+            spec.chunk_starts = self.chunk_starts
+            spec.chunk_cnts = self.chunk_cnts
+        if self.ray_indices is not None:
+            spec.ray_indices = self.ray_indices.contiguous()
+        return spec
+
+    @property
+    def device(self) -> torch.device:
+        return self.vals.device
+
+
+@dataclass(init=False)
+class RaySamples(_ChunkedSegments):
     """Ray samples that supports batched and flattened data.
 
     Note:
@@ -22,9 +79,15 @@ class RaySamples:
             with shape (all_samples,)
         packed_info: Optional. A tensor of shape (n_rays, 2) that specifies
             the start and count of each chunk in flattened `vals`, with in
-            total n_rays chunks. Only needed when `vals` is flattened.
+            total n_rays chunks. Only needed when `vals` is flattened. Can
+            also be a :class:`PackedRays`.
         ray_indices: Optional. A tensor of shape (all_samples,) that specifies
             the ray index of each sample. Only needed when `vals` is flattened.
+        chunk_starts: Optional. Contiguous tensor of shape (n_rays,), i.e.
+            `packed_info[:, 0]`. Given with `chunk_cnts` in place of
+            `packed_info`, it is used as is, without copies.
+        chunk_cnts: Optional. Contiguous tensor of shape (n_rays,), i.e.
+            `packed_info[:, 1]`.
 
     Examples:
 
@@ -41,54 +104,47 @@ class RaySamples:
     """
 
     vals: torch.Tensor
-    packed_info: Optional[torch.Tensor] = None
+    chunk_starts: Optional[torch.Tensor] = None
+    chunk_cnts: Optional[torch.Tensor] = None
     ray_indices: Optional[torch.Tensor] = None
     is_valid: Optional[torch.Tensor] = None
 
+    def __init__(
+        self,
+        vals: torch.Tensor,
+        packed_info: Optional[Union[torch.Tensor, "PackedRays"]] = None,
+        ray_indices: Optional[torch.Tensor] = None,
+        is_valid: Optional[torch.Tensor] = None,
+        chunk_starts: Optional[torch.Tensor] = None,
+        chunk_cnts: Optional[torch.Tensor] = None,
+    ):
+        self.vals = vals
+        self.ray_indices = ray_indices
+        self.is_valid = is_valid
+        self._init_chunks(packed_info, chunk_starts, chunk_cnts)
+
     def _to_cpp(self):
         """
         Generate object to pass to C++
         """
-
-        spec = _C.RaySegmentsSpec()
-        spec.vals = self.vals.contiguous()
-        if self.packed_info is not None:
-            spec.chunk_starts = self.packed_info[:, 0].contiguous()
-        if self.chunk_cnts is not None:
-            spec.chunk_cnts = self.packed_info[:, 1].contiguous()
-        if self.ray_indices is not None:
-            spec.ray_indices = self.ray_indices.contiguous()
-        return spec
+        return self._to_cpp_chunks()
 
     @classmethod
     def _from_cpp(cls, spec):
         """
         Generate object from C++
         """
-        if spec.chunk_starts is not None and spec.chunk_cnts is not None:
-            packed_info = torch.stack([spec.chunk_starts, spec.chunk_cnts], -1)
-        else:
-            packed_info = None
-        ray_indices = spec.ray_indices
-        if spec.is_valid is not None:
-            is_valid = spec.is_valid
-        else:
-            is_valid = None
-        vals = spec.vals
         return cls(
-            vals=vals,
-            packed_info=packed_info,
-            ray_indices=ray_indices,
-            is_valid=is_valid,
+            vals=spec.vals,
+            ray_indices=spec.ray_indices,
+            is_valid=spec.is_valid,
+            chunk_starts=spec.chunk_starts,
+            chunk_cnts=spec.chunk_cnts,
         )
 
-    @property
-    def device(self) -> torch.device:
-        return self.vals.device
-
 
-@dataclass
-class RayIntervals:
+@dataclass(init=False)
+class RayIntervals(_ChunkedSegments):
     """Ray intervals that supports batched and flattened data.
 
     Each interval is defined by two edges (left and right). The attribute `vals`
@@ -106,13 +162,19 @@ class RayIntervals:
             with shape (all_edges,)
         packed_info: Optional. A tensor of shape (n_rays, 2) that specifies
             the start and count of each chunk in flattened `vals`, with in
-            total n_rays chunks. Only needed when `vals` is flattened.
+            total n_rays chunks. Only needed when `vals` is flattened. Can
+            also be a :class:`PackedRays`.
         ray_indices: Optional. A tensor of shape (all_edges,) that specifies
             the ray index of each edge. Only needed when `vals` is flattened.
         is_left: Optional. A boolen tensor of shape (all_edges,) that specifies
             whether each edge is a left edge. Only needed when `vals` is flattened.
         is_right: Optional. A boolen tensor of shape (all_edges,) that specifies
             whether each edge is a right edge. Only needed when `vals` is flattened.
+        chunk_starts: Optional. Contiguous tensor of shape (n_rays,), i.e.
+            `packed_info[:, 0]`. Given with `chunk_cnts` in place of
+            `packed_info`, it is used as is, without copies.
+        chunk_cnts: Optional. Contiguous tensor of shape (n_rays,), i.e.
+            `packed_info[:, 1]`.
 
     Examples:
 
@@ -131,24 +193,33 @@ class RayIntervals:
     """
 
     vals: torch.Tensor
-    packed_info: Optional[torch.Tensor] = None
+    chunk_starts: Optional[torch.Tensor] = None
+    chunk_cnts: Optional[torch.Tensor] = None
     ray_indices: Optional[torch.Tensor] = None
     is_left: Optional[torch.Tensor] = None
     is_right: Optional[torch.Tensor] = None
 
+    def __init__(
+        self,
+        vals: torch.Tensor,
+        packed_info: Optional[Union[torch.Tensor, "PackedRays"]] = None,
+        ray_indices: Optional[torch.Tensor] = None,
+        is_left: Optional[torch.Tensor] = None,
+        is_right: Optional[torch.Tensor] = None,
+        chunk_starts: Optional[torch.Tensor] = None,
+        chunk_cnts: Optional[torch.Tensor] = None,
+    ):
+        self.vals = vals
+        self.ray_indices = ray_indices
+        self.is_left = is_left
+        self.is_right = is_right
+        self._init_chunks(packed_info, chunk_starts, chunk_cnts)
+
     def _to_cpp(self):
         """
         Generate object to pass to C++
         """
-
-        spec = _C.RaySegmentsSpec()
-        spec.vals = self.vals.contiguous()
-        if self.packed_info is not None:
-            spec.chunk_starts = self.packed_info[:, 0].contiguous()
-        if self.packed_info is not None:
-            spec.chunk_cnts = self.packed_info[:, 1].contiguous()
-        if self.ray_indices is not None:
-            spec.ray_indices = self.ray_indices.contiguous()
+        spec = self._to_cpp_chunks()
         if self.is_left is not None:
             spec.is_left = self.is_left.contiguous()
         if self.is_right is not None:
@@ -160,21 +231,116 @@ class RayIntervals:
         """
         Generate object from C++
         """
-        if spec.chunk_starts is not None and spec.chunk_cnts is not None:
-            packed_info = torch.stack([spec.chunk_starts, spec.chunk_cnts], -1)
-        else:
-            packed_info = None
-        ray_indices = spec.ray_indices
-        is_left = spec.is_left
-        is_right = spec.is_right
         return cls(
             vals=spec.vals,
-            packed_info=packed_info,
-            ray_indices=ray_indices,
-            is_left=is_left,
-            is_right=is_right,
+            ray_indices=spec.ray_indices,
+            is_left=spec.is_left,
+            is_right=spec.is_right,
+            chunk_starts=spec.chunk_starts,
+            chunk_cnts=spec.chunk_cnts,
+        )
+
+
+class PackedRays:
+    """The layout of flattened samples along the rays.
+
+    Holds the `packed_info`, `ray_indices` and `n_rays` of the same flattened
+    samples. The ones that are not given are computed on first access and
+    cached, so converting between them is paid once per batch rather than once
+    per op. It can be passed as `packed_info` to the scan and volrend functions
+    and to :class:`RaySamples` and :class:`RayIntervals`, and as `ray_indices`
+    to :func:`nerfacc.rendering` and :func:`nerfacc.accumulate_along_rays`.
+
+    Note:
+        The samples must be in the order of the rays, i.e., `ray_indices` is
+        sorted. A `packed_info` may leave gaps between the chunks, e.g. the
+        over-allocated outputs of :func:`nerfacc.traverse_grids`, but then
+        `ray_indices` must be given too, as it cannot be computed from it.
+
+    Args:
+        packed_info: Optional. A tensor of shape (n_rays, 2) that specifies
+            the start and count of each chunk in the flattened samples.
+        ray_indices: Optional. A tensor of shape (all_samples,) that specifies
+            the ray index of each sample.
+        n_rays: Optional. Number of rays. If not given, it is inferred from
+            `packed_info`, or from `ray_indices` which requires a device
+            synchronization.
+
+    Examples:
+
+    .. code-block:: python
+
+        >>> ray_indices, t_starts, t_ends = estimator.sampling(rays_o, rays_d)
+        >>> rays = PackedRays(ray_indices=ray_indices, n_rays=rays_o.shape[0])
+        >>> colors, opacities, depths, extras = rendering(
+        >>>     t_starts, t_ends, rays, rgb_sigma_fn=rgb_sigma_fn)
+
+    """
+
+    def __init__(
+        self,
+        packed_info: Optional[torch.Tensor] = None,
+        ray_indices: Optional[torch.Tensor] = None,
+        n_rays: Optional[int] = None,
+    ):
+        assert (
+            packed_info is not None or ray_indices is not None
+        ), "Either packed_info or ray_indices should be provided."
+        self._packed_info = packed_info
+        self._ray_indices = ray_indices
+        self._n_rays = n_rays
+        # packed from the sorted ray indices, so there are no gaps.
+        self._contiguous = packed_info is None
+
+    @classmethod
+    def from_samples(
+        cls, samples: Union[RaySamples, RayIntervals]
+    ) -> "PackedRays":
+        """The layout of flattened :class:`RaySamples` or
+        :class:`RayIntervals`."""
+        return cls(
+            packed_info=samples.packed_info, ray_indices=samples.ray_indices
         )
 
+    @property
+    def packed_info(self) -> torch.Tensor:
+        if self._packed_info is None:
+            self._packed_info = pack_info(self._ray_indices, self._n_rays)
+        return self._packed_info
+
+    @property
+    def ray_indices(self) -> torch.Tensor:
+        if self._ray_indices is None:
+            chunk_cnts = self.packed_info[:, 1]
+            self._ray_indices = torch.repeat_interleave(
+                torch.arange(self.n_rays, device=chunk_cnts.device),
+                chunk_cnts,
+            )
+        return self._ray_indices
+
+    @property
+    def n_rays(self) -> int:
+        if self._n_rays is None:
+            self._n_rays = self.packed_info.shape[0]
+        return self._n_rays
+
+    @property
+    def is_contiguous(self) -> bool:
+        """Whether the chunks are known to be packed back to back, covering
+        all the samples, which lets the reductions skip the gaps."""
+        return self._contiguous
+
     @property
     def device(self) -> torch.device:
-        return self.vals.device
+        if self._packed_info is not None:
+            return self._packed_info.device
+        return self._ray_indices.device
+
+
+def _as_packed_info(
+    packed_info: Optional[Union[torch.Tensor, PackedRays]]
+) -> Optional[torch.Tensor]:
+    """Accept a :class:`PackedRays` wherever a `packed_info` is expected."""
+    if isinstance(packed_info, PackedRays):
+        return packed_info.packed_info
+    return packed_info
@@ -0,0 +1,43 @@
+"""
+Copyright (c) 2022 Ruilong Li, UC Berkeley.
+"""
+
+import torch
+
+_deterministic = False
+
+
+def use_deterministic_algorithms(mode: bool) -> None:
+    """Sets whether nerfacc uses bitwise reproducible algorithms.
+
+    When enabled, the scans, the rendering and the accumulation along rays
+    reduce the samples of each ray in a fixed order, so that the outputs
+    (and gradients) are bitwise identical across runs and across numbers of
+    threads. Ops that would otherwise reduce in a varying order (e.g. the CUDA
+    scans, or `index_add_` on CUDA) are replaced by slower fixed-order
+    implementations.
+
+    Deterministic algorithms are also used when
+    :func:`torch.use_deterministic_algorithms` is enabled.
+
+    Args:
+        mode: If True, use deterministic algorithms.
+
+    Example:
+
+    .. code-block:: python
+
+        >>> nerfacc.use_deterministic_algorithms(True)
+        >>> colors, opacities, depths, extras = nerfacc.rendering(...)
+
+    """
+    global _deterministic
+    _deterministic = bool(mode)
+
+
+def are_deterministic_algorithms_enabled() -> bool:
+    """Returns True if nerfacc uses deterministic algorithms.
+
+    See :func:`nerfacc.use_deterministic_algorithms`.
+    """
+    return _deterministic or torch.are_deterministic_algorithms_enabled()
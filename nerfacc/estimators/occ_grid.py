@@ -1,12 +1,24 @@
-from typing import Callable, List, Optional, Tuple, Union
+import os
+import struct
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 import torch
 from torch import Tensor
 
-from ..grid import _enlarge_aabb, traverse_grids
+from ..grid import (
+    MortonGrid,
+    _enlarge_aabb,
+    _query_cells,
+    _refresh_occupancy_mips,
+    build_occupancy_mips,
+    ray_aabb_intersect,
+    traverse_grids,
+)
 from ..volrend import (
+    accumulate_along_rays,
     render_visibility_from_alpha,
     render_visibility_from_density,
+    render_weight_from_density,
 )
 from .base import AbstractEstimator
 
@@ -25,6 +37,11 @@ class OccGridEstimator(AbstractEstimator):
     """
 
     DIM: int = 3
+    # whether the grid can be saved to snapshots and updated within a budget
+    # of cells per step, which both need the occupancy of all the cells.
+    SUPPORTS_SNAPSHOTS: bool = True
+    SUPPORTS_BUDGETED_UPDATES: bool = True
+    SUPPORTS_UPDATES: bool = True
 
     def __init__(
         self,
@@ -66,6 +83,27 @@ class OccGridEstimator(AbstractEstimator):
         # Buffers
         self.register_buffer("resolution", resolution)  # [3]
         self.register_buffer("aabbs", aabbs)  # [n_aabbs, 6]
+        self._init_occupancy(resolution)
+        # occupancy pyramid, and the binaries tensor and version it was built
+        # from. Holding the tensor keeps its address from being reused.
+        self._mips = None
+        self._mips_key = None
+
+        # Bookkeeping of the budgeted updates, allocated on the first one:
+        # how often the samples of `sampling` fell in each cell since its last
+        # refresh, the step of that refresh, the cells visited since then,
+        # the next cell of the sweep over the grid, and the sum and count of
+        # the visible occupancies for the threshold.
+        self.register_buffer("visits", None, persistent=False)
+        self.register_buffer("last_refresh", None, persistent=False)
+        self._visited = []
+        self._sweep_start = 0
+        self._visible_occ_sum = None
+        self._n_visible = None
+
+    def _init_occupancy(self, resolution: Tensor) -> None:
+        """Register the buffers holding the occupancy of the cells."""
+        levels = self.levels
         self.register_buffer(
             "occs", torch.zeros(self.levels * self.cells_per_lvl)
         )
@@ -74,13 +112,42 @@ class OccGridEstimator(AbstractEstimator):
             torch.zeros([levels] + resolution.tolist(), dtype=torch.bool),
         )
 
-        # Grid coords & indices
-        grid_coords = _meshgrid3d(resolution).reshape(
-            self.cells_per_lvl, self.DIM
+    @property
+    def mips(self) -> Optional[Tensor]:
+        """Occupancy pyramid of the binaries (see
+        :func:`nerfacc.grid.build_occupancy_mips`), for the traversal to skip
+        empty blocks of cells. Rebuilt whenever the binaries change. None if
+        the resolution is not a multiple of 8."""
+        if (self.resolution % 8 != 0).any():
+            return None
+        if not self._mips_valid():
+            self._mips = build_occupancy_mips(self.binaries)
+            self._mips_key = (self.binaries, self.binaries._version)
+        return self._mips
+
+    def _mips_valid(self) -> bool:
+        """Whether the cached pyramid is the one of the current binaries."""
+        return (
+            self._mips_key is not None
+            and self._mips_key[0] is self.binaries
+            and self._mips_key[1] == self.binaries._version
         )
-        self.register_buffer("grid_coords", grid_coords, persistent=False)
-        grid_indices = torch.arange(self.cells_per_lvl)
-        self.register_buffer("grid_indices", grid_indices, persistent=False)
+
+    def _invalidate_mips(self) -> None:
+        """Drop the cached pyramid, to be called whenever the binaries
+        change."""
+        self._mips = self._mips_key = None
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        self._check_updatable()
+        self._invalidate_mips()
+        super()._load_from_state_dict(*args, **kwargs)
+
+    def _check_updatable(self) -> None:
+        if not self.SUPPORTS_UPDATES:
+            raise RuntimeError(
+                f"{type(self).__name__} is read-only and cannot be updated."
+            )
 
     @torch.no_grad()
     def sampling(
@@ -170,6 +237,7 @@ class OccGridEstimator(AbstractEstimator):
             far_planes=far_planes,
             step_size=render_step_size,
             cone_angle=cone_angle,
+            mips=self.mips,
         )
         t_starts = intervals.vals[intervals.is_left]
         t_ends = intervals.vals[intervals.is_right]
@@ -180,7 +248,7 @@ class OccGridEstimator(AbstractEstimator):
         if (alpha_thre > 0.0 or early_stop_eps > 0.0) and (
             sigma_fn is not None or alpha_fn is not None
         ):
-            alpha_thre = min(alpha_thre, self.occs.mean().item())
+            alpha_thre = min(alpha_thre, self._mean_occupancy())
 
             # Compute visibility of the samples, and filter out invisible samples
             if sigma_fn is not None:
@@ -218,8 +286,194 @@ class OccGridEstimator(AbstractEstimator):
                 t_starts[masks],
                 t_ends[masks],
             )
+        if self.training and self.visits is not None:
+            t_mid = (t_starts + t_ends)[:, None] / 2.0
+            x = rays_o[ray_indices] + t_mid * rays_d[ray_indices]
+            self._record_visits(x)
         return ray_indices, t_starts, t_ends
 
+    @torch.no_grad()
+    def render_streaming(
+        self,
+        # rays
+        rays_o: Tensor,  # [n_rays, 3]
+        rays_d: Tensor,  # [n_rays, 3]
+        # radiance field
+        rgb_sigma_fn: Callable,
+        near_plane: float = 0.0,
+        far_plane: float = 1e10,
+        t_min: Optional[Tensor] = None,  # [n_rays]
+        t_max: Optional[Tensor] = None,  # [n_rays]
+        # rendering options
+        render_step_size: float = 1e-3,
+        early_stop_eps: float = 1e-4,
+        alpha_thre: float = 0.0,
+        cone_angle: float = 0.0,
+        render_bkgd: Optional[Tensor] = None,
+        max_samples_per_wave: int = 64,
+    ) -> Tuple[Tensor, Tensor, Tensor, Dict]:
+        """Sampling and rendering in depth-ordered waves, for inference.
+
+        Unlike :meth:`sampling` followed by :func:`nerfacc.rendering`, the
+        field is not evaluated on all the traversed samples at once. Each wave
+        marches a few more samples along the rays that are still alive, from
+        where the previous wave stopped, and queries `rgb_sigma_fn` on them
+        only. A ray stops being queried once its transmittance drops below
+        `early_stop_eps` or it leaves the grid, so the samples behind opaque
+        surfaces are never evaluated. The waves take more samples per ray as
+        fewer rays remain alive.
+
+        Note:
+            This function is not differentiable to any inputs. The samples of
+            a wave beyond the point where a ray terminates are still
+            evaluated, and the transparent samples (`alpha < alpha_thre`) are
+            dropped from the outputs but not from the transmittance, so the
+            outputs differ from :meth:`sampling` and :func:`nerfacc.rendering`
+            by less than `early_stop_eps` and `alpha_thre` per ray.
+
+        Args:
+            rays_o: Ray origins of shape (n_rays, 3).
+            rays_d: Normalized ray directions of shape (n_rays, 3).
+            rgb_sigma_fn: A function that takes in samples {t_starts (N,),
+                t_ends (N,), ray indices (N,)} and returns the post-activation
+                rgb (N, 3) and density values (N,).
+            near_plane: Optional. Near plane distance. Default: 0.0.
+            far_plane: Optional. Far plane distance. Default: 1e10.
+            t_min: Optional. Per-ray minimum distance. Tensor with shape (n_rays).
+            t_max: Optional. Per-ray maximum distance. Tensor with shape (n_rays).
+            render_step_size: Step size for marching. Default: 1e-3.
+            early_stop_eps: Stop querying a ray once its transmittance is
+                below this threshold. Default: 1e-4.
+            alpha_thre: Alpha threshold for skipping empty space. Default: 0.0.
+            cone_angle: Cone angle for linearly-increased step size. 0. means
+                constant step size. Default: 0.0.
+            render_bkgd: Optional. Background color. Tensor with shape (3,).
+            max_samples_per_wave: Maximum number of samples marched along a
+                ray in one wave. Default: 64.
+
+        Returns:
+            Ray colors (n_rays, 3), opacities (n_rays, 1), depths (n_rays, 1)
+            and a dict of extras: the number of samples evaluated by
+            `rgb_sigma_fn` (`n_evals`) and the number of waves (`n_waves`).
+
+        Examples:
+
+        .. code-block:: python
+
+            >>> colors, opacities, depths, extras = estimator.render_streaming(
+            >>>     rays_o, rays_d, rgb_sigma_fn, render_step_size=1e-3)
+            >>> print(extras["n_evals"])
+
+        """
+        n_rays = rays_o.shape[0]
+        device = rays_o.device
+
+        near_planes = torch.full_like(rays_o[..., 0], fill_value=near_plane)
+        far_planes = torch.full_like(rays_o[..., 0], fill_value=far_plane)
+        if t_min is not None:
+            near_planes = torch.clamp(near_planes, min=t_min)
+        if t_max is not None:
+            far_planes = torch.clamp(far_planes, max=t_max)
+
+        t_mins, t_maxs, hits = ray_aabb_intersect(rays_o, rays_d, self.aabbs)
+        t_sorted, t_indices = torch.sort(torch.cat([t_mins, t_maxs], -1), -1)
+        mips = self.mips
+
+        # [rgb, opacity, depth] of each ray.
+        outputs = torch.zeros((n_rays, 5), device=device)
+        min_samples = 1 if cone_angle == 0 else 4
+        n_evals = n_waves = 0
+
+        # The alive rays, compacted after every wave.
+        alive = torch.arange(n_rays, device=device)
+        alive_outputs = outputs
+        n_alive = n_rays
+        while n_alive > 0:
+            n_samples = max(
+                min(n_rays // n_alive, max_samples_per_wave), min_samples
+            )
+            intervals, samples, termination_planes = traverse_grids(
+                rays_o,
+                rays_d,
+                self.binaries,
+                self.aabbs,
+                near_planes=near_planes,
+                far_planes=far_planes,
+                step_size=render_step_size,
+                cone_angle=cone_angle,
+                traverse_steps_limit=n_samples,
+                over_allocate=True,
+                t_sorted=t_sorted,
+                t_indices=t_indices,
+                hits=hits,
+                mips=mips,
+            )
+            t_starts = intervals.vals[intervals.is_left]
+            t_ends = intervals.vals[intervals.is_right]
+            ray_indices = samples.ray_indices[samples.is_valid]
+            n_waves += 1
+            n_evals += t_starts.shape[0]
+
+            if t_starts.shape[0] != 0:
+                rgbs, sigmas = rgb_sigma_fn(
+                    t_starts, t_ends, alive[ray_indices]
+                )
+                assert (
+                    sigmas.shape == t_starts.shape
+                ), "sigmas must have shape of (N,)! Got {}".format(sigmas.shape)
+                # The weights within the wave, scaled below by the
+                # transmittance of the previous waves.
+                weights, _, alphas = render_weight_from_density(
+                    t_starts,
+                    t_ends,
+                    sigmas,
+                    ray_indices=ray_indices,
+                    n_rays=n_alive,
+                )
+                if alpha_thre > 0.0:
+                    weights = weights * (alphas >= alpha_thre)
+                values = torch.cat(
+                    [
+                        rgbs,
+                        torch.ones_like(t_starts)[:, None],
+                        (t_starts + t_ends)[:, None] / 2.0,
+                    ],
+                    dim=-1,
+                )
+                wave_outputs = accumulate_along_rays(
+                    weights, values, ray_indices=ray_indices, n_rays=n_alive
+                )
+                alive_outputs = alive_outputs + wave_outputs * (
+                    1.0 - alive_outputs[:, 3:4]
+                )
+                outputs[alive] = alive_outputs
+
+            # Rays that are opaque enough, or have left the grid (fewer
+            # samples than asked for), are done.
+            keep = torch.nonzero(
+                (alive_outputs[:, 3] <= 1.0 - early_stop_eps)
+                & (samples.chunk_cnts == n_samples)
+            ).squeeze(-1)
+            n_alive = keep.shape[0]
+            alive = alive[keep]
+            alive_outputs = alive_outputs[keep]
+            rays_o, rays_d = rays_o[keep], rays_d[keep]
+            near_planes = termination_planes[keep]
+            far_planes = far_planes[keep]
+            t_sorted, t_indices = t_sorted[keep], t_indices[keep]
+            hits = hits[keep]
+
+        colors, opacities, depths = outputs.split([3, 1, 1], dim=-1)
+        depths = depths / opacities.clamp_min(torch.finfo(depths.dtype).eps)
+        if render_bkgd is not None:
+            colors = colors + render_bkgd * (1.0 - opacities)
+        return (
+            colors,
+            opacities,
+            depths,
+            {"n_evals": n_evals, "n_waves": n_waves},
+        )
+
     @torch.no_grad()
     def update_every_n_steps(
         self,
@@ -229,6 +483,7 @@ class OccGridEstimator(AbstractEstimator):
         ema_decay: float = 0.95,
         warmup_steps: int = 256,
         n: int = 16,
+        budget: Optional[int] = None,
     ) -> None:
         """Update the estimator every n steps during training.
 
@@ -242,6 +497,13 @@ class OccGridEstimator(AbstractEstimator):
                 stage we change the sampling strategy to 1/4 uniformly sampled cells
                 together with 1/4 occupied cells. Default: 256.
             n: Update the grid every n steps. Default: 16.
+            budget: Optional. If provided, after the warmup stage refresh at
+                most `budget` cells at every step instead of a quarter of the
+                grid every n steps, to keep the cost per step flat. Half of the
+                budget goes to the cells the samples of :meth:`sampling` fell
+                in, the most stale and visited first, and the rest to a sweep
+                over the grid, so that every cell is refreshed at least every
+                `2 * cells / budget` steps. Default: None.
         """
         if not self.training:
             raise RuntimeError(
@@ -249,7 +511,21 @@ class OccGridEstimator(AbstractEstimator):
                 "Please call _update() directly if you want to update the "
                 "field during inference."
             )
-        if step % n == 0 and self.training:
+        self._check_updatable()
+        if budget is not None and not self.SUPPORTS_BUDGETED_UPDATES:
+            raise ValueError(
+                f"{type(self).__name__} does not support budgeted updates. "
+                "Please call update_every_n_steps() without `budget`."
+            )
+        if budget is not None and step >= warmup_steps:
+            self._update_budgeted(
+                step=step,
+                occ_eval_fn=occ_eval_fn,
+                occ_thre=occ_thre,
+                ema_decay=ema_decay,
+                budget=budget,
+            )
+        elif step % n == 0 and self.training:
             self._update(
                 step=step,
                 occ_eval_fn=occ_eval_fn,
@@ -280,56 +556,227 @@ class OccGridEstimator(AbstractEstimator):
             near_plane: Near plane distance
             chunk: The chunk size to split the cells (to avoid OOM)
         """
+        self._check_updatable()
         assert K.dim() == 3 and K.shape[1:] == (3, 3)
         assert c2w.dim() == 3 and (
             c2w.shape[1:] == (3, 4) or c2w.shape[1:] == (4, 4)
         )
         assert K.shape[0] == c2w.shape[0] or K.shape[0] == 1
 
-        N_cams = c2w.shape[0]
         w2c_R = c2w[:, :3, :3].transpose(2, 1)  # (N_cams, 3, 3)
         w2c_T = -w2c_R @ c2w[:, :3, 3:]  # (N_cams, 3, 1)
 
         lvl_indices = self._get_all_cells()
         for lvl, indices in enumerate(lvl_indices):
-            grid_coords = self.grid_coords[indices]
-
             for i in range(0, len(indices), chunk):
-                x = grid_coords[i : i + chunk] / (self.resolution - 1)
                 indices_chunk = indices[i : i + chunk]
-                # voxel coordinates [0, 1]^3 -> world
-                xyzs_w = (
-                    self.aabbs[lvl, :3]
-                    + x * (self.aabbs[lvl, 3:] - self.aabbs[lvl, :3])
-                ).T
-                xyzs_c = w2c_R @ xyzs_w + w2c_T  # (N_cams, 3, chunk)
-                uvd = K @ xyzs_c  # (N_cams, 3, chunk)
-                uv = uvd[:, :2] / uvd[:, 2:]  # (N_cams, 2, chunk)
-                in_image = (
-                    (uvd[:, 2] >= 0)
-                    & (uv[:, 0] >= 0)
-                    & (uv[:, 0] < width)
-                    & (uv[:, 1] >= 0)
-                    & (uv[:, 1] < height)
+                valid_mask = self._visible_to_cameras(
+                    lvl,
+                    _unravel_index(indices_chunk, self.resolution),
+                    K,
+                    w2c_R,
+                    w2c_T,
+                    width,
+                    height,
+                    near_plane,
                 )
-                covered_by_cam = (
-                    uvd[:, 2] >= near_plane
-                ) & in_image  # (N_cams, chunk)
-                # if the cell is visible by at least one camera
-                count = covered_by_cam.sum(0) / N_cams
-
-                too_near_to_cam = (
-                    uvd[:, 2] < near_plane
-                ) & in_image  # (N, chunk)
-                # if the cell is too close (in front) to any camera
-                too_near_to_any_cam = too_near_to_cam.any(0)
-                # a valid cell should be visible by at least one camera and not too close to any camera
-                valid_mask = (count > 0) & (~too_near_to_any_cam)
-
                 cell_ids_base = lvl * self.cells_per_lvl
                 self.occs[cell_ids_base + indices_chunk] = torch.where(
                     valid_mask, 0.0, -1.0
                 )
+        self._visible_occ_sum = self._n_visible = None
+        self._invalidate_mips()
+
+    def _visible_to_cameras(
+        self,
+        lvl: int,
+        grid_coords: Tensor,
+        K: Tensor,
+        w2c_R: Tensor,
+        w2c_T: Tensor,
+        width: int,
+        height: int,
+        near_plane: float,
+    ) -> Tensor:
+        """Whether the cells at `grid_coords` of level `lvl` are visible by at
+        least one camera and not too close to any camera."""
+        N_cams = w2c_R.shape[0]
+        x = grid_coords / (self.resolution - 1)
+        # voxel coordinates [0, 1]^3 -> world
+        xyzs_w = (
+            self.aabbs[lvl, :3]
+            + x * (self.aabbs[lvl, 3:] - self.aabbs[lvl, :3])
+        ).T
+        xyzs_c = w2c_R @ xyzs_w + w2c_T  # (N_cams, 3, chunk)
+        uvd = K @ xyzs_c  # (N_cams, 3, chunk)
+        uv = uvd[:, :2] / uvd[:, 2:]  # (N_cams, 2, chunk)
+        in_image = (
+            (uvd[:, 2] >= 0)
+            & (uv[:, 0] >= 0)
+            & (uv[:, 0] < width)
+            & (uv[:, 1] >= 0)
+            & (uv[:, 1] < height)
+        )
+        covered_by_cam = (uvd[:, 2] >= near_plane) & in_image  # (N_cams, chunk)
+        # if the cell is visible by at least one camera
+        count = covered_by_cam.sum(0) / N_cams
+
+        too_near_to_cam = (uvd[:, 2] < near_plane) & in_image  # (N, chunk)
+        # if the cell is too close (in front) to any camera
+        too_near_to_any_cam = too_near_to_cam.any(0)
+        # a valid cell should be visible by at least one camera and not too close to any camera
+        return (count > 0) & (~too_near_to_any_cam)
+
+    @torch.no_grad()
+    def save_snapshot(self, path: str) -> None:
+        """Save the grid to a standalone snapshot file.
+
+        The snapshot is a 64-byte little-endian header followed by the
+        `aabbs` (float32), the `occs` (float16) and the bit-packed `binaries`
+        (uint8), each section aligned to 64 bytes. The header holds the magic
+        `b"NACCOCC\\0"`, the format version, the number of levels, the
+        resolution, the layout of the binaries and the byte offsets of the
+        three sections (see `_SNAPSHOT_HEADER`), so the sections can be
+        memory mapped, e.g. with `np.memmap`, without unpickling anything.
+
+        The binaries of grids that are cubes with a power of 2 resolution are
+        stored as the bits of a :class:`nerfacc.grid.MortonGrid`
+        (`_SNAPSHOT_MORTON`), which :meth:`from_snapshot` traverses in place.
+        Other grids are stored in row-major order, most significant bit first,
+        as `np.packbits` (`_SNAPSHOT_ROW_MAJOR`).
+
+        Args:
+            path: Path of the snapshot file.
+        """
+        if not self.SUPPORTS_SNAPSHOTS:
+            raise NotImplementedError(
+                f"{type(self).__name__} does not support snapshots."
+            )
+        n_cells = self.levels * self.cells_per_lvl
+        aabbs_offset = _align(_SNAPSHOT_HEADER.size)
+        occs_offset = _align(aabbs_offset + self.levels * 6 * 4)
+        binaries_offset = _align(occs_offset + n_cells * 2)
+        n_bytes = binaries_offset + (n_cells + 7) // 8
+
+        binaries = self.binaries
+        if _is_morton_resolution(self.resolution):
+            layout = _SNAPSHOT_MORTON
+            if not isinstance(binaries, MortonGrid):
+                binaries = MortonGrid.from_dense(binaries)
+            bits = binaries.bits.flatten()
+        else:
+            layout = _SNAPSHOT_ROW_MAJOR
+            bits = _packbits(binaries.flatten())
+
+        with open(path, "wb") as f:
+            f.truncate(n_bytes)
+        buffer = torch.from_file(
+            path, shared=True, size=n_bytes, dtype=torch.uint8
+        )
+        header = _SNAPSHOT_HEADER.pack(
+            _SNAPSHOT_MAGIC,
+            _SNAPSHOT_VERSION,
+            self.levels,
+            *self.resolution.tolist(),
+            layout,
+            aabbs_offset,
+            occs_offset,
+            binaries_offset,
+        )
+        buffer[: len(header)] = torch.tensor(list(header), dtype=torch.uint8)
+        buffer[aabbs_offset:occs_offset].view(torch.float32)[
+            : self.levels * 6
+        ] = (self.aabbs.flatten().float().cpu())
+        buffer[occs_offset:binaries_offset].view(torch.float16)[
+            :n_cells
+        ] = self.occs.half().cpu()
+        buffer[binaries_offset:] = bits.cpu()
+
+    @classmethod
+    @torch.no_grad()
+    def from_snapshot(
+        cls, path: str, device: Union[torch.device, str] = "cpu"
+    ) -> "OccGridEstimator":
+        """Load a grid saved by :meth:`save_snapshot`.
+
+        The file is memory mapped without unpickling anything. If its
+        binaries are in the Morton layout, the returned estimator is
+        read-only: its `occs` (float16) and the bits of its binaries (a
+        :class:`nerfacc.grid.MortonGrid`) are views of the mapping, so the
+        processes loading the same snapshot on CPU share one copy of the grid
+        in the page cache and start without unpacking it. It cannot be
+        updated, and it traverses the grid without the occupancy pyramid.
+        Otherwise the sections are copied into the buffers of a regular
+        estimator, i.e. 5 bytes per cell per process.
+
+        Note:
+            The mapping is writable, as `torch.from_file` maps files shared
+            for writing only, so the file must be writable and must not be
+            rewritten while the estimator is in use.
+
+        Args:
+            path: Path of the snapshot file.
+            device: Device of the returned estimator. Default: "cpu".
+
+        Returns:
+            An :class:`OccGridEstimator` in eval mode.
+        """
+        if not cls.SUPPORTS_SNAPSHOTS:
+            raise NotImplementedError(
+                f"{cls.__name__} does not support snapshots."
+            )
+        buffer = torch.from_file(
+            path, shared=True, size=os.path.getsize(path), dtype=torch.uint8
+        )
+        (
+            magic,
+            version,
+            levels,
+            resx,
+            resy,
+            resz,
+            layout,
+            aabbs_offset,
+            occs_offset,
+            binaries_offset,
+        ) = _SNAPSHOT_HEADER.unpack(
+            bytes(buffer[: _SNAPSHOT_HEADER.size].tolist())
+        )
+        # the layout field was padding, i.e. zero, in the first version.
+        if magic != _SNAPSHOT_MAGIC or version not in (1, _SNAPSHOT_VERSION):
+            raise ValueError(
+                f"{path} is not an occupancy grid snapshot "
+                f"(magic {magic}, version {version})."
+            )
+        resolution = [resx, resy, resz]
+        n_cells = levels * resx * resy * resz
+
+        aabbs = buffer[aabbs_offset:occs_offset].view(torch.float32)
+        aabbs = aabbs[: levels * 6].view(levels, 6).clone()
+        occs = buffer[occs_offset:binaries_offset].view(torch.float16)
+        occs = occs[:n_cells]
+        bits = buffer[binaries_offset : binaries_offset + (n_cells + 7) // 8]
+
+        if layout == _SNAPSHOT_MORTON:
+            estimator = _MappedOccGridEstimator(
+                roi_aabb=aabbs[0], resolution=resolution, levels=levels
+            )
+            estimator.occs = occs
+            estimator.morton_bits = bits.view(levels, -1)
+        else:
+            binaries = _unpackbits(bits, n_cells)
+            estimator = cls(
+                roi_aabb=aabbs[0], resolution=resolution, levels=levels
+            )
+            estimator.occs.copy_(occs)
+            estimator.binaries.copy_(binaries.view(estimator.binaries.shape))
+            estimator._invalidate_mips()
+        estimator.aabbs.copy_(aabbs)
+        return estimator.to(device).eval()
+
+    def _mean_occupancy(self) -> float:
+        """Mean of the occupancy values of all the cells."""
+        return self.occs.mean().item()
 
     @torch.no_grad()
     def _get_all_cells(self) -> List[Tensor]:
@@ -337,8 +784,10 @@ class OccGridEstimator(AbstractEstimator):
         lvl_indices = []
         for lvl in range(self.levels):
             # filter out the cells with -1 density (non-visible to any camera)
-            cell_ids = lvl * self.cells_per_lvl + self.grid_indices
-            indices = self.grid_indices[self.occs[cell_ids] >= 0.0]
+            occs = self.occs[
+                lvl * self.cells_per_lvl : (lvl + 1) * self.cells_per_lvl
+            ]
+            indices = torch.nonzero(occs >= 0.0)[:, 0]
             lvl_indices.append(indices)
         return lvl_indices
 
@@ -382,7 +831,7 @@ class OccGridEstimator(AbstractEstimator):
 
         for lvl, indices in enumerate(lvl_indices):
             # infer occupancy: density * step_size
-            grid_coords = self.grid_coords[indices]
+            grid_coords = _unravel_index(indices, self.resolution)
             x = (
                 grid_coords + torch.rand_like(grid_coords, dtype=torch.float32)
             ) / self.resolution
@@ -402,22 +851,192 @@ class OccGridEstimator(AbstractEstimator):
             # )
         thre = torch.clamp(self.occs[self.occs >= 0].mean(), max=occ_thre)
         self.binaries = (self.occs > thre).view(self.binaries.shape)
+        self._visible_occ_sum = self._n_visible = None
+        self._invalidate_mips()
+
+    @torch.no_grad()
+    def _update_budgeted(
+        self,
+        step: int,
+        occ_eval_fn: Callable,
+        occ_thre: float = 0.01,
+        ema_decay: float = 0.95,
+        budget: int = 2**16,
+    ) -> None:
+        """Update the occ field in the EMA way for at most `budget` cells, and
+        only their binaries: the most stale and visited cells among those the
+        samples fell in, and the next cells of a sweep over the grid."""
+        n_cells = self.occs.numel()
+        if self.visits is None:
+            self.visits = torch.zeros_like(self.occs)
+            # all the cells are as stale as each other to begin with.
+            self.last_refresh = torch.full(
+                (n_cells,), step - 1, dtype=torch.int32, device=self.device
+            )
+        if self._visible_occ_sum is None:
+            # resynced after each sweep, as the sum drifts with the updates.
+            self._visible_occ_sum = self.occs.clamp(min=0).sum(
+                dtype=torch.float64
+            )
+            self._n_visible = (self.occs >= 0).sum()
+
+        # the visited cells with the highest priority.
+        visited = torch.empty((0,), dtype=torch.long, device=self.device)
+        if len(self._visited) > 0:
+            visited = torch.cat(self._visited)
+            # cells with -1 density are not visible to any camera.
+            visited = visited[
+                (self.visits[visited] > 0) & (self.occs[visited] >= 0)
+            ]
+        staleness = step - self.last_refresh[visited]
+        priority = staleness * (1.0 + torch.log1p(self.visits[visited]))
+        _, selector = torch.topk(
+            priority, min(budget - budget // 2, visited.numel())
+        )
+        selected = torch.unique(visited[selector])
+
+        # the next cells of the sweep, with what is left of the budget.
+        n_sweep = min(budget - selected.numel(), n_cells)
+        swept = (
+            torch.arange(n_sweep, device=self.device) + self._sweep_start
+        ) % n_cells
+        self._sweep_start += n_sweep
+        swept = swept[self.occs[swept] >= 0]
+
+        cell_ids = torch.unique(torch.cat([selected, swept]))
+        # infer occupancy: density * step_size
+        lvls = torch.div(cell_ids, self.cells_per_lvl, rounding_mode="floor")
+        grid_coords = _unravel_index(
+            cell_ids % self.cells_per_lvl, self.resolution
+        )
+        x = (
+            grid_coords + torch.rand_like(grid_coords, dtype=torch.float32)
+        ) / self.resolution
+        # voxel coordinates [0, 1]^3 -> world
+        aabbs = self.aabbs[lvls]
+        x = aabbs[:, :3] + x * (aabbs[:, 3:] - aabbs[:, :3])
+        occ = occ_eval_fn(x).squeeze(-1)
+        # ema update
+        old = self.occs[cell_ids]
+        new = torch.maximum(old * ema_decay, occ)
+        self.occs[cell_ids] = new
+        self._visible_occ_sum += (new - old).sum(dtype=torch.float64)
+        self.last_refresh[cell_ids] = step
+        self.visits[cell_ids] = 0.0
+        # the visited cells left for the next steps.
+        self._visited = [visited[self.visits[visited] > 0]]
+
+        mips_valid = self._mips_valid()
+        thre = torch.clamp(
+            self._visible_occ_sum / self._n_visible.clamp(min=1), max=occ_thre
+        ).to(new)
+        self.binaries.view(-1)[cell_ids] = new > thre
+        if mips_valid:
+            _refresh_occupancy_mips(
+                self._mips, self.binaries, lvls, grid_coords
+            )
+            self._mips_key = (self.binaries, self.binaries._version)
+        else:
+            self._invalidate_mips()
+        if self._sweep_start >= n_cells:
+            self._sweep_start %= n_cells
+            self._visible_occ_sum = None
+
+    @torch.no_grad()
+    def _record_visits(self, x: Tensor) -> None:
+        """Count the samples at positions `x` (N, 3) in the cells they fall in."""
+        lvls, grid_coords, selector = _query_cells(
+            x, self.binaries.shape, self.aabbs[0]
+        )
+        res = self.resolution
+        cell_ids = (
+            lvls * self.cells_per_lvl
+            + (grid_coords[:, 0] * res[1] + grid_coords[:, 1]) * res[2]
+            + grid_coords[:, 2]
+        )
+        cell_ids = cell_ids[selector]
+        # only the cells not visited yet join the candidates. The samples of a
+        # ray in a cell are consecutive, so most duplicates go cheaply.
+        fresh = torch.unique_consecutive(cell_ids[self.visits[cell_ids] == 0])
+        self.visits.index_put_(
+            (cell_ids,),
+            torch.ones_like(cell_ids, dtype=self.visits.dtype),
+            accumulate=True,
+        )
+        self._visited.append(fresh)
+
+
+class _MappedOccGridEstimator(OccGridEstimator):
+    """Read-only :class:`OccGridEstimator` returned by
+    :meth:`OccGridEstimator.from_snapshot`, whose `occs` (float16) and
+    Morton-ordered bits of the binaries are views of the mapped snapshot."""
+
+    SUPPORTS_BUDGETED_UPDATES: bool = False
+    SUPPORTS_UPDATES: bool = False
+
+    def _init_occupancy(self, resolution: Tensor) -> None:
+        # replaced by the views of the snapshot once mapped.
+        self.register_buffer("occs", torch.zeros((0,), dtype=torch.float16))
+        self.register_buffer(
+            "morton_bits",
+            torch.zeros((self.levels, 0), dtype=torch.uint8),
+        )
+
+    @property
+    def binaries(self) -> MortonGrid:
+        return MortonGrid(self.morton_bits)
+
+    @property
+    def mips(self) -> None:
+        return None
 
 
-def _meshgrid3d(
-    res: Tensor, device: Union[torch.device, str] = "cpu"
-) -> Tensor:
-    """Create 3D grid coordinates."""
-    assert len(res) == 3
-    res = res.tolist()
+def _unravel_index(indices: Tensor, res: Tensor) -> Tensor:
+    """Grid coordinates (n, 3) of the flattened cell `indices` of a 3D grid
+    with resolution `res`, computed instead of stored."""
     return torch.stack(
-        torch.meshgrid(
-            [
-                torch.arange(res[0], dtype=torch.long),
-                torch.arange(res[1], dtype=torch.long),
-                torch.arange(res[2], dtype=torch.long),
-            ],
-            indexing="ij",
-        ),
+        [
+            torch.div(indices, res[1] * res[2], rounding_mode="floor"),
+            torch.div(indices, res[2], rounding_mode="floor") % res[1],
+            indices % res[2],
+        ],
         dim=-1,
-    ).to(device)
+    ).long()
+
+
+# Header of the snapshots written by `OccGridEstimator.save_snapshot`: magic,
+# version, levels, resolution, layout of the binaries, and the byte offsets of
+# the aabbs, occs and binaries sections.
+_SNAPSHOT_HEADER = struct.Struct("<8sII3II3Q8x")
+_SNAPSHOT_MAGIC = b"NACCOCC\0"
+_SNAPSHOT_VERSION = 2
+_SNAPSHOT_ROW_MAJOR = 0
+_SNAPSHOT_MORTON = 1
+
+
+def _is_morton_resolution(resolution: Tensor) -> bool:
+    """Whether grids of this resolution can be a :class:`MortonGrid`."""
+    res = int(resolution[0])
+    return (
+        (resolution == res).all().item() and res >= 2 and res & (res - 1) == 0
+    )
+
+
+def _align(offset: int, alignment: int = 64) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _packbits(bits: Tensor) -> Tensor:
+    """Pack a flat boolean tensor into uint8, most significant bit first."""
+    bits = torch.nn.functional.pad(bits, (0, -len(bits) % 8))
+    shifts = torch.arange(7, -1, -1, device=bits.device, dtype=torch.uint8)
+    return (bits.view(-1, 8).to(torch.uint8) << shifts).sum(
+        dim=-1, dtype=torch.uint8
+    )
+
+
+def _unpackbits(packed: Tensor, n: int) -> Tensor:
+    """Inverse of :func:`_packbits`, for the first `n` bits."""
+    shifts = torch.arange(7, -1, -1, device=packed.device, dtype=torch.uint8)
+    bits = (packed[:, None] >> shifts) & 1
+    return bits.flatten()[:n].bool()
@@ -0,0 +1,355 @@
+"""
+Copyright (c) 2022 Ruilong Li, UC Berkeley.
+"""
+from typing import Callable, Iterator, List, Optional, Union
+
+import torch
+from torch import Tensor
+
+from ..grid import BrickGrid
+from .occ_grid import OccGridEstimator, _unravel_index
+
+# `brick_table` values of the blocks that have no brick.
+_EMPTY = -1  # all the cells have occupancy 0.
+_INVISIBLE = -2  # all the cells are invisible to the cameras (occupancy -1).
+
+
+class SparseOccGridEstimator(OccGridEstimator):
+    """Occupancy grid estimator that only stores the occupied blocks of cells.
+
+    The cells are grouped into blocks of 8x8x8. A table of shape
+    (levels, resx / 8, resy / 8, resz / 8) maps each block either to a brick,
+    holding the occupancy values and binaries of its cells, or marks it as
+    empty or invisible to the cameras. Only the blocks with occupied cells,
+    or with both visible and invisible cells, have a brick, so the memory
+    grows with the occupied space rather than with the resolution. The cell
+    coordinates are computed on the fly, in chunks, instead of being stored.
+
+    The binaries are a :class:`nerfacc.grid.BrickGrid`, that
+    :func:`nerfacc.traverse_grids` marches through directly.
+
+    Note:
+        Unlike :class:`OccGridEstimator`, which binarizes the occupancy with
+        `min(mean occupancy, occ_thre)`, the cells are binarized with
+        `occ_thre`, so that the occupancy values below it need not be stored:
+        a brick is freed once none of its cells is above `occ_thre`.
+
+    Args:
+        roi_aabb: The axis-aligned bounding box of the region of interest.
+        resolution: The resolution of the grid, a multiple of 8. If an integer
+            is given, the grid is assumed to be a cube. Default: 128.
+        levels: The number of levels of the grid. Default: 1.
+        chunk_size: The number of cells evaluated at once when updating the
+            grid. Default: 2**20.
+    """
+
+    # the occupancy values and binaries of all the cells are not stored.
+    SUPPORTS_SNAPSHOTS: bool = False
+    SUPPORTS_BUDGETED_UPDATES: bool = False
+
+    def __init__(
+        self,
+        roi_aabb: Union[List[int], Tensor],
+        resolution: Union[int, List[int], Tensor] = 128,
+        levels: int = 1,
+        chunk_size: int = 2**20,
+        **kwargs,
+    ) -> None:
+        super().__init__(roi_aabb, resolution, levels, **kwargs)
+        self.chunk_size = chunk_size
+
+    def _init_occupancy(self, resolution: Tensor) -> None:
+        n = BrickGrid.BRICK_SIZE
+        assert (
+            resolution % n == 0
+        ).all(), f"The resolution must be a multiple of {n}! Got {resolution}."
+        self.register_buffer(
+            "brick_table",
+            torch.full(
+                [self.levels] + (resolution // n).tolist(),
+                _EMPTY,
+                dtype=torch.int32,
+            ),
+        )
+        self.register_buffer("brick_occs", torch.zeros((0, n**3)))
+        self.register_buffer(
+            "brick_binaries", torch.zeros((0, n, n, n), dtype=torch.bool)
+        )
+
+    @property
+    def binaries(self) -> BrickGrid:
+        return BrickGrid(self.brick_table, self.brick_binaries)
+
+    @property
+    def mips(self) -> None:
+        # the empty blocks have no brick already.
+        return None
+
+    @property
+    def blocks_per_lvl(self) -> int:
+        return self.brick_table[0].numel()
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # the number of bricks of the checkpoint may differ from ours.
+        for name in ["brick_occs", "brick_binaries"]:
+            if prefix + name in state_dict:
+                setattr(
+                    self,
+                    name,
+                    getattr(self, name).new_empty(
+                        state_dict[prefix + name].shape
+                    ),
+                )
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    @torch.no_grad()
+    def mark_invisible_cells(
+        self,
+        K: Tensor,
+        c2w: Tensor,
+        width: int,
+        height: int,
+        near_plane: float = 0.0,
+        chunk: int = 32**3,
+    ) -> None:
+        assert K.dim() == 3 and K.shape[1:] == (3, 3)
+        assert c2w.dim() == 3 and (
+            c2w.shape[1:] == (3, 4) or c2w.shape[1:] == (4, 4)
+        )
+        assert K.shape[0] == c2w.shape[0] or K.shape[0] == 1
+
+        w2c_R = c2w[:, :3, :3].transpose(2, 1)  # (N_cams, 3, 3)
+        w2c_T = -w2c_R @ c2w[:, :3, 3:]  # (N_cams, 3, 1)
+
+        # like the dense grid, this resets the occupancy of all the cells.
+        n_cells = BrickGrid.BRICK_SIZE**3
+        brick_occs = []
+        n_bricks = 0
+        for lvl in range(self.levels):
+            table = self.brick_table[lvl].view(-1)
+            for blocks in torch.split(
+                torch.arange(self.blocks_per_lvl, device=table.device),
+                max(chunk // n_cells, 1),
+            ):
+                valid_mask = self._visible_to_cameras(
+                    lvl,
+                    self._block_cells(blocks).view(-1, self.DIM),
+                    K,
+                    w2c_R,
+                    w2c_T,
+                    width,
+                    height,
+                    near_plane,
+                ).view(-1, n_cells)
+                all_valid = valid_mask.all(dim=-1)
+                mixed = valid_mask.any(dim=-1) & ~all_valid
+                table[blocks] = torch.where(all_valid, _EMPTY, _INVISIBLE).to(
+                    table
+                )
+                ids = torch.cumsum(mixed, 0, dtype=torch.int32) - 1 + n_bricks
+                table[blocks[mixed]] = ids[mixed]
+                brick_occs.append(torch.where(valid_mask[mixed], 0.0, -1.0))
+                n_bricks += len(brick_occs[-1])
+        self.brick_occs = torch.cat(brick_occs).to(self.brick_occs)
+        self.brick_binaries = torch.zeros_like(
+            self.brick_occs, dtype=torch.bool
+        ).view(-1, *[BrickGrid.BRICK_SIZE] * self.DIM)
+
+    def _mean_occupancy(self) -> float:
+        n_invisible = (self.brick_table == _INVISIBLE).sum()
+        total = self.brick_occs.sum() - n_invisible * self.brick_occs.shape[1]
+        return (total / (self.levels * self.cells_per_lvl)).item()
+
+    def _block_cells(self, blocks: Tensor, local: Optional[Tensor] = None):
+        """Grid coordinates (n_blocks, 512, 3) of the cells of the blocks of a
+        level, given by their flattened indices in the level. If `local` is
+        given, only the coordinates (n_blocks, 3) of the cell `local[i]` of
+        each block `blocks[i]`."""
+        n = BrickGrid.BRICK_SIZE
+        block_coords = _unravel_index(
+            blocks, torch.tensor(self.brick_table.shape[1:])
+        )
+        if local is None:
+            local = torch.arange(n**3, device=blocks.device)
+            block_coords = block_coords[:, None]
+        return block_coords * n + _unravel_index(local, torch.tensor([n] * 3))
+
+    def _locate(self, lvl: int, grid_coords: Tensor):
+        """Brick (or `_EMPTY` / `_INVISIBLE`) and index in the brick of the
+        cells at `grid_coords` of level `lvl`."""
+        n = BrickGrid.BRICK_SIZE
+        block_coords = grid_coords // n
+        local_coords = grid_coords % n
+        bricks = self.brick_table[lvl][tuple(block_coords.unbind(-1))].long()
+        local = (
+            local_coords[:, 0] * n + local_coords[:, 1]
+        ) * n + local_coords[:, 2]
+        return bricks, local
+
+    def _lookup_occs(self, lvl: int, grid_coords: Tensor) -> Tensor:
+        """Occupancy values of the cells at `grid_coords` of level `lvl`."""
+        bricks, local = self._locate(lvl, grid_coords)
+        occs = torch.where(bricks == _INVISIBLE, -1.0, 0.0)
+        # the bricks reserved during an update are not allocated yet.
+        stored = (bricks >= 0) & (bricks < len(self.brick_occs))
+        occs[stored] = self.brick_occs[bricks[stored], local[stored]]
+        return occs
+
+    def _cells_to_update(self, lvl: int, warmup: bool) -> Iterator[Tensor]:
+        """Grid coordinates of the visible cells of level `lvl` to update, in
+        chunks of about `chunk_size` cells."""
+        n_cells = BrickGrid.BRICK_SIZE**3
+        device = self.brick_table.device
+        if warmup:
+            # all the visible cells.
+            visible = torch.nonzero(
+                self.brick_table[lvl].view(-1) != _INVISIBLE
+            )[:, 0]
+            for blocks in torch.split(
+                visible, max(self.chunk_size // n_cells, 1)
+            ):
+                coords = self._block_cells(blocks).view(-1, self.DIM)
+                yield coords[self._lookup_occs(lvl, coords) >= 0.0]
+            return
+
+        # a quarter of the cells sampled uniformly, plus as many occupied cells
+        # at most, like the dense grid.
+        N = self.cells_per_lvl // 4
+        for i in range(0, N, self.chunk_size):
+            indices = torch.randint(
+                self.cells_per_lvl,
+                (min(self.chunk_size, N - i),),
+                device=device,
+            )
+            coords = _unravel_index(indices, self.resolution)
+            yield coords[self._lookup_occs(lvl, coords) >= 0.0]
+
+        table = self.brick_table[lvl].view(-1)
+        blocks = torch.nonzero(
+            (table >= 0) & (table < len(self.brick_binaries))
+        )[:, 0]
+        occupied = torch.nonzero(
+            self.brick_binaries[table[blocks].long()].view(-1, n_cells)
+        )
+        if len(occupied) > N:
+            occupied = occupied[
+                torch.randint(len(occupied), (N,), device=device)
+            ]
+        for chunk in torch.split(occupied, self.chunk_size):
+            yield self._block_cells(blocks[chunk[:, 0]], chunk[:, 1])
+
+    def _reserve_bricks(
+        self, lvl: int, grid_coords: Tensor, n_bricks: int
+    ) -> int:
+        """Assign the ids of new bricks, from `n_bricks` on, to the blocks of
+        the cells at `grid_coords` of level `lvl`, and return the number of
+        bricks with them. The bricks are allocated by :meth:`_allocate_bricks`.
+        """
+        n = BrickGrid.BRICK_SIZE
+        _, bx, by, bz = self.brick_table.shape
+        block_coords = grid_coords // n
+        blocks = torch.unique(
+            (block_coords[:, 0] * by + block_coords[:, 1]) * bz
+            + block_coords[:, 2]
+        )
+        self.brick_table[lvl].view(-1)[blocks] = torch.arange(
+            n_bricks, n_bricks + len(blocks), device=blocks.device
+        ).to(self.brick_table)
+        return n_bricks + len(blocks)
+
+    def _allocate_bricks(self, n_bricks: int) -> None:
+        """Grow the bricks to `n_bricks`, with empty ones."""
+        n = BrickGrid.BRICK_SIZE
+        n_new = n_bricks - len(self.brick_occs)
+        self.brick_occs = torch.cat(
+            [self.brick_occs, self.brick_occs.new_zeros((n_new, n**3))]
+        )
+        self.brick_binaries = torch.cat(
+            [
+                self.brick_binaries,
+                self.brick_binaries.new_zeros((n_new, n, n, n)),
+            ]
+        )
+
+    def _free_bricks(self, occ_thre: float) -> None:
+        """Free the bricks with no cell above `occ_thre`, unless they have both
+        visible and invisible cells, and binarize the others."""
+        n_cells = BrickGrid.BRICK_SIZE**3
+        binaries = self.brick_occs > occ_thre
+        invisible = self.brick_occs < 0.0
+        n_invisible = invisible.sum(dim=-1)
+        keep = binaries.any(dim=-1) | (
+            (n_invisible > 0) & (n_invisible < n_cells)
+        )
+        # blocks without a brick
+        free = torch.where(n_invisible == n_cells, _INVISIBLE, _EMPTY)
+        ids = torch.cumsum(keep, 0, dtype=torch.int32) - 1
+        new_ids = torch.where(keep, ids, free.to(ids))
+
+        table = self.brick_table
+        allocated = table >= 0
+        table[allocated] = new_ids[table[allocated].long()]
+        self.brick_occs = self.brick_occs[keep]
+        self.brick_binaries = binaries[keep].view(
+            -1, *[BrickGrid.BRICK_SIZE] * self.DIM
+        )
+
+    @torch.no_grad()
+    def _update(
+        self,
+        step: int,
+        occ_eval_fn: Callable,
+        occ_thre: float = 0.01,
+        ema_decay: float = 0.95,
+        warmup_steps: int = 256,
+    ) -> None:
+        """Update the occ field in the EMA way."""
+        # the bricks of the blocks that get occupied are allocated at once
+        # after all the chunks, which copies the bricks once per update, and
+        # their cells are updated then.
+        n_allocated = n_bricks = len(self.brick_occs)
+        pending = []
+        for lvl in range(self.levels):
+            for grid_coords in self._cells_to_update(
+                lvl, warmup=step < warmup_steps
+            ):
+                # infer occupancy: density * step_size
+                x = (
+                    grid_coords
+                    + torch.rand_like(grid_coords, dtype=torch.float32)
+                ) / self.resolution
+                # voxel coordinates [0, 1]^3 -> world
+                x = self.aabbs[lvl, :3] + x * (
+                    self.aabbs[lvl, 3:] - self.aabbs[lvl, :3]
+                )
+                occ = occ_eval_fn(x).squeeze(-1)
+
+                bricks, local = self._locate(lvl, grid_coords)
+                new = (bricks == _EMPTY) & (occ > occ_thre)
+                if new.any():
+                    n_bricks = self._reserve_bricks(
+                        lvl, grid_coords[new], n_bricks
+                    )
+                    # only the empty blocks may have been given a brick.
+                    empty = bricks == _EMPTY
+                    bricks[empty] = self._locate(lvl, grid_coords[empty])[0]
+                # the cells of the reserved bricks wait for their allocation,
+                # and those of empty blocks that remain below the threshold
+                # are not stored.
+                reserved = bricks >= n_allocated
+                pending.append(
+                    (bricks[reserved], local[reserved], occ[reserved])
+                )
+                stored = (bricks >= 0) & ~reserved
+                bricks, local = bricks[stored], local[stored]
+                # ema update
+                self.brick_occs[bricks, local] = torch.maximum(
+                    self.brick_occs[bricks, local] * ema_decay, occ[stored]
+                )
+        if n_bricks > n_allocated:
+            self._allocate_bricks(n_bricks)
+            for bricks, local, occ in pending:
+                self.brick_occs[bricks, local] = torch.maximum(
+                    self.brick_occs[bricks, local] * ema_decay, occ
+                )
+        self._free_bricks(occ_thre)
@@ -1,7 +1,8 @@
 """
 Copyright (c) 2022 Ruilong Li, UC Berkeley.
 """
-from typing import Optional, Tuple
+from dataclasses import dataclass
+from typing import Optional, Tuple, Union
 
 import torch
 from torch import Tensor
@@ -10,6 +11,143 @@ from . import cuda as _C
 from .data_specs import RayIntervals, RaySamples
 
 
+@dataclass
+class BrickGrid:
+    """Binary occupancy grids stored as 8x8x8 bricks of cells.
+
+    Only the blocks of 8x8x8 cells that have occupied cells are stored, so
+    the memory grows with the occupied space rather than with the resolution.
+    It can be passed to :func:`traverse_grids` in place of dense binaries.
+
+    Args:
+        brick_table: (m, resx / 8, resy / 8, resz / 8) IntTensor. The index
+            in `bricks` of each block of cells, or a negative value if all
+            the cells of the block are empty.
+        bricks: (n_bricks, 8, 8, 8) BoolTensor. Occupancy of the cells of
+            each stored block.
+    """
+
+    brick_table: Tensor
+    bricks: Tensor
+
+    BRICK_SIZE = 8
+
+    @property
+    def shape(self) -> torch.Size:
+        """Shape of the equivalent dense binaries, (m, resx, resy, resz)."""
+        m, bx, by, bz = self.brick_table.shape
+        n = self.BRICK_SIZE
+        return torch.Size([m, bx * n, by * n, bz * n])
+
+    def size(self, dim: Optional[int] = None):
+        return self.shape if dim is None else self.shape[dim]
+
+    @property
+    def device(self) -> torch.device:
+        return self.brick_table.device
+
+    @classmethod
+    def from_dense(cls, binaries: Tensor) -> "BrickGrid":
+        """Bricks of dense (m, resx, resy, resz) binaries. The resolution
+        must be a multiple of 8."""
+        n = cls.BRICK_SIZE
+        m, resx, resy, resz = binaries.shape
+        assert (
+            resx % n == 0 and resy % n == 0 and resz % n == 0
+        ), f"The resolution must be a multiple of {n}! Got {binaries.shape}."
+        blocks = binaries.reshape(m, resx // n, n, resy // n, n, resz // n, n)
+        blocks = blocks.permute(0, 1, 3, 5, 2, 4, 6)
+        occupied = blocks.flatten(-3).any(dim=-1)
+        brick_table = torch.cumsum(occupied.flatten(), 0, dtype=torch.int32)
+        brick_table = torch.where(occupied.flatten(), brick_table - 1, -1).view(
+            occupied.shape
+        )
+        return cls(brick_table.int(), blocks[occupied].contiguous())
+
+    def to_dense(self) -> Tensor:
+        """The equivalent dense (m, resx, resy, resz) binaries."""
+        n = self.BRICK_SIZE
+        m, bx, by, bz = self.brick_table.shape
+        blocks = torch.zeros(
+            (m, bx, by, bz, n, n, n), dtype=torch.bool, device=self.device
+        )
+        occupied = self.brick_table >= 0
+        blocks[occupied] = self.bricks[self.brick_table[occupied].long()]
+        return blocks.permute(0, 1, 4, 2, 5, 3, 6).reshape(self.shape)
+
+
+@dataclass
+class MortonGrid:
+    """Binary occupancy grids bit-packed in Morton (Z-curve) order.
+
+    Neighboring cells are close in memory along every axis, not only along z
+    as in the row-major dense binaries, and each cell takes one bit. The grids
+    must be cubes with a power of 2 resolution. It can be passed to
+    :func:`traverse_grids` in place of dense binaries.
+
+    Args:
+        bits: (m, res^3 / 8) ByteTensor. The occupancy of the cell of Morton
+            code `c` is the bit `c % 8` (least significant first) of the byte
+            `c // 8`.
+    """
+
+    bits: Tensor
+
+    @property
+    def resolution(self) -> int:
+        res = 1
+        while res**3 < self.bits.shape[1] * 8:
+            res *= 2
+        return res
+
+    @property
+    def shape(self) -> torch.Size:
+        """Shape of the equivalent dense binaries, (m, res, res, res)."""
+        return torch.Size([self.bits.shape[0]] + [self.resolution] * 3)
+
+    def size(self, dim: Optional[int] = None):
+        return self.shape if dim is None else self.shape[dim]
+
+    @property
+    def device(self) -> torch.device:
+        return self.bits.device
+
+    @classmethod
+    def from_dense(cls, binaries: Tensor) -> "MortonGrid":
+        """Morton layout of dense (m, res, res, res) binaries."""
+        m, res = binaries.shape[0], binaries.shape[1]
+        assert (
+            binaries.shape[1:] == (res,) * 3
+            and res >= 2
+            and res & (res - 1) == 0
+        ), (
+            "The grids must be cubes with a power of 2 resolution! "
+            f"Got {binaries.shape}."
+        )
+        codes = _morton_codes(res, binaries.device).view(-1)
+        ordered = torch.zeros_like(binaries).view(m, -1)
+        ordered[:, codes] = binaries.reshape(m, -1)
+        shifts = torch.arange(8, device=binaries.device, dtype=torch.uint8)
+        bits = (ordered.view(m, -1, 8).to(torch.uint8) << shifts).sum(
+            dim=-1, dtype=torch.uint8
+        )
+        return cls(bits)
+
+    def to_dense(self) -> Tensor:
+        """The equivalent dense (m, res, res, res) binaries."""
+        shifts = torch.arange(8, device=self.device, dtype=torch.uint8)
+        ordered = ((self.bits[..., None] >> shifts) & 1).bool().flatten(1)
+        codes = _morton_codes(self.resolution, self.device).view(-1)
+        return ordered[:, codes].view(self.shape)
+
+    def lookup(self, levels: Tensor, coords: Tensor) -> Tensor:
+        """Occupancy of the cells at (..., 3) grid `coords` of the grids
+        `levels` (broadcastable to `coords[..., 0]`)."""
+        codes = _morton3d(coords)
+        byte = self.bits[levels, codes >> 3]
+        return ((byte >> (codes & 7).to(torch.uint8)) & 1).bool()
+
+
 @torch.no_grad()
 def ray_aabb_intersect(
     rays_o: Tensor,
@@ -96,7 +234,7 @@ def traverse_grids(
     rays_o: Tensor,  # [n_rays, 3]
     rays_d: Tensor,  # [n_rays, 3]
     # grids
-    binaries: Tensor,  # [m, resx, resy, resz]
+    binaries: Union[Tensor, BrickGrid, MortonGrid],  # [m, resx, resy, resz]
     aabbs: Tensor,  # [m, 6]
     # options
     near_planes: Optional[Tensor] = None,  # [n_rays]
@@ -110,6 +248,8 @@ def traverse_grids(
     t_sorted: Optional[Tensor] = None,  # [n_rays, n_grids * 2]
     t_indices: Optional[Tensor] = None,  # [n_rays, n_grids * 2]
     hits: Optional[Tensor] = None,  # [n_rays, n_grids]
+    # empty space skipping
+    mips: Optional[Tensor] = None,
 ) -> Tuple[RayIntervals, RaySamples, Tensor]:
     """Ray Traversal within Multiple Grids.
 
@@ -119,7 +259,8 @@ def traverse_grids(
     Args:
         rays_o: (n_rays, 3) Ray origins.
         rays_d: (n_rays, 3) Normalized ray directions.
-        binary_grids: (m, resx, resy, resz) Multiple binary grids with the same resolution.
+        binaries: (m, resx, resy, resz) Multiple binary grids with the same resolution,
+            or a :class:`BrickGrid` or a :class:`MortonGrid` of them.
         aabbs: (m, 6) Axis-aligned bounding boxes {xmin, ymin, zmin, xmax, ymax, zmax}.
         near_planes: Optional. (n_rays,) Near planes for the traversal to start. Default to 0.
         far_planes: Optional. (n_rays,) Far planes for the traversal to end. Default to infinity.
@@ -132,6 +273,11 @@ def traverse_grids(
         t_sorted: Optional. (n_rays, n_grids * 2) Pre-computed sorted t values for each ray-grid pair. Default to None.
         t_indices: Optional. (n_rays, n_grids * 2) Pre-computed sorted t indices for each ray-grid pair. Default to None.
         hits: Optional. (n_rays, n_grids) Pre-computed hit flags for each ray-grid pair. Default to None.
+        mips: Optional. The occupancy pyramid of dense `binaries` from
+            :func:`build_occupancy_mips`. If given, the traversal skips the cells of
+            the empty 2x2x2, 4x4x4 and 8x8x8 blocks without looking them up, and
+            jumps over them in one step if `cone_angle` is 0. The outputs are the
+            same up to the rounding of the sample positions. Default to None.
 
     Returns:
         A :class:`RayIntervals` object containing the intervals of the ray traversal, and
@@ -161,6 +307,20 @@ def traverse_grids(
             torch.cat([t_mins, t_maxs], dim=-1), dim=-1
         )
 
+    brick_table = torch.empty((0,), dtype=torch.int32, device=rays_o.device)
+    bricks = torch.empty((0,), dtype=torch.bool, device=rays_o.device)
+    morton_bits = torch.empty((0,), dtype=torch.uint8, device=rays_o.device)
+    if mips is None:
+        mips = torch.empty((0,), dtype=torch.bool, device=rays_o.device)
+    else:
+        assert isinstance(binaries, Tensor), "mips need dense binaries."
+    if isinstance(binaries, BrickGrid):
+        brick_table, bricks = binaries.brick_table, binaries.bricks
+        binaries = torch.empty((0,), dtype=torch.bool, device=rays_o.device)
+    elif isinstance(binaries, MortonGrid):
+        morton_bits = binaries.bits
+        binaries = torch.empty((0,), dtype=torch.bool, device=rays_o.device)
+
     # Traverse the grids.
     intervals, samples, termination_planes = _C.traverse_grids(
         # rays
@@ -169,6 +329,10 @@ def traverse_grids(
         rays_mask.contiguous(),  # [n_rays]
         # grids
         binaries.contiguous(),  # [m, resx, resy, resz]
+        brick_table.contiguous(),  # [m, resx / 8, resy / 8, resz / 8]
+        bricks.contiguous(),  # [n_bricks, 8, 8, 8]
+        morton_bits.contiguous(),  # [m, res^3 / 8]
+        mips.contiguous(),  # [m * resx * resy * resz * 73 / 512]
         aabbs.contiguous(),  # [m, 6]
         # intersections
         t_sorted.contiguous(),  # [n_rays, m * 2]
@@ -192,13 +356,68 @@ def traverse_grids(
     )
 
 
+@torch.no_grad()
+def build_occupancy_mips(binaries: Tensor) -> Tensor:
+    """Occupancy pyramid of binary grids, for :func:`traverse_grids` to skip
+    empty space in blocks of cells.
+
+    Args:
+        binaries: (m, resx, resy, resz) Multiple binary grids with the same
+            resolution, a multiple of 8.
+
+    Returns:
+        The 2x, 4x and 8x OR-reduced binaries, i.e. whether each 2x2x2, 4x4x4
+        and 8x8x8 block of cells has an occupied cell, flattened one after
+        another.
+    """
+    m, resx, resy, resz = binaries.shape
+    assert (
+        resx % 8 == 0 and resy % 8 == 0 and resz % 8 == 0
+    ), f"The resolution must be a multiple of 8! Got {binaries.shape}."
+    mips = []
+    mip = binaries
+    for _ in range(3):
+        m, resx, resy, resz = mip.shape
+        mip = mip.view(m, resx // 2, 2, resy // 2, 2, resz // 2, 2)
+        mip = mip.any(dim=6).any(dim=4).any(dim=2)
+        mips.append(mip.flatten())
+    return torch.cat(mips)
+
+
+@torch.no_grad()
+def _refresh_occupancy_mips(
+    mips: Tensor, binaries: Tensor, levels: Tensor, coords: Tensor
+) -> None:
+    """Update in place the pyramid `mips` of `binaries` (see
+    :func:`build_occupancy_mips`) after the cells at (n, 3) `coords` of the
+    grids `levels` (n,) changed. Each level is OR-reduced from the one below,
+    so only 8 cells are read per changed block."""
+    m, resx, resy, resz = binaries.shape
+    corners = _grid_coords(2, binaries.device)  # [8, 3]
+    fine, offset = binaries, 0
+    for s in range(1, 4):
+        res = (resx >> s, resy >> s, resz >> s)
+        mip = mips[offset : offset + m * res[0] * res[1] * res[2]].view(m, *res)
+        coords = coords // 2
+        children = coords[:, None] * 2 + corners  # [n, 8, 3]
+        mip[levels, coords[:, 0], coords[:, 1], coords[:, 2]] = fine[
+            levels[:, None],
+            children[..., 0],
+            children[..., 1],
+            children[..., 2],
+        ].any(dim=-1)
+        fine, offset = mip, offset + mip.numel()
+
+
 def _enlarge_aabb(aabb, factor: float) -> Tensor:
     center = (aabb[:3] + aabb[3:]) / 2
     extent = (aabb[3:] - aabb[:3]) / 2
     return torch.cat([center - extent * factor, center + extent * factor])
 
 
-def _query(x: Tensor, data: Tensor, base_aabb: Tensor) -> Tensor:
+def _query(
+    x: Tensor, data: Union[Tensor, MortonGrid], base_aabb: Tensor
+) -> Tensor:
     """
     Query the grid values at the given points.
 
@@ -206,9 +425,22 @@ def _query(x: Tensor, data: Tensor, base_aabb: Tensor) -> Tensor:
 
     Args:
         x: (N, 3) tensor of points to query.
-        data: (m, resx, resy, resz) tensor of grid values
+        data: (m, resx, resy, resz) tensor of grid values, or a
+            :class:`MortonGrid`.
         base_aabb: (6,) aabb of base level grid.
     """
+    mip, ix, selector = _query_cells(x, data.shape, base_aabb)
+    if isinstance(data, MortonGrid):
+        return data.lookup(mip, ix) * selector, selector
+    return data[mip, ix[:, 0], ix[:, 1], ix[:, 2]] * selector, selector
+
+
+def _query_cells(
+    x: Tensor, shape: Tuple[int, ...], base_aabb: Tensor
+) -> Tuple[Tensor, Tensor, Tensor]:
+    """The grid (N,) and the cell (N, 3) of (m, resx, resy, resz) grids with
+    2x scaled aabbs in which the (N, 3) points `x` fall, and whether they fall
+    in any grid (N,)."""
     # normalize so that the base_aabb is [0, 1]^3
     aabb_min, aabb_max = torch.split(base_aabb, 3, dim=0)
     x_norm = (x - aabb_min) / (aabb_max - aabb_min)
@@ -221,17 +453,48 @@ def _query(x: Tensor, data: Tensor, base_aabb: Tensor) -> Tensor:
     # compute the mip level
     exponent = torch.frexp(maxval)[1].long()
     mip = torch.clamp(exponent + 1, min=0)
-    selector = mip < data.shape[0]
+    selector = mip < shape[0]
 
     # use the mip to re-normalize all points to [0, 1].
     scale = 2**mip
     x_unit = (x_norm - 0.5) / scale[:, None] + 0.5
 
     # map to the grid index
-    resolution = torch.tensor(data.shape[1:], device=x.device)
+    resolution = torch.tensor(shape[1:], device=x.device)
     ix = (x_unit * resolution).long()
 
     ix = torch.clamp(ix, max=resolution - 1)
-    mip = torch.clamp(mip, max=data.shape[0] - 1)
-
-    return data[mip, ix[:, 0], ix[:, 1], ix[:, 2]] * selector, selector
+    mip = torch.clamp(mip, max=shape[0] - 1)
+    return mip, ix, selector
+
+
+def _grid_coords(res: int, device: Union[torch.device, str] = "cpu") -> Tensor:
+    """Row-major (res^3, 3) coordinates of the cells of a cubic grid."""
+    r = torch.arange(res, device=device)
+    return torch.stack(torch.meshgrid([r, r, r], indexing="ij"), -1).view(-1, 3)
+
+
+def _morton_codes(res: int, device: Union[torch.device, str] = "cpu") -> Tensor:
+    """Morton codes (res, res, res) of the cells of a cubic grid."""
+    r = torch.arange(res, device=device)
+    zeros = torch.zeros_like(r)
+    x = _morton3d(torch.stack([r, zeros, zeros], -1))
+    y = _morton3d(torch.stack([zeros, r, zeros], -1))
+    z = _morton3d(torch.stack([zeros, zeros, r], -1))
+    # the bits of the axes are interleaved, so they do not overlap.
+    return x[:, None, None] | y[None, :, None] | z[None, None, :]
+
+
+def _morton3d(coords: Tensor) -> Tensor:
+    """Morton (Z-curve) codes of (..., 3) grid coordinates, the bits of x
+    being the most significant. Same as `morton_encode` in the kernels."""
+    codes = coords.long() & 0x1FFFFF
+    for shift, mask in [
+        (32, 0x1F00000000FFFF),
+        (16, 0x1F0000FF0000FF),
+        (8, 0x100F00F00F00F00F),
+        (4, 0x10C30C30C30C30C3),
+        (2, 0x1249249249249249),
+    ]:
+        codes = (codes | codes << shift) & mask
+    return codes[..., 0] << 2 | codes[..., 1] << 1 | codes[..., 2]
@@ -1,48 +1,54 @@
+from typing import Optional, Union
+
 from torch import Tensor
-import torch
 
+from .data_specs import PackedRays
 from .scan import inclusive_sum
-from .volrend import accumulate_along_rays
+from .volrend import _resolve_packed_info, accumulate_along_rays
 
 
 def distortion(
     weights: Tensor,
     t_starts: Tensor,
     t_ends: Tensor,
-    ray_indices: Tensor,
-    # n_rays: int,
+    packed_info: Optional[Union[Tensor, PackedRays]] = None,
+    ray_indices: Optional[Union[Tensor, PackedRays]] = None,
+    n_rays: Optional[int] = None,
 ) -> Tensor:
     """Distortion Regularization proposed in Mip-NeRF 360.
 
+    This function supports both batched and flattened input tensor. For flattened input tensor, either
+    (`packed_info`) or (`ray_indices` and `n_rays`) should be provided.
+
     Args:
-        weights: The flattened weights of the samples. Shape (n_samples,)
-        t_starts: The start points of the samples. Shape (n_samples,)
-        t_ends: The end points of the samples. Shape (n_samples,)
-        ray_indices: The ray indices of the samples. LongTensor with shape (n_samples,)
-        n_rays: The total number of rays.
+        weights: The weights of the samples. Shape (n_rays, n_samples) or (all_samples,)
+        t_starts: The start points of the samples. Shape (n_rays, n_samples) or (all_samples,)
+        t_ends: The end points of the samples. Shape (n_rays, n_samples) or (all_samples,)
+        packed_info: A tensor of shape (n_rays, 2) that specifies the start and count
+            of each chunk in the flattened samples, with in total n_rays chunks.
+            Useful for flattened input. Can also be a :class:`PackedRays`.
+        ray_indices: The ray indices of the samples. LongTensor with shape (all_samples,)
+            Can also be a :class:`PackedRays`.
+        n_rays: The total number of rays. Only useful when `ray_indices` is provided.
+            If not given, it is inferred from `ray_indices`, which synchronizes
+            with the device.
 
     Returns:
         The per-ray distortion loss with the shape (n_rays, 1).
     """
-    assert (
-        weights.shape == t_starts.shape == t_ends.shape
-    ), (
+    assert weights.shape == t_starts.shape == t_ends.shape, (
         f"the shape of the inputs are not the same: "
         f"weights {weights.shape}, t_starts {t_starts.shape}, "
-        f"t_ends {t_ends.shape}, ray_indices {ray_indices.shape}"
+        f"t_ends {t_ends.shape}"
     )
+    # Pack once and share it with the scans and the accumulation below.
+    packed_info = _resolve_packed_info(packed_info, ray_indices, n_rays)
+
     t_mids = 0.5 * (t_starts + t_ends)
     t_deltas = t_ends - t_starts
     loss_uni = (1 / 3) * (t_deltas * weights.pow(2))
-    loss_bi_0 = weights * t_mids * inclusive_sum(weights, packed_info=ray_indices)
-    loss_bi_1 = weights * inclusive_sum(weights * t_mids, packed_info=ray_indices)
+    loss_bi_0 = weights * t_mids * inclusive_sum(weights, packed_info)
+    loss_bi_1 = weights * inclusive_sum(weights * t_mids, packed_info)
     loss_bi = 2 * (loss_bi_0 - loss_bi_1)
     loss = loss_uni + loss_bi
-    
-    num_rays = len(ray_indices)
-    num_samples_per_ray = weights.shape[0] // num_rays
-    sample_indices = torch.arange(num_rays, device = weights.device)
-    sample_indices = torch.repeat_interleave(sample_indices, num_samples_per_ray)
-
-    loss = accumulate_along_rays(loss, None, sample_indices, num_rays)
-    return loss
\ No newline at end of file
+    return accumulate_along_rays(loss, None, packed_info=packed_info)
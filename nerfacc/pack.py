@@ -11,12 +11,17 @@ from torch import Tensor
 def pack_info(ray_indices: Tensor, n_rays: Optional[int] = None) -> Tensor:
     """Pack `ray_indices` to `packed_info`. Useful for converting per sample data to per ray data.
 
+    Works on any device. When `n_rays` is given, this does not synchronize
+    with the device. See :class:`nerfacc.PackedRays` to compute it once and
+    share it across ops.
+
     Note:
         this function is not differentiable to any inputs.
 
     Args:
         ray_indices: Ray indices of the samples. LongTensor with shape (n_sample).
-        n_rays: Number of rays. If None, it is inferred from `ray_indices`. Default is None.
+        n_rays: Number of rays. If None, it is inferred from `ray_indices`, which
+            synchronizes with the device. Default is None.
 
     Returns:
         A LongTensor of shape (n_rays, 2) that specifies the start and count
@@ -35,15 +40,16 @@ def pack_info(ray_indices: Tensor, n_rays: Optional[int] = None) -> Tensor:
     assert (
         ray_indices.dim() == 1
     ), "ray_indices must be a 1D tensor with shape (n_samples)."
-    if ray_indices.is_cuda:
-        device = ray_indices.device
-        dtype = ray_indices.dtype
-        if n_rays is None:
-            n_rays = ray_indices.max().item() + 1
-        chunk_cnts = torch.zeros((n_rays,), device=device, dtype=dtype)
-        chunk_cnts.index_add_(0, ray_indices, torch.ones_like(ray_indices))
-        chunk_starts = chunk_cnts.cumsum(dim=0, dtype=dtype) - chunk_cnts
-        packed_info = torch.stack([chunk_starts, chunk_cnts], dim=-1)
+    if n_rays is None:
+        chunk_cnts = torch.bincount(ray_indices)
     else:
-        raise NotImplementedError("Only support cuda inputs.")
-    return packed_info
+        # bincount needs the max index to size its output, which syncs on
+        # CUDA. Scattering into a buffer of known size does not.
+        chunk_cnts = torch.zeros(
+            (n_rays,), device=ray_indices.device, dtype=torch.long
+        )
+        chunk_cnts.index_add_(
+            0, ray_indices, torch.ones_like(ray_indices, dtype=torch.long)
+        )
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    return torch.stack([chunk_starts, chunk_cnts], dim=-1)
@@ -1,16 +1,18 @@
 """
 Copyright (c) 2022 Ruilong Li, UC Berkeley.
 """
-from typing import Optional
+from typing import Optional, Union
 
 import torch
 from torch import Tensor
 
 from . import cuda as _C
+from .data_specs import PackedRays, _as_packed_info
+from .determinism import are_deterministic_algorithms_enabled
 
 
 def inclusive_sum(
-    inputs: Tensor, packed_info: Optional[Tensor] = None
+    inputs: Tensor, packed_info: Optional[Union[Tensor, PackedRays]] = None
 ) -> Tensor:
     """Inclusive Sum that supports flattened tensor.
 
@@ -24,7 +26,8 @@ def inclusive_sum(
         packed_info: A tensor of shape (n_rays, 2) that specifies the start and count
             of each chunk in the flattened input tensor, with in total n_rays chunks.
             If None, the input is assumed to be a N-D tensor and the sum is computed
-            along the last dimension. Default is None.
+            along the last dimension. Can also be a :class:`PackedRays`.
+            Default is None.
 
     Returns:
         The inclusive sum with the same shape as the input tensor.
@@ -39,6 +42,9 @@ def inclusive_sum(
         tensor([ 1.,  3.,  3.,  7., 12.,  6., 13., 21., 30.], device='cuda:0')
 
     """
+    packed_info = _as_packed_info(packed_info)
+    if packed_info is None and _use_fixed_order(inputs):
+        return _scan_batched_as_flattened(inclusive_sum, inputs)
     if packed_info is None:
         # Batched inclusive sum on the last dimension.
         outputs = torch.cumsum(inputs, dim=-1)
@@ -54,7 +60,7 @@ def inclusive_sum(
 
 
 def exclusive_sum(
-    inputs: Tensor, packed_info: Optional[Tensor] = None
+    inputs: Tensor, packed_info: Optional[Union[Tensor, PackedRays]] = None
 ) -> Tensor:
     """Exclusive Sum that supports flattened tensor.
 
@@ -66,7 +72,8 @@ def exclusive_sum(
         packed_info: A tensor of shape (n_rays, 2) that specifies the start and count
             of each chunk in the flattened input tensor, with in total n_rays chunks.
             If None, the input is assumed to be a N-D tensor and the sum is computed
-            along the last dimension. Default is None.
+            along the last dimension. Can also be a :class:`PackedRays`.
+            Default is None.
 
     Returns:
         The exclusive sum with the same shape as the input tensor.
@@ -81,6 +88,9 @@ def exclusive_sum(
         tensor([ 0.,  1.,  0.,  3.,  7.,  0.,  6., 13., 21.], device='cuda:0')
 
     """
+    packed_info = _as_packed_info(packed_info)
+    if packed_info is None and _use_fixed_order(inputs):
+        return _scan_batched_as_flattened(exclusive_sum, inputs)
     if packed_info is None:
         # Batched exclusive sum on the last dimension.
         outputs = torch.cumsum(
@@ -101,7 +111,7 @@ def exclusive_sum(
 
 
 def inclusive_prod(
-    inputs: Tensor, packed_info: Optional[Tensor] = None
+    inputs: Tensor, packed_info: Optional[Union[Tensor, PackedRays]] = None
 ) -> Tensor:
     """Inclusive Product that supports flattened tensor.
 
@@ -115,7 +125,8 @@ def inclusive_prod(
         packed_info: A tensor of shape (n_rays, 2) that specifies the start and count
             of each chunk in the flattened input tensor, with in total n_rays chunks.
             If None, the input is assumed to be a N-D tensor and the product is computed
-            along the last dimension. Default is None.
+            along the last dimension. Can also be a :class:`PackedRays`.
+            Default is None.
 
     Returns:
         The inclusive product with the same shape as the input tensor.
@@ -130,6 +141,9 @@ def inclusive_prod(
         tensor([1., 2., 3., 12., 60., 6., 42., 336., 3024.], device='cuda:0')
 
     """
+    packed_info = _as_packed_info(packed_info)
+    if packed_info is None and _use_fixed_order(inputs):
+        return _scan_batched_as_flattened(inclusive_prod, inputs)
     if packed_info is None:
         # Batched inclusive product on the last dimension.
         outputs = torch.cumprod(inputs, dim=-1)
@@ -145,7 +159,7 @@ def inclusive_prod(
 
 
 def exclusive_prod(
-    inputs: Tensor, packed_info: Optional[Tensor] = None
+    inputs: Tensor, packed_info: Optional[Union[Tensor, PackedRays]] = None
 ) -> Tensor:
     """Exclusive Product that supports flattened tensor.
 
@@ -157,7 +171,8 @@ def exclusive_prod(
         packed_info: A tensor of shape (n_rays, 2) that specifies the start and count
             of each chunk in the flattened input tensor, with in total n_rays chunks.
             If None, the input is assumed to be a N-D tensor and the product is computed
-            along the last dimension. Default is None.
+            along the last dimension. Can also be a :class:`PackedRays`.
+            Default is None.
 
     Returns:
         The exclusive product with the same shape as the input tensor.
@@ -173,6 +188,9 @@ def exclusive_prod(
         tensor([1., 1., 1., 3., 12., 1., 6., 42., 336.], device='cuda:0')
 
     """
+    packed_info = _as_packed_info(packed_info)
+    if packed_info is None and _use_fixed_order(inputs):
+        return _scan_batched_as_flattened(exclusive_prod, inputs)
     if packed_info is None:
         outputs = torch.cumprod(
             torch.cat(
@@ -186,6 +204,46 @@ def exclusive_prod(
     return outputs
 
 
+def _exclusive_sum_reverse(
+    inputs: Tensor, packed_info: Optional[Tensor] = None
+) -> Tensor:
+    """Exclusive sum from the end of each chunk: outputs[i] = sum_{j>i} inputs[j].
+
+    Not differentiable. Same arguments as :func:`exclusive_sum`.
+    """
+    if packed_info is None:
+        return torch.flip(exclusive_sum(torch.flip(inputs, [-1])), [-1])
+    chunk_starts, chunk_cnts = packed_info.unbind(dim=-1)
+    return _C.exclusive_sum(
+        chunk_starts.contiguous(),
+        chunk_cnts.contiguous(),
+        inputs.contiguous(),
+        False,
+        True,
+    )
+
+
+def _use_fixed_order(inputs: Tensor) -> bool:
+    """Whether the batched scans should avoid `torch.cumsum` and
+    `torch.cumprod`, which are not deterministic on CUDA."""
+    return (
+        are_deterministic_algorithms_enabled() and inputs.device.type != "cpu"
+    )
+
+
+def _scan_batched_as_flattened(scan_fn, inputs: Tensor) -> Tensor:
+    """Apply a flattened scan on the last dimension of batched inputs."""
+    n_per_chunk = inputs.shape[-1]
+    n_chunks = inputs.numel() // max(n_per_chunk, 1)
+    chunk_cnts = torch.full(
+        (n_chunks,), n_per_chunk, dtype=torch.long, device=inputs.device
+    )
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    packed_info = torch.stack([chunk_starts, chunk_cnts], dim=-1)
+    outputs = scan_fn(inputs.reshape(-1), packed_info)
+    return outputs.reshape(inputs.shape)
+
+
 class _InclusiveSum(torch.autograd.Function):
     """Inclusive Sum on a Flattened Tensor."""
 
@@ -286,3 +344,298 @@ class _ExclusiveProd(torch.autograd.Function):
             chunk_starts, chunk_cnts, inputs, outputs, grad_outputs
         )
         return None, None, grad_inputs
+
+
+def _chunk_heads(
+    chunk_starts: Tensor, chunk_cnts: Tensor, n_edges: int
+) -> Tensor:
+    """For each element, the index of the first element of its chunk.
+
+    Chunks are assumed to be sorted by their starts, as in `packed_info`.
+    """
+    index = chunk_starts.clamp(max=n_edges - 1)
+    src = torch.where(chunk_cnts > 0, chunk_starts, torch.zeros_like(index))
+    heads = torch.zeros(
+        (n_edges,), dtype=chunk_starts.dtype, device=chunk_starts.device
+    )
+    heads.scatter_reduce_(0, index, src, reduce="amax")
+    return torch.cummax(heads, dim=0).values
+
+
+def _segmented_scan_fixed_order(
+    chunk_starts: Tensor,
+    chunk_cnts: Tensor,
+    inputs: Tensor,
+    is_prod: bool,
+    exclusive: bool,
+    normalize: bool = False,
+    reverse: bool = False,
+) -> Tensor:
+    """Segmented scan with a fixed order of operations.
+
+    Hillis-Steele scan: in step k, each element is combined with the element
+    2^k before it (after it with `reverse`) in the same chunk. Every output is
+    computed by the same sequence of elementwise ops on any device and for
+    any number of threads, so the results are bitwise reproducible. Takes
+    log2(max chunk size) steps, and syncs to get the max chunk size.
+    """
+    n_edges = inputs.numel()
+    if n_edges == 0:
+        return torch.empty_like(inputs)
+    identity = 1 if is_prod else 0
+    heads = _chunk_heads(chunk_starts, chunk_cnts, n_edges)
+    index = chunk_starts.clamp(max=n_edges - 1)
+    cnts = torch.zeros_like(heads).scatter_reduce_(
+        0, index, chunk_cnts, reduce="amax"
+    )
+    tails = heads + cnts[heads] - 1
+    positions = torch.arange(n_edges, device=inputs.device)
+    # The number of elements before (or after, with `reverse`) in the chunk.
+    offsets = tails - positions if reverse else positions - heads
+
+    outputs = inputs
+    step = 1
+    max_cnt = int(chunk_cnts.max())
+    while step < max_cnt:
+        pad = torch.full_like(outputs[:step], identity)
+        if reverse:
+            shifted = torch.cat([outputs[step:], pad])
+        else:
+            shifted = torch.cat([pad, outputs[:-step]])
+        combined = outputs * shifted if is_prod else outputs + shifted
+        outputs = torch.where(offsets >= step, combined, outputs)
+        step *= 2
+
+    if normalize:
+        totals = outputs[heads if reverse else tails]
+    if exclusive:
+        pad = torch.full_like(outputs[:1], identity)
+        if reverse:
+            shifted = torch.cat([outputs[1:], pad])
+        else:
+            shifted = torch.cat([pad, outputs[:-1]])
+        outputs = torch.where(offsets >= 1, shifted, pad)
+    if normalize:
+        outputs = outputs / totals.clamp(min=1e-10)
+    return outputs
+
+
+def _segmented_cumsum(
+    chunk_starts: Tensor,
+    chunk_cnts: Tensor,
+    inputs: Tensor,
+    exclusive: bool,
+    normalize: bool = False,
+    reverse: bool = False,
+    stability: Optional[str] = "float64",
+) -> Tensor:
+    """Vectorized segmented cumsum: a global `torch.cumsum` minus per-chunk offsets.
+
+    With `reverse`, each chunk is scanned from its last element to its first,
+    which is what the backward pass of the scans needs.
+
+    Subtracting the offsets cancels most of the significant digits of a long
+    global prefix sum, so `stability` controls how the prefix sums are
+    accumulated:
+
+    - None: in the dtype of the inputs.
+    - "float64": in double precision (not supported on MPS, which uses "kahan").
+    - "kahan": compensated sums in the dtype of the inputs. The rounding error
+      of every addition is recovered with TwoSum and accumulated separately.
+
+    In the deterministic mode, `_segmented_scan_fixed_order` is used instead.
+    """
+    assert stability in [None, "float64", "kahan"], stability
+    if are_deterministic_algorithms_enabled():
+        return _segmented_scan_fixed_order(
+            chunk_starts,
+            chunk_cnts,
+            inputs,
+            False,
+            exclusive,
+            normalize,
+            reverse,
+        )
+    n_edges = inputs.numel()
+    if n_edges == 0:
+        return torch.empty_like(inputs)
+    if not inputs.is_floating_point():
+        stability = None
+    elif stability == "float64" and inputs.device.type == "mps":
+        stability = "kahan"
+
+    heads = _chunk_heads(chunk_starts, chunk_cnts, n_edges)
+    x = inputs.double() if stability == "float64" else inputs
+    inc = torch.cumsum(x, dim=0)
+    exc = torch.cat([torch.zeros_like(inc[:1]), inc[:-1]])
+    if stability == "kahan":
+        # TwoSum: the exact error of exc + x -> inc. The errors only correct
+        # the values, so they do not need gradients.
+        with torch.no_grad():
+            bb = inc - exc
+            errs = (exc - (inc - bb)) + (x - bb)
+            inc_errs = torch.cumsum(errs, dim=0)
+            exc_errs = torch.cat([torch.zeros_like(errs[:1]), inc_errs[:-1]])
+            base_errs = exc_errs[heads]
+        base = exc[heads]
+        inc = (inc - base) + (inc_errs - base_errs)
+        exc = (exc - base) + (exc_errs - base_errs)
+    else:
+        base = exc[heads]
+        inc = inc - base
+        exc = exc - base
+
+    if normalize or reverse:
+        # The total value of each chunk, at its last element.
+        index = chunk_starts.clamp(max=n_edges - 1)
+        cnts = torch.zeros_like(heads).scatter_reduce_(
+            0, index, chunk_cnts, reduce="amax"
+        )
+        totals = inc[heads + cnts[heads] - 1]
+
+    if reverse:
+        outputs = totals - (inc if exclusive else exc)
+    else:
+        outputs = exc if exclusive else inc
+    if normalize:
+        outputs = outputs / totals.clamp(min=1e-10)
+    return outputs.to(inputs.dtype)
+
+
+def _segmented_cumprod(
+    chunk_starts: Tensor,
+    chunk_cnts: Tensor,
+    inputs: Tensor,
+    exclusive: bool,
+    stability: Optional[str] = "float64",
+) -> Tensor:
+    """Vectorized segmented cumprod as a segmented cumsum in log-space.
+
+    Zeros and signs are counted separately, so the inputs can be any real
+    numbers. Same as the CUDA kernels, the gradient w.r.t. the inputs that
+    are exactly zero is not correct.
+    """
+    if are_deterministic_algorithms_enabled():
+        return _segmented_scan_fixed_order(
+            chunk_starts, chunk_cnts, inputs, True, exclusive
+        )
+    is_zero = inputs == 0
+    safe_inputs = torch.where(is_zero, torch.ones_like(inputs), inputs)
+    log_prods = _segmented_cumsum(
+        chunk_starts,
+        chunk_cnts,
+        safe_inputs.abs().log(),
+        exclusive,
+        stability=stability,
+    )
+    n_zeros = _segmented_cumsum(
+        chunk_starts, chunk_cnts, is_zero.long(), exclusive
+    )
+    n_negs = _segmented_cumsum(
+        chunk_starts, chunk_cnts, (inputs < 0).long(), exclusive
+    )
+    signs = 1 - 2 * (n_negs % 2).to(inputs.dtype)
+    outputs = torch.where(
+        n_zeros > 0, torch.zeros_like(inputs), signs * torch.exp(log_prods)
+    )
+    return outputs
+
+
+def _inclusive_sum_torch(
+    chunk_starts: Tensor,
+    chunk_cnts: Tensor,
+    inputs: Tensor,
+    normalize: bool = False,
+    backward: bool = False,
+    stability: Optional[str] = "float64",
+) -> Tensor:
+    """Pure PyTorch implementation of `_C.inclusive_sum`."""
+    if backward:
+        assert not normalize, "Only support backward for normalize==False."
+    return _segmented_cumsum(
+        chunk_starts, chunk_cnts, inputs, False, normalize, backward, stability
+    )
+
+
+def _exclusive_sum_torch(
+    chunk_starts: Tensor,
+    chunk_cnts: Tensor,
+    inputs: Tensor,
+    normalize: bool = False,
+    backward: bool = False,
+    stability: Optional[str] = "float64",
+) -> Tensor:
+    """Pure PyTorch implementation of `_C.exclusive_sum`."""
+    if backward:
+        assert not normalize, "Only support backward for normalize==False."
+    return _segmented_cumsum(
+        chunk_starts, chunk_cnts, inputs, True, normalize, backward, stability
+    )
+
+
+def _inclusive_prod_forward_torch(
+    chunk_starts: Tensor,
+    chunk_cnts: Tensor,
+    inputs: Tensor,
+    stability: Optional[str] = "float64",
+) -> Tensor:
+    """Pure PyTorch implementation of `_C.inclusive_prod_forward`."""
+    return _segmented_cumprod(
+        chunk_starts, chunk_cnts, inputs, False, stability
+    )
+
+
+def _exclusive_prod_forward_torch(
+    chunk_starts: Tensor,
+    chunk_cnts: Tensor,
+    inputs: Tensor,
+    stability: Optional[str] = "float64",
+) -> Tensor:
+    """Pure PyTorch implementation of `_C.exclusive_prod_forward`."""
+    return _segmented_cumprod(chunk_starts, chunk_cnts, inputs, True, stability)
+
+
+def _inclusive_prod_backward_torch(
+    chunk_starts: Tensor,
+    chunk_cnts: Tensor,
+    inputs: Tensor,
+    outputs: Tensor,
+    grad_outputs: Tensor,
+    stability: Optional[str] = "float64",
+) -> Tensor:
+    """Pure PyTorch implementation of `_C.inclusive_prod_backward`.
+
+    Same as the CUDA kernel, the gradient is not correct when inputs are zero.
+    """
+    grad_inputs = _segmented_cumsum(
+        chunk_starts,
+        chunk_cnts,
+        grad_outputs * outputs,
+        False,
+        reverse=True,
+        stability=stability,
+    )
+    return grad_inputs / torch.where(inputs == 0, 1e-10, inputs)
+
+
+def _exclusive_prod_backward_torch(
+    chunk_starts: Tensor,
+    chunk_cnts: Tensor,
+    inputs: Tensor,
+    outputs: Tensor,
+    grad_outputs: Tensor,
+    stability: Optional[str] = "float64",
+) -> Tensor:
+    """Pure PyTorch implementation of `_C.exclusive_prod_backward`.
+
+    Same as the CUDA kernel, the gradient is not correct when inputs are zero.
+    """
+    grad_inputs = _segmented_cumsum(
+        chunk_starts,
+        chunk_cnts,
+        grad_outputs * outputs,
+        True,
+        reverse=True,
+        stability=stability,
+    )
+    return grad_inputs / torch.where(inputs == 0, 1e-10, inputs)
@@ -2,20 +2,23 @@
 Copyright (c) 2022 Ruilong Li, UC Berkeley.
 """
 
-from typing import Callable, Dict, Optional, Tuple
+from typing import Callable, Dict, Optional, Tuple, Union
 
 import torch
 from torch import Tensor
 
+from . import cuda as _C
+from .data_specs import PackedRays, _as_packed_info
+from .determinism import are_deterministic_algorithms_enabled
 from .pack import pack_info
-from .scan import exclusive_prod, exclusive_sum
+from .scan import _exclusive_sum_reverse, exclusive_prod, exclusive_sum
 
 
 def rendering(
     # ray marching results
     t_starts: Tensor,
     t_ends: Tensor,
-    ray_indices: Optional[Tensor] = None,
+    ray_indices: Optional[Union[Tensor, PackedRays]] = None,
     n_rays: Optional[int] = None,
     # radiance field
     rgb_sigma_fn: Optional[Callable] = None,
@@ -36,11 +39,25 @@ def rendering(
     Warning:
         This function is not differentiable to `t_starts`, `t_ends` and `ray_indices`.
 
+    Note:
+        Where the extension has a fused rendering op, i.e. on CPU for now, the
+        weights are computed and accumulated along the rays in a single pass
+        over the samples. It is only used for float32 or float64 inputs of the
+        same dtype, and not when `t_starts` or `t_ends` require grad, in which
+        case, as on CUDA, :func:`render_weight_from_density` (or
+        :func:`render_weight_from_alpha`) and :func:`accumulate_along_rays`
+        are used instead. Both paths return the same outputs, extras and
+        gradients up to rounding.
+
     Args:
         t_starts: Per-sample start distance. Tensor with shape (n_rays, n_samples) or (all_samples,).
         t_ends: Per-sample end distance. Tensor with shape (n_rays, n_samples) or (all_samples,).
         ray_indices: Ray indices of the flattened samples. LongTensor with shape (all_samples).
-        n_rays: Number of rays. Only useful when `ray_indices` is provided.
+            Can also be a :class:`PackedRays`, which lets the packing of the samples
+            be computed once and shared with the caller.
+        n_rays: Number of rays. Only useful when `ray_indices` is provided. If
+            not given, it is inferred from `ray_indices`, which synchronizes
+            with the device.
         rgb_sigma_fn: A function that takes in samples {t_starts, t_ends,
             ray indices} and returns the post-activation rgb (..., 3) and density
             values (...,). The shape `...` is the same as the shape of `t_starts`.
@@ -73,6 +90,11 @@ def rendering(
         dict_keys(['weights', 'alphas', 'trans'])
 
     """
+    rays = None
+    if isinstance(ray_indices, PackedRays):
+        rays, ray_indices = ray_indices, ray_indices.ray_indices
+    elif ray_indices is not None:
+        rays = PackedRays(ray_indices=ray_indices, n_rays=n_rays)
     if ray_indices is not None:
         assert (
             t_starts.shape == t_ends.shape == ray_indices.shape
@@ -97,13 +119,23 @@ def rendering(
             sigmas.shape == t_starts.shape
         ), "sigmas must have shape of (N,)! Got {}".format(sigmas.shape)
         # Rendering: compute weights.
-        weights, trans, alphas = render_weight_from_density(
-            t_starts,
-            t_ends,
-            sigmas,
-            ray_indices=ray_indices,
-            n_rays=n_rays,
-        )
+        fused = _can_fuse(t_starts, t_ends, sigmas, rgbs)
+        if fused:
+            (
+                colors,
+                opacities,
+                depths,
+                weights,
+                trans,
+                alphas,
+            ) = _rendering_fused(t_starts, t_ends, sigmas, rgbs, rays, False)
+        else:
+            weights, trans, alphas = render_weight_from_density(
+                t_starts,
+                t_ends,
+                sigmas,
+                packed_info=rays,
+            )
         extras = {
             "weights": weights,
             "alphas": alphas,
@@ -124,11 +156,16 @@ def rendering(
             alphas.shape == t_starts.shape
         ), "alphas must have shape of (N,)! Got {}".format(alphas.shape)
         # Rendering: compute weights.
-        weights, trans = render_weight_from_alpha(
-            alphas,
-            ray_indices=ray_indices,
-            n_rays=n_rays,
-        )
+        fused = _can_fuse(t_starts, t_ends, alphas, rgbs)
+        if fused:
+            colors, opacities, depths, weights, trans = _rendering_fused(
+                t_starts, t_ends, alphas, rgbs, rays, True
+            )
+        else:
+            weights, trans = render_weight_from_alpha(
+                alphas,
+                packed_info=rays,
+            )
         extras = {
             "weights": weights,
             "trans": trans,
@@ -137,18 +174,16 @@ def rendering(
         }
 
     # Rendering: accumulate rgbs, opacities, and depths along the rays.
-    colors = accumulate_along_rays(
-        weights, values=rgbs, ray_indices=ray_indices, n_rays=n_rays
-    )
-    opacities = accumulate_along_rays(
-        weights, values=None, ray_indices=ray_indices, n_rays=n_rays
-    )
-    depths = accumulate_along_rays(
-        weights,
-        values=(t_starts + t_ends)[..., None] / 2.0,
-        ray_indices=ray_indices,
-        n_rays=n_rays,
-    )
+    if not fused:
+        colors = accumulate_along_rays(weights, values=rgbs, packed_info=rays)
+        opacities = accumulate_along_rays(
+            weights, values=None, packed_info=rays
+        )
+        depths = accumulate_along_rays(
+            weights,
+            values=(t_starts + t_ends)[..., None] / 2.0,
+            packed_info=rays,
+        )
     depths = depths / opacities.clamp_min(torch.finfo(rgbs.dtype).eps)
 
     # Background composition.
@@ -158,9 +193,186 @@ def rendering(
     return colors, opacities, depths, extras
 
 
+def _resolve_packed_info(
+    packed_info: Optional[Union[Tensor, PackedRays]],
+    ray_indices: Optional[Union[Tensor, PackedRays]],
+    n_rays: Optional[int],
+) -> Optional[Tensor]:
+    """The `packed_info` of the flattened samples, if any. Packing
+    `ray_indices` without `n_rays` synchronizes with the device."""
+    if packed_info is None and isinstance(ray_indices, PackedRays):
+        packed_info = ray_indices
+    if packed_info is None and ray_indices is not None:
+        packed_info = pack_info(ray_indices, n_rays)
+    return _as_packed_info(packed_info)
+
+
+def _can_fuse(
+    t_starts: Tensor, t_ends: Tensor, densities: Tensor, values: Tensor
+) -> bool:
+    """Whether `rendering()` can use the fused rendering op."""
+    return (
+        _C.is_supported("rendering_forward", t_starts.device)
+        # the fused op is not differentiable to t_starts and t_ends.
+        and not (t_starts.requires_grad or t_ends.requires_grad)
+        and values.dim() == t_starts.dim() + 1
+        and t_starts.dtype in (torch.float32, torch.float64)
+        and t_starts.dtype == t_ends.dtype == densities.dtype == values.dtype
+    )
+
+
+def _rendering_fused(
+    t_starts: Tensor,
+    t_ends: Tensor,
+    densities: Tensor,
+    values: Tensor,
+    rays: Optional[PackedRays],
+    from_alpha: bool,
+) -> Tuple[Tensor, ...]:
+    """Compute the weights and accumulate the values, opacities and depths
+    along the rays in a single pass over the samples.
+
+    Returns the accumulated values, opacities and (unnormalized) depths, and
+    the weights, transmittance and alphas of the samples. The alphas are not
+    returned if `from_alpha` (i.e., `densities` are the alphas).
+    """
+    if rays is not None:
+        packed_info = rays.packed_info
+        return _Rendering.apply(
+            packed_info[:, 0],
+            packed_info[:, 1],
+            t_starts,
+            t_ends,
+            densities,
+            values,
+            from_alpha,
+        )
+
+    # batched inputs: every ray has the same number of samples.
+    n_samples = t_starts.shape[-1]
+    batch_shape = t_starts.shape[:-1]
+    chunk_cnts = torch.full(
+        (batch_shape.numel(),),
+        n_samples,
+        dtype=torch.long,
+        device=t_starts.device,
+    )
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    outputs = _Rendering.apply(
+        chunk_starts,
+        chunk_cnts,
+        t_starts.reshape(-1),
+        t_ends.reshape(-1),
+        densities.reshape(-1),
+        values.reshape(-1, values.shape[-1]),
+        from_alpha,
+    )
+    return tuple(
+        out.reshape(batch_shape + out.shape[-1:])
+        if i < 3
+        else out.reshape(t_starts.shape)
+        for i, out in enumerate(outputs)
+    )
+
+
+class _Rendering(torch.autograd.Function):
+    """Fused volume rendering of the flattened samples."""
+
+    @staticmethod
+    def forward(
+        ctx,
+        chunk_starts,
+        chunk_cnts,
+        t_starts,
+        t_ends,
+        densities,
+        values,
+        from_alpha: bool,
+    ):
+        chunk_starts = chunk_starts.contiguous()
+        chunk_cnts = chunk_cnts.contiguous()
+        t_starts = t_starts.contiguous()
+        t_ends = t_ends.contiguous()
+        densities = densities.contiguous()
+        values = values.contiguous()
+        (
+            colors,
+            opacities,
+            depths,
+            weights,
+            trans,
+            alphas,
+        ) = _C.rendering_forward(
+            chunk_starts,
+            chunk_cnts,
+            t_starts,
+            t_ends,
+            densities,
+            values,
+            from_alpha,
+        )
+        ctx.from_alpha = from_alpha
+        ctx.set_materialize_grads(False)
+        if from_alpha:
+            ctx.save_for_backward(
+                chunk_starts,
+                chunk_cnts,
+                t_starts,
+                t_ends,
+                values,
+                trans,
+                densities,
+            )
+            return colors, opacities, depths, weights, trans
+        ctx.save_for_backward(
+            chunk_starts, chunk_cnts, t_starts, t_ends, values, trans, alphas
+        )
+        return colors, opacities, depths, weights, trans, alphas
+
+    @staticmethod
+    def backward(ctx, *grads):
+        (
+            chunk_starts,
+            chunk_cnts,
+            t_starts,
+            t_ends,
+            values,
+            trans,
+            alphas,
+        ) = ctx.saved_tensors
+        grad_colors, grad_opacities, grad_depths = grads[:3]
+        if grad_colors is None:
+            grad_colors = values.new_zeros(
+                (chunk_cnts.shape[0], values.shape[-1])
+            )
+        if grad_opacities is None:
+            grad_opacities = values.new_zeros((chunk_cnts.shape[0], 1))
+        if grad_depths is None:
+            grad_depths = values.new_zeros((chunk_cnts.shape[0], 1))
+        grad_weights, grad_trans = grads[3:5]
+        grad_alphas = None if ctx.from_alpha else grads[5]
+        grad_densities, grad_values = _C.rendering_backward(
+            chunk_starts,
+            chunk_cnts,
+            t_starts,
+            t_ends,
+            values,
+            trans,
+            alphas,
+            grad_colors.contiguous(),
+            grad_opacities.contiguous(),
+            grad_depths.contiguous(),
+            None if grad_weights is None else grad_weights.contiguous(),
+            None if grad_trans is None else grad_trans.contiguous(),
+            None if grad_alphas is None else grad_alphas.contiguous(),
+            ctx.from_alpha,
+        )
+        return None, None, None, None, grad_densities, grad_values, None
+
+
 def render_transmittance_from_alpha(
     alphas: Tensor,
-    packed_info: Optional[Tensor] = None,
+    packed_info: Optional[Union[Tensor, PackedRays]] = None,
     ray_indices: Optional[Tensor] = None,
     n_rays: Optional[int] = None,
     prefix_trans: Optional[Tensor] = None,
@@ -177,9 +389,11 @@ def render_transmittance_from_alpha(
         alphas: The opacity values of the samples. Tensor with shape (all_samples,) or (n_rays, n_samples).
         packed_info: A tensor of shape (n_rays, 2) that specifies the start and count
             of each chunk in the flattened samples, with in total n_rays chunks.
-            Useful for flattened input.
+            Useful for flattened input. Can also be a :class:`PackedRays`.
         ray_indices: Ray indices of the flattened samples. LongTensor with shape (all_samples).
-        n_rays: Number of rays. Only useful when `ray_indices` is provided.
+        n_rays: Number of rays. Only useful when `ray_indices` is provided. If
+            not given, it is inferred from `ray_indices`, which synchronizes
+            with the device.
         prefix_trans: The pre-computed transmittance of the samples. Tensor with shape (all_samples,).
 
     Returns:
@@ -197,12 +411,11 @@ def render_transmittance_from_alpha(
     # FIXME Try not to use exclusive_prod because:
     # 1. torch.cumprod is much slower than torch.cumsum
     # 2. exclusive_prod gradient on input == 0 is not correct.
-    if ray_indices is not None and packed_info is None:
-        packed_info = pack_info(ray_indices, n_rays)
+    packed_info = _resolve_packed_info(packed_info, ray_indices, n_rays)
 
     trans = exclusive_prod(1 - alphas, packed_info)
     if prefix_trans is not None:
-        trans *= prefix_trans
+        trans = trans * prefix_trans
     return trans
 
 
@@ -210,7 +423,7 @@ def render_transmittance_from_density(
     t_starts: Tensor,
     t_ends: Tensor,
     sigmas: Tensor,
-    packed_info: Optional[Tensor] = None,
+    packed_info: Optional[Union[Tensor, PackedRays]] = None,
     ray_indices: Optional[Tensor] = None,
     n_rays: Optional[int] = None,
     prefix_trans: Optional[Tensor] = None,
@@ -231,9 +444,11 @@ def render_transmittance_from_density(
         sigmas: The density values of the samples. Tensor with shape (all_samples,) or (n_rays, n_samples).
         packed_info: A tensor of shape (n_rays, 2) that specifies the start and count
             of each chunk in the flattened samples, with in total n_rays chunks.
-            Useful for flattened input.
+            Useful for flattened input. Can also be a :class:`PackedRays`.
         ray_indices: Ray indices of the flattened samples. LongTensor with shape (all_samples).
-        n_rays: Number of rays. Only useful when `ray_indices` is provided.
+        n_rays: Number of rays. Only useful when `ray_indices` is provided. If
+            not given, it is inferred from `ray_indices`, which synchronizes
+            with the device.
         prefix_trans: The pre-computed transmittance of the samples. Tensor with shape (all_samples,).
 
     Returns:
@@ -253,20 +468,19 @@ def render_transmittance_from_density(
         alphas: [0.33, 0.55, 0.095, 0.55, 0.095, 0.00, 0.59]
 
     """
-    if ray_indices is not None and packed_info is None:
-        packed_info = pack_info(ray_indices, n_rays)
+    packed_info = _resolve_packed_info(packed_info, ray_indices, n_rays)
 
     sigmas_dt = sigmas * (t_ends - t_starts)
     alphas = 1.0 - torch.exp(-sigmas_dt)
     trans = torch.exp(-exclusive_sum(sigmas_dt, packed_info))
     if prefix_trans is not None:
-        trans *= prefix_trans
+        trans = trans * prefix_trans
     return trans, alphas
 
 
 def render_weight_from_alpha(
     alphas: Tensor,
-    packed_info: Optional[Tensor] = None,
+    packed_info: Optional[Union[Tensor, PackedRays]] = None,
     ray_indices: Optional[Tensor] = None,
     n_rays: Optional[int] = None,
     prefix_trans: Optional[Tensor] = None,
@@ -283,9 +497,11 @@ def render_weight_from_alpha(
         alphas: The opacity values of the samples. Tensor with shape (all_samples,) or (n_rays, n_samples).
         packed_info: A tensor of shape (n_rays, 2) that specifies the start and count
             of each chunk in the flattened samples, with in total n_rays chunks.
-            Useful for flattened input.
+            Useful for flattened input. Can also be a :class:`PackedRays`.
         ray_indices: Ray indices of the flattened samples. LongTensor with shape (all_samples).
-        n_rays: Number of rays. Only useful when `ray_indices` is provided.
+        n_rays: Number of rays. Only useful when `ray_indices` is provided. If
+            not given, it is inferred from `ray_indices`, which synchronizes
+            with the device.
         prefix_trans: The pre-computed transmittance of the samples. Tensor with shape (all_samples,).
 
     Returns:
@@ -313,7 +529,7 @@ def render_weight_from_density(
     t_starts: Tensor,
     t_ends: Tensor,
     sigmas: Tensor,
-    packed_info: Optional[Tensor] = None,
+    packed_info: Optional[Union[Tensor, PackedRays]] = None,
     ray_indices: Optional[Tensor] = None,
     n_rays: Optional[int] = None,
     prefix_trans: Optional[Tensor] = None,
@@ -332,9 +548,11 @@ def render_weight_from_density(
         sigmas: The density values of the samples. Tensor with shape (all_samples,) or (n_rays, n_samples).
         packed_info: A tensor of shape (n_rays, 2) that specifies the start and count
             of each chunk in the flattened samples, with in total n_rays chunks.
-            Useful for flattened input.
+            Useful for flattened input. Can also be a :class:`PackedRays`.
         ray_indices: Ray indices of the flattened samples. LongTensor with shape (all_samples).
-        n_rays: Number of rays. Only useful when `ray_indices` is provided.
+        n_rays: Number of rays. Only useful when `ray_indices` is provided. If
+            not given, it is inferred from `ray_indices`, which synchronizes
+            with the device.
         prefix_trans: The pre-computed transmittance of the samples. Tensor with shape (all_samples,).
 
     Returns:
@@ -355,17 +573,79 @@ def render_weight_from_density(
         alphas: [0.33, 0.55, 0.095, 0.55, 0.095, 0.00, 0.59]
 
     """
-    trans, alphas = render_transmittance_from_density(
-        t_starts, t_ends, sigmas, packed_info, ray_indices, n_rays, prefix_trans
+    packed_info = _resolve_packed_info(packed_info, ray_indices, n_rays)
+
+    weights, trans, alphas = _RenderWeightFromDensity.apply(
+        t_starts, t_ends, sigmas, packed_info, prefix_trans
     )
-    weights = trans * alphas
     return weights, trans, alphas
 
 
+class _RenderWeightFromDensity(torch.autograd.Function):
+    """Rendering weights from density.
+
+    Only the inputs are saved for backward. The alphas and transmittance are
+    recomputed in the backward pass, so that none of the per-sample
+    intermediate tensors is kept alive by the autograd graph.
+    """
+
+    @staticmethod
+    def forward(ctx, t_starts, t_ends, sigmas, packed_info, prefix_trans):
+        sigmas_dt = sigmas * (t_ends - t_starts)
+        alphas = 1.0 - torch.exp(-sigmas_dt)
+        trans = torch.exp(-exclusive_sum(sigmas_dt, packed_info))
+        if prefix_trans is not None:
+            trans *= prefix_trans
+        weights = trans * alphas
+        ctx.set_materialize_grads(False)
+        ctx.save_for_backward(
+            t_starts, t_ends, sigmas, packed_info, prefix_trans
+        )
+        return weights, trans, alphas
+
+    @staticmethod
+    def backward(ctx, grad_weights, grad_trans, grad_alphas):
+        t_starts, t_ends, sigmas, packed_info, prefix_trans = ctx.saved_tensors
+        deltas = t_ends - t_starts
+        sigmas_dt = sigmas * deltas
+        alphas = 1.0 - torch.exp(-sigmas_dt)
+        trans = torch.exp(-exclusive_sum(sigmas_dt, packed_info))
+        if prefix_trans is not None:
+            trans_scan = trans
+            trans = trans * prefix_trans
+
+        # Total gradients w.r.t. alphas and trans, through weights = trans * alphas.
+        grad_a = torch.zeros_like(alphas)
+        grad_t = torch.zeros_like(trans)
+        if grad_weights is not None:
+            grad_a += grad_weights * trans
+            grad_t += grad_weights * alphas
+        if grad_alphas is not None:
+            grad_a += grad_alphas
+        if grad_trans is not None:
+            grad_t += grad_trans
+
+        # d(alpha_k) / d(sigma_dt_k) = 1 - alpha_k, and
+        # d(trans_i) / d(sigma_dt_k) = -trans_i for all k < i.
+        grad_sigmas_dt = grad_a * (1.0 - alphas) - _exclusive_sum_reverse(
+            grad_t * trans, packed_info
+        )
+        grad_t_starts = grad_t_ends = grad_sigmas = grad_prefix_trans = None
+        if ctx.needs_input_grad[0]:
+            grad_t_starts = -grad_sigmas_dt * sigmas
+        if ctx.needs_input_grad[1]:
+            grad_t_ends = grad_sigmas_dt * sigmas
+        if ctx.needs_input_grad[2]:
+            grad_sigmas = grad_sigmas_dt * deltas
+        if ctx.needs_input_grad[4]:
+            grad_prefix_trans = grad_t * trans_scan
+        return grad_t_starts, grad_t_ends, grad_sigmas, None, grad_prefix_trans
+
+
 @torch.no_grad()
 def render_visibility_from_alpha(
     alphas: Tensor,
-    packed_info: Optional[Tensor] = None,
+    packed_info: Optional[Union[Tensor, PackedRays]] = None,
     ray_indices: Optional[Tensor] = None,
     n_rays: Optional[int] = None,
     early_stop_eps: float = 1e-4,
@@ -386,9 +666,11 @@ def render_visibility_from_alpha(
         alphas: The opacity values of the samples. Tensor with shape (all_samples,) or (n_rays, n_samples).
         packed_info: A tensor of shape (n_rays, 2) that specifies the start and count
             of each chunk in the flattened samples, with in total n_rays chunks.
-            Useful for flattened input.
+            Useful for flattened input. Can also be a :class:`PackedRays`.
         ray_indices: Ray indices of the flattened samples. LongTensor with shape (all_samples).
-        n_rays: Number of rays. Only useful when `ray_indices` is provided.
+        n_rays: Number of rays. Only useful when `ray_indices` is provided. If
+            not given, it is inferred from `ray_indices`, which synchronizes
+            with the device.
         early_stop_eps: The early stopping threshold on transmittance.
         alpha_thre: The threshold on opacity.
         prefix_trans: The pre-computed transmittance of the samples. Tensor with shape (all_samples,).
@@ -423,7 +705,7 @@ def render_visibility_from_density(
     t_starts: Tensor,
     t_ends: Tensor,
     sigmas: Tensor,
-    packed_info: Optional[Tensor] = None,
+    packed_info: Optional[Union[Tensor, PackedRays]] = None,
     ray_indices: Optional[Tensor] = None,
     n_rays: Optional[int] = None,
     early_stop_eps: float = 1e-4,
@@ -444,9 +726,11 @@ def render_visibility_from_density(
         alphas: The opacity values of the samples. Tensor with shape (all_samples,) or (n_rays, n_samples).
         packed_info: A tensor of shape (n_rays, 2) that specifies the start and count
             of each chunk in the flattened samples, with in total n_rays chunks.
-            Useful for flattened input.
+            Useful for flattened input. Can also be a :class:`PackedRays`.
         ray_indices: Ray indices of the flattened samples. LongTensor with shape (all_samples).
-        n_rays: Number of rays. Only useful when `ray_indices` is provided.
+        n_rays: Number of rays. Only useful when `ray_indices` is provided. If
+            not given, it is inferred from `ray_indices`, which synchronizes
+            with the device.
         early_stop_eps: The early stopping threshold on transmittance.
         alpha_thre: The threshold on opacity.
         prefix_trans: The pre-computed transmittance of the samples. Tensor with shape (all_samples,).
@@ -483,13 +767,18 @@ def render_visibility_from_density(
 def accumulate_along_rays(
     weights: Tensor,
     values: Optional[Tensor] = None,
-    ray_indices: Optional[Tensor] = None,
+    ray_indices: Optional[Union[Tensor, PackedRays]] = None,
     n_rays: Optional[int] = None,
+    packed_info: Optional[Union[Tensor, PackedRays]] = None,
 ) -> Tensor:
     """Accumulate volumetric values along the ray.
 
     This function supports both batched inputs and flattened inputs with
-    `ray_indices` and `n_rays` provided.
+    `ray_indices` and `n_rays` provided, or with `packed_info` provided.
+
+    With `packed_info`, the samples of each ray are summed up with a
+    segmented reduction, which is faster than scattering with `ray_indices`
+    and deterministic.
 
     Note:
         This function is differentiable to `weights` and `values`.
@@ -505,8 +794,14 @@ def accumulate_along_rays(
         ray_indices: Ray indices of the samples with shape (all_samples,).
             If provided, `weights` must be a flattened tensor with shape (all_samples,)
             and values (if not None) must be a flattened tensor with shape (all_samples, D).
-            Default: None.
+            Can also be a :class:`PackedRays`. Default: None.
         n_rays: Number of rays. Should be provided together with `ray_indices`. Default: None.
+        packed_info: A tensor of shape (n_rays, 2) that specifies the start and count
+            of each chunk in the flattened samples, with in total n_rays chunks.
+            The chunks must be in the order of the rays and must not overlap,
+            but may leave gaps between them, which are ignored. If provided,
+            `ray_indices` and `n_rays` are ignored. Can also be a
+            :class:`PackedRays`. Default: None.
 
     Returns:
         Accumulated values with shape (n_rays, D). If `values` is not given we return
@@ -529,19 +824,31 @@ def accumulate_along_rays(
         print(colors.shape, opacities.shape, depths.shape)
 
     """
+    if packed_info is None and isinstance(ray_indices, PackedRays):
+        packed_info = ray_indices
+    contiguous = (
+        isinstance(packed_info, PackedRays) and packed_info.is_contiguous
+    )
+    packed_info = _as_packed_info(packed_info)
     if values is None:
         src = weights[..., None]
     else:
         assert values.dim() == weights.dim() + 1
         assert weights.shape == values.shape[:-1]
         src = weights[..., None] * values
-    if ray_indices is not None:
+    if packed_info is not None:
+        assert weights.dim() == 1, "weights must be flattened"
+        outputs = _segment_sum(src, packed_info, contiguous)
+    elif ray_indices is not None:
         assert n_rays is not None, "n_rays must be provided"
         assert weights.dim() == 1, "weights must be flattened"
-        outputs = torch.zeros(
-            (n_rays, src.shape[-1]), device=src.device, dtype=src.dtype
-        )
-        outputs.index_add_(0, ray_indices, src)
+        if are_deterministic_algorithms_enabled():
+            outputs = _scatter_sum_fixed_order(src, ray_indices, n_rays)
+        else:
+            outputs = torch.zeros(
+                (n_rays, src.shape[-1]), device=src.device, dtype=src.dtype
+            )
+            outputs.index_add_(0, ray_indices, src)
     else:
         outputs = torch.sum(src, dim=-2)
     return outputs
@@ -550,24 +857,92 @@ def accumulate_along_rays(
 def accumulate_along_rays_(
     weights: Tensor,
     values: Optional[Tensor] = None,
-    ray_indices: Optional[Tensor] = None,
+    ray_indices: Optional[Union[Tensor, PackedRays]] = None,
     outputs: Optional[Tensor] = None,
+    packed_info: Optional[Union[Tensor, PackedRays]] = None,
 ) -> None:
     """Accumulate volumetric values along the ray.
 
     Inplace version of :func:`accumulate_along_rays`.
     """
+    if packed_info is None and isinstance(ray_indices, PackedRays):
+        packed_info = ray_indices
+    contiguous = (
+        isinstance(packed_info, PackedRays) and packed_info.is_contiguous
+    )
+    packed_info = _as_packed_info(packed_info)
     if values is None:
         src = weights[..., None]
     else:
         assert values.dim() == weights.dim() + 1
         assert weights.shape == values.shape[:-1]
         src = weights[..., None] * values
-    if ray_indices is not None:
+    if packed_info is not None:
+        assert weights.dim() == 1, "weights must be flattened"
+        outputs.add_(_segment_sum(src, packed_info, contiguous))
+    elif ray_indices is not None:
         assert weights.dim() == 1, "weights must be flattened"
         assert (
             outputs.dim() == 2 and outputs.shape[-1] == src.shape[-1]
         ), "outputs must be of shape (n_rays, D)"
-        outputs.index_add_(0, ray_indices, src)
+        if are_deterministic_algorithms_enabled():
+            outputs.add_(
+                _scatter_sum_fixed_order(src, ray_indices, outputs.shape[0])
+            )
+        else:
+            outputs.index_add_(0, ray_indices, src)
     else:
         outputs.add_(src.sum(dim=-2))
+
+
+def _segment_sum(
+    src: Tensor, packed_info: Tensor, contiguous: bool = False
+) -> Tensor:
+    """Sum of the chunks of `src` (all_samples, D) specified by `packed_info`.
+    Returns a tensor with shape (n_rays, D).
+
+    The chunks must be in the order of the rays and must not overlap. Unless
+    they are known to be `contiguous`, i.e. packed back to back and covering
+    all of `src`, the gaps around them (e.g., in the over-allocated outputs of
+    :func:`traverse_grids`) are reduced as segments of their own and dropped,
+    so that the layout needs not be checked on the host.
+    """
+    chunk_starts, chunk_cnts = packed_info.unbind(-1)
+    if contiguous:
+        lengths = chunk_cnts
+    else:
+        chunk_ends = torch.nn.functional.pad(chunk_starts + chunk_cnts, (1, 0))
+        gaps = chunk_starts - chunk_ends[:-1]
+        lengths = torch.cat(
+            [
+                torch.stack([gaps, chunk_cnts], dim=-1).flatten(),
+                src.shape[0] - chunk_ends[-1:],
+            ]
+        )
+    if src.device.type in ("cpu", "cuda"):
+        # `unsafe` skips validating the lengths, which syncs on CUDA.
+        sums = torch.segment_reduce(
+            src, "sum", lengths=lengths, axis=0, unsafe=src.is_cuda
+        )
+    else:
+        segment_ids = torch.repeat_interleave(
+            torch.arange(len(lengths), device=src.device),
+            lengths,
+            output_size=src.shape[0],
+        )
+        sums = torch.zeros(
+            (len(lengths), src.shape[-1]), device=src.device, dtype=src.dtype
+        )
+        sums.index_add_(0, segment_ids, src)
+    return sums if contiguous else sums[1::2]
+
+
+def _scatter_sum_fixed_order(
+    src: Tensor, ray_indices: Tensor, n_rays: int
+) -> Tensor:
+    """Same as `index_add_` of `src` into zeros of shape (n_rays, D), but the
+    samples of each ray are summed up in a fixed order."""
+    order = torch.argsort(ray_indices, stable=True)
+    return _segment_sum(
+        src[order], pack_info(ray_indices, n_rays), contiguous=True
+    )
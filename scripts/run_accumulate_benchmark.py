@@ -0,0 +1,77 @@
+"""Benchmark `accumulate_along_rays` with `packed_info` (segmented reduction)
+against `ray_indices` (scatter with `index_add_`).
+
+Usage:
+    python scripts/run_accumulate_benchmark.py --n_samples 1e6 1e7 5e7
+"""
+import argparse
+import time
+from typing import Callable
+
+import torch
+
+from nerfacc.volrend import accumulate_along_rays
+
+
+def timeit(func: Callable, device: torch.device, repeat: int) -> float:
+    """Average wall time of `func` in ms."""
+    func()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    tic = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - tic) / repeat * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--n_samples", type=float, nargs="+", default=[1e6, 1e7, 5e7]
+    )
+    parser.add_argument("--samples_per_ray", type=int, default=64)
+    parser.add_argument("--dim", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    torch.manual_seed(42)
+    device = torch.device(args.device)
+    print(f"device: {device}, threads: {torch.get_num_threads()}")
+    for n_samples in args.n_samples:
+        n_rays = int(n_samples) // args.samples_per_ray
+        chunk_cnts = torch.randint(
+            0, 2 * args.samples_per_ray, (n_rays,), device=device
+        )
+        chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+        packed_info = torch.stack([chunk_starts, chunk_cnts], dim=-1)
+        ray_indices = torch.repeat_interleave(
+            torch.arange(n_rays, device=device), chunk_cnts
+        )
+        n = ray_indices.shape[0]
+        weights = torch.rand((n,), device=device, requires_grad=True)
+        values = torch.rand((n, args.dim), device=device, requires_grad=True)
+
+        def run_index_add():
+            accumulate_along_rays(
+                weights, values, ray_indices=ray_indices, n_rays=n_rays
+            ).sum().backward()
+
+        def run_segment():
+            accumulate_along_rays(
+                weights, values, packed_info=packed_info
+            ).sum().backward()
+
+        t_index_add = timeit(run_index_add, device, args.repeat)
+        t_segment = timeit(run_segment, device, args.repeat)
+        print(
+            f"* n_samples {n}: index_add_ {t_index_add:.1f} ms, "
+            f"segment_reduce {t_segment:.1f} ms (fwd+bwd), "
+            f"speedup {t_index_add / t_segment:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Benchmark the cost of `nerfacc.use_deterministic_algorithms`.
+
+Compares the fixed-order segmented scan against the cumsum based scan, and
+the sort + segmented sum accumulation against `index_add_`.
+
+Usage:
+    python scripts/run_determinism_benchmark.py --n_rays 4096 --max_samples 256
+"""
+import argparse
+import time
+
+import torch
+
+from nerfacc.scan import (
+    _segmented_cumprod,
+    _segmented_cumsum,
+    _segmented_scan_fixed_order,
+)
+from nerfacc.volrend import _scatter_sum_fixed_order
+
+
+def timeit(func, repeat: int, device: torch.device) -> float:
+    """Average wall time of `func` in ms."""
+    func()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    tic = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - tic) / repeat * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_rays", type=int, default=4096)
+    parser.add_argument("--max_samples", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    torch.manual_seed(42)
+    device = torch.device(args.device)
+    chunk_cnts = torch.randint(0, args.max_samples, (args.n_rays,))
+    chunk_cnts = chunk_cnts.to(device)
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    n_samples = int(chunk_cnts.sum())
+    data = torch.rand((n_samples,), device=device)
+    src = torch.rand((n_samples, 3), device=device)
+    ray_indices = torch.repeat_interleave(
+        torch.arange(args.n_rays, device=device), chunk_cnts
+    )
+    # Shuffle so that the sort is not a no-op.
+    perm = torch.randperm(n_samples, device=device)
+    ray_indices, src = ray_indices[perm], src[perm]
+    print(f"n_rays: {args.n_rays}, n_samples: {n_samples}")
+
+    def index_add():
+        outputs = torch.zeros((args.n_rays, 3), device=device)
+        return outputs.index_add_(0, ray_indices, src)
+
+    cases = [
+        (
+            "inclusive_sum",
+            lambda: _segmented_cumsum(chunk_starts, chunk_cnts, data, False),
+            lambda: _segmented_scan_fixed_order(
+                chunk_starts, chunk_cnts, data, False, False
+            ),
+        ),
+        (
+            "exclusive_prod",
+            lambda: _segmented_cumprod(
+                chunk_starts, chunk_cnts, data, exclusive=True
+            ),
+            lambda: _segmented_scan_fixed_order(
+                chunk_starts, chunk_cnts, data, True, True
+            ),
+        ),
+        (
+            "accumulate_along_rays",
+            index_add,
+            lambda: _scatter_sum_fixed_order(src, ray_indices, args.n_rays),
+        ),
+    ]
+    for name, default_fn, deterministic_fn in cases:
+        default_ms = timeit(default_fn, args.repeat, device)
+        deterministic_ms = timeit(deterministic_fn, args.repeat, device)
+        print(
+            f"* {name}: default {default_ms:.2f} ms, "
+            f"deterministic {deterministic_ms:.2f} ms "
+            f"({deterministic_ms / default_ms:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
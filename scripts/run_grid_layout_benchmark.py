@@ -0,0 +1,125 @@
+"""Benchmark the traversal throughput of the occupancy grid layouts.
+
+Compares `traverse_grids` on the row-major dense binaries against the
+bit-packed Morton (Z-curve) layout of :class:`nerfacc.grid.MortonGrid`, and
+against the dense binaries with the occupancy pyramid of
+:func:`nerfacc.grid.build_occupancy_mips` to skip empty blocks, for rays
+travelling along each axis and in random directions.
+
+Usage:
+    python scripts/run_grid_layout_benchmark.py --resolutions 64 128 256 512
+"""
+import argparse
+import time
+
+import torch
+import torch.nn.functional as F
+
+from nerfacc.grid import (
+    MortonGrid,
+    _enlarge_aabb,
+    build_occupancy_mips,
+    traverse_grids,
+)
+
+
+def timeit(func, repeat: int, device: torch.device) -> float:
+    """Average wall time of `func` in s."""
+    func()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    tic = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - tic) / repeat
+
+
+def scene_binaries(
+    levels: int, resolution: int, device: torch.device
+) -> torch.Tensor:
+    """Occupied cells on a sphere shell, like the surface of an object."""
+    x2 = (torch.arange(resolution, device=device) + 0.5) / resolution * 2 - 1
+    x2 = x2**2
+    r = torch.sqrt(x2[:, None, None] + x2[None, :, None] + x2[None, None, :])
+    shell = (r - 0.5).abs() < 0.05
+    return shell[None].repeat(levels, 1, 1, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--resolutions", type=int, nargs="+", default=[64, 128, 256, 512]
+    )
+    parser.add_argument("--levels", type=int, default=1)
+    parser.add_argument("--n_rays", type=int, default=65536)
+    parser.add_argument("--render_step_size", type=float, default=5e-3)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    torch.manual_seed(42)
+    aabb = torch.tensor([-1.0, -1.0, -1.0, 1.0, 1.0, 1.0], device=device)
+    aabbs = torch.stack(
+        [_enlarge_aabb(aabb, 2**i) for i in range(args.levels)]
+    )
+    directions = {
+        "x": torch.tensor([1.0, 1e-3, 1e-3]),
+        "y": torch.tensor([1e-3, 1.0, 1e-3]),
+        "z": torch.tensor([1e-3, 1e-3, 1.0]),
+        "random": None,
+    }
+
+    for resolution in args.resolutions:
+        binaries = scene_binaries(args.levels, resolution, device)
+        mips = build_occupancy_mips(binaries)
+        layouts = {
+            "dense": (binaries, None),
+            "morton": (MortonGrid.from_dense(binaries), None),
+            "mips": (binaries, mips),
+        }
+        print(
+            f"resolution: {resolution}^3, dense: "
+            f"{binaries.numel() / 2**20:.1f} MiB, morton: "
+            f"{layouts['morton'][0].bits.numel() / 2**20:.2f} MiB, mips: "
+            f"{mips.numel() / 2**20:.2f} MiB"
+        )
+        for name, direction in directions.items():
+            if direction is None:
+                rays_d = torch.randn((args.n_rays, 3), device=device)
+            else:
+                rays_d = direction.to(device).expand(args.n_rays, 3)
+            rays_d = F.normalize(rays_d, dim=-1)
+            # start on the face of the aabb opposite to the direction.
+            rays_o = torch.rand((args.n_rays, 3), device=device) * 2 - 1
+            rays_o = rays_o - rays_d * 2.0
+
+            rays_per_s = {}
+            for layout, (grid, grid_mips) in layouts.items():
+                elapsed = timeit(
+                    lambda: traverse_grids(
+                        rays_o,
+                        rays_d,
+                        grid,
+                        aabbs,
+                        step_size=args.render_step_size,
+                        mips=grid_mips,
+                    ),
+                    args.repeat,
+                    device,
+                )
+                rays_per_s[layout] = args.n_rays / elapsed
+            print(
+                f"* {name}: dense {rays_per_s['dense'] / 1e6:.2f} Mrays/s, "
+                + ", ".join(
+                    f"{layout} {rays_per_s[layout] / 1e6:.2f} Mrays/s "
+                    f"({rays_per_s[layout] / rays_per_s['dense']:.2f}x)"
+                    for layout in ["morton", "mips"]
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Benchmark the per-step cost of the occupancy grid updates.
+
+Compares `OccGridEstimator.update_every_n_steps` refreshing a quarter of the
+grid every n steps against the budgeted updates refreshing a fixed number of
+cells at every step, with a small MLP as the occupancy function, and reports
+the mean and the worst latency per step.
+
+Usage:
+    python scripts/run_occ_update_benchmark.py --resolution 128 --budget 65536
+"""
+import argparse
+import time
+
+import torch
+
+from nerfacc.estimators.occ_grid import OccGridEstimator
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resolution", type=int, default=128)
+    parser.add_argument("--levels", type=int, default=1)
+    parser.add_argument("--n", type=int, default=16)
+    parser.add_argument("--budget", type=int, default=None)
+    parser.add_argument("--steps", type=int, default=64)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    torch.manual_seed(42)
+    mlp = torch.nn.Sequential(
+        torch.nn.Linear(3, 64),
+        torch.nn.ReLU(),
+        torch.nn.Linear(64, 64),
+        torch.nn.ReLU(),
+        torch.nn.Linear(64, 1),
+    ).to(device)
+
+    def occ_eval_fn(x):
+        return torch.sigmoid(mlp(x)) * 1e-2
+
+    n_cells = args.levels * args.resolution**3
+    # refresh as many cells per step as the every-n updates on average.
+    budget = args.budget or n_cells // 4 // args.n
+    rays_o = torch.randn((4096, 3), device=device) * 0.1
+    rays_o[:, 2] += 3.0
+    rays_d = torch.randn((4096, 3), device=device) * 0.3
+    rays_d[:, 2] -= 1.0
+    rays_d = rays_d / rays_d.norm(dim=-1, keepdim=True)
+
+    for name, kwargs in [
+        (f"every {args.n} steps", dict(n=args.n)),
+        (f"budget {budget}", dict(budget=budget)),
+    ]:
+        estimator = OccGridEstimator(
+            roi_aabb=[-1.0, -1, -1, 1, 1, 1],
+            resolution=args.resolution,
+            levels=args.levels,
+        ).to(device)
+        # skip the warmup, which updates all the cells in both cases.
+        estimator.update_every_n_steps(0, occ_eval_fn, warmup_steps=1, n=1)
+        latencies = []
+        for step in range(1, args.steps + 1):
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            tic = time.perf_counter()
+            estimator.update_every_n_steps(
+                step, occ_eval_fn, warmup_steps=1, **kwargs
+            )
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            latencies.append(time.perf_counter() - tic)
+            estimator.sampling(rays_o, rays_d, render_step_size=1e-2)
+        latencies = torch.tensor(latencies) * 1e3
+        print(
+            f"{name}: mean {latencies.mean():.2f} ms/step, "
+            f"max {latencies.max():.2f} ms/step, "
+            f"occupied {estimator.binaries.float().mean():.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Benchmark the per-call overhead of converting `RayIntervals` to and from
+the C++ `RaySegmentsSpec`.
+
+Compares against storing `packed_info` and slicing / stacking it on every
+conversion, which is how the conversion used to work.
+
+Usage:
+    python scripts/run_ray_segments_benchmark.py --n_rays 1000000
+"""
+import argparse
+import time
+
+import torch
+
+from nerfacc import cuda as _C
+from nerfacc.data_specs import RayIntervals
+
+
+def legacy_to_cpp(vals, packed_info, ray_indices):
+    spec = _C.RaySegmentsSpec()
+    spec.vals = vals.contiguous()
+    spec.chunk_starts = packed_info[:, 0].contiguous()
+    spec.chunk_cnts = packed_info[:, 1].contiguous()
+    spec.ray_indices = ray_indices.contiguous()
+    return spec
+
+
+def legacy_from_cpp(spec):
+    packed_info = torch.stack([spec.chunk_starts, spec.chunk_cnts], -1)
+    return spec.vals, packed_info, spec.ray_indices
+
+
+def timeit(func, repeat: int, device: torch.device) -> float:
+    """Average wall time of `func` in us."""
+    func()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    tic = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - tic) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_rays", type=int, default=1_000_000)
+    parser.add_argument("--samples_per_ray", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    n_rays, n = args.n_rays, args.samples_per_ray
+    chunk_cnts = torch.full((n_rays,), n, device=device)
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    packed_info = torch.stack([chunk_starts, chunk_cnts], -1)
+    vals = torch.rand((n_rays * n,), device=device)
+    ray_indices = torch.arange(n_rays, device=device).repeat_interleave(n)
+    intervals = RayIntervals(
+        vals, packed_info=packed_info, ray_indices=ray_indices
+    )
+    spec = intervals._to_cpp()
+    print(f"n_rays: {n_rays}, n_edges: {n_rays * n}")
+
+    for name, legacy_fn, fn in [
+        (
+            "to_cpp",
+            lambda: legacy_to_cpp(vals, packed_info, ray_indices),
+            intervals._to_cpp,
+        ),
+        (
+            "from_cpp",
+            lambda: legacy_from_cpp(spec),
+            lambda: RayIntervals._from_cpp(spec),
+        ),
+    ]:
+        legacy_us = timeit(legacy_fn, args.repeat, device)
+        us = timeit(fn, args.repeat, device)
+        print(f"* {name}: packed_info {legacy_us:.1f} us, chunks {us:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark the memory kept alive for backward by `render_weight_from_density`.
+
+Compares against composing `render_transmittance_from_density` with a
+multiplication, which is how the weights used to be computed.
+
+Usage:
+    python scripts/run_render_weight_benchmark.py --n_rays 4096 --max_samples 256
+"""
+import argparse
+import time
+
+import torch
+
+from nerfacc.volrend import (
+    render_transmittance_from_density,
+    render_weight_from_density,
+)
+
+
+def composed_weight_from_density(t_starts, t_ends, sigmas, packed_info):
+    trans, alphas = render_transmittance_from_density(
+        t_starts, t_ends, sigmas, packed_info
+    )
+    return trans * alphas, trans, alphas
+
+
+def saved_bytes(func, *args) -> int:
+    """Bytes of the tensors saved for backward by `func`, excluding the inputs
+    and the returned weights (which the caller keeps alive anyway)."""
+    saved = {}
+
+    def pack_hook(x):
+        saved[x.untyped_storage().data_ptr()] = x.untyped_storage().nbytes()
+        return x
+
+    with torch.autograd.graph.saved_tensors_hooks(pack_hook, lambda x: x):
+        weights, _, _ = func(*args)
+    excluded = {x.untyped_storage().data_ptr() for x in list(args) + [weights]}
+    return sum(v for k, v in saved.items() if k not in excluded)
+
+
+def timeit(func, repeat: int) -> float:
+    """Average wall time of `func` in ms."""
+    func()
+    tic = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - tic) / repeat * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_rays", type=int, default=4096)
+    parser.add_argument("--max_samples", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    torch.manual_seed(42)
+    device = torch.device(args.device)
+    chunk_cnts = torch.randint(0, args.max_samples, (args.n_rays,))
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    packed_info = torch.stack([chunk_starts, chunk_cnts], dim=-1).to(device)
+    n_samples = int(chunk_cnts.sum())
+    t_starts = torch.rand((n_samples,), device=device)
+    t_ends = t_starts + torch.rand((n_samples,), device=device)
+    sigmas = torch.rand((n_samples,), device=device, requires_grad=True)
+    print(f"n_rays: {args.n_rays}, n_samples: {n_samples}")
+
+    for name, fn in [
+        ("composed", composed_weight_from_density),
+        ("render_weight_from_density", render_weight_from_density),
+    ]:
+        nbytes = saved_bytes(fn, t_starts, t_ends, sigmas, packed_info)
+        elapsed = timeit(
+            lambda: fn(t_starts, t_ends, sigmas, packed_info)[0]
+            .sum()
+            .backward(),
+            args.repeat,
+        )
+        print(
+            f"* {name}: saved for backward {nbytes / 2**20:.1f} MiB "
+            f"({nbytes / n_samples:.1f} bytes per sample), "
+            f"fwd+bwd {elapsed:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
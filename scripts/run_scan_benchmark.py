@@ -0,0 +1,91 @@
+"""Benchmark the CPU scan kernels against a naive per-ray `torch.cumsum` loop.
+
+Usage:
+    python scripts/run_scan_benchmark.py --n_rays 4096 --max_samples 128
+"""
+import argparse
+import time
+from typing import Callable
+
+import torch
+
+from nerfacc.scan import exclusive_prod, exclusive_sum, inclusive_sum
+
+
+def timeit(func: Callable, warmup: int = 3, repeat: int = 10) -> float:
+    """Average wall time of `func` in ms."""
+    for _ in range(warmup):
+        func()
+    tic = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - tic) / repeat * 1e3
+
+
+def naive_scan(inputs, packed_info, scan_fn):
+    """Scan each ray with a separate torch call."""
+    outputs = []
+    for start, cnt in packed_info.tolist():
+        outputs.append(scan_fn(inputs[start : start + cnt]))
+    return torch.cat(outputs)
+
+
+def naive_exclusive_sum(x):
+    return torch.cumsum(x, dim=0) - x
+
+
+def naive_exclusive_prod(x):
+    return torch.cumprod(
+        torch.cat([torch.ones_like(x[:1]), x[:-1]], dim=0), dim=0
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_rays", type=int, default=4096)
+    parser.add_argument("--max_samples", type=int, default=128)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    torch.manual_seed(42)
+    chunk_cnts = torch.randint(0, args.max_samples, (args.n_rays,))
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    packed_info = torch.stack([chunk_starts, chunk_cnts], dim=-1)
+    n_samples = int(chunk_cnts.sum())
+    inputs = torch.rand((n_samples,), requires_grad=True)
+    print(
+        f"n_rays: {args.n_rays}, n_samples: {n_samples}, "
+        f"threads: {torch.get_num_threads()}"
+    )
+
+    cases = [
+        ("inclusive_sum", inclusive_sum, lambda x: torch.cumsum(x, dim=0)),
+        ("exclusive_sum", exclusive_sum, naive_exclusive_sum),
+        ("exclusive_prod", exclusive_prod, naive_exclusive_prod),
+    ]
+    for name, fn, naive_fn in cases:
+        ext_fwd = timeit(
+            lambda: fn(inputs.detach(), packed_info), repeat=args.repeat
+        )
+        ext_bwd = timeit(
+            lambda: fn(inputs, packed_info).sum().backward(),
+            repeat=args.repeat,
+        )
+        naive_fwd = timeit(
+            lambda: naive_scan(inputs.detach(), packed_info, naive_fn),
+            repeat=args.repeat,
+        )
+        naive_bwd = timeit(
+            lambda: naive_scan(inputs, packed_info, naive_fn).sum().backward(),
+            repeat=args.repeat,
+        )
+        print(
+            f"* {name}: "
+            f"cpu ext {ext_fwd:.2f} ms (fwd), {ext_bwd:.2f} ms (fwd+bwd) | "
+            f"per-ray loop {naive_fwd:.2f} ms (fwd), {naive_bwd:.2f} ms (fwd+bwd) | "
+            f"speedup {naive_fwd / ext_fwd:.1f}x, {naive_bwd / ext_bwd:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
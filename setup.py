@@ -13,6 +13,7 @@ URL = "https://github.com/KAIR-BAIR/nerfacc"
 
 BUILD_NO_CUDA = os.getenv("BUILD_NO_CUDA", "0") == "1"
 WITH_SYMBOLS = os.getenv("WITH_SYMBOLS", "0") == "1"
+FORCE_CUDA = os.getenv("FORCE_CUDA", "0") == "1"
 
 
 def get_ext():
@@ -26,12 +27,20 @@ def get_ext():
 def get_extensions():
     import torch
     from torch.__config__ import parallel_info
-    from torch.utils.cpp_extension import CUDAExtension
+    from torch.utils.cpp_extension import CUDA_HOME, CppExtension, CUDAExtension
+
+    # decide from the toolkit, not from a visible GPU: the wheels are built on
+    # GPU-less runners. Use BUILD_NO_CUDA=1 to skip the extension.
+    with_cuda = (
+        CUDA_HOME is not None or torch.version.hip is not None or FORCE_CUDA
+    )
 
     extensions_dir = osp.join("nerfacc", "cuda", "csrc")
-    sources = glob.glob(osp.join(extensions_dir, "*.cu")) + glob.glob(
-        osp.join(extensions_dir, "*.cpp")
+    sources = glob.glob(osp.join(extensions_dir, "*.cpp")) + glob.glob(
+        osp.join(extensions_dir, "cpu", "*.cpp")
     )
+    if with_cuda:
+        sources += glob.glob(osp.join(extensions_dir, "*.cu"))
     # remove generated 'hip' files, in case of rebuilds
     sources = [path for path in sources if "hip" not in path]
 
@@ -75,9 +84,12 @@ def get_extensions():
         undef_macros += ["__HIP_NO_HALF_CONVERSIONS__"]
     else:
         nvcc_flags += ["--expt-relaxed-constexpr"]
-    extra_compile_args["nvcc"] = nvcc_flags
+    if with_cuda:
+        define_macros += [("WITH_CUDA", None)]
+        extra_compile_args["nvcc"] = nvcc_flags
 
-    extension = CUDAExtension(
+    Extension = CUDAExtension if with_cuda else CppExtension
+    extension = Extension(
         f"nerfacc.csrc",
         sources,
         include_dirs=[osp.join(extensions_dir, "include")],
@@ -0,0 +1,172 @@
+import pytest
+import torch
+
+import nerfacc
+
+
+@pytest.fixture
+def deterministic():
+    nerfacc.use_deterministic_algorithms(True)
+    yield
+    nerfacc.use_deterministic_algorithms(False)
+
+
+def test_switch(deterministic):
+    from nerfacc.cuda import Backend
+
+    assert nerfacc.are_deterministic_algorithms_enabled()
+    backend = Backend(
+        "dummy",
+        ("cpu",),
+        ("inclusive_sum", "exclusive_sum"),
+        lambda: object(),
+        nondeterministic_ops=("inclusive_sum",),
+    )
+    cpu = torch.device("cpu")
+    assert not backend.supports("inclusive_sum", cpu)
+    assert backend.supports("exclusive_sum", cpu)
+    nerfacc.use_deterministic_algorithms(False)
+    assert not nerfacc.are_deterministic_algorithms_enabled()
+    assert backend.supports("inclusive_sum", cpu)
+
+
+def test_scan_fixed_order():
+    from nerfacc.scan import _segmented_scan_fixed_order
+
+    torch.manual_seed(42)
+    chunk_cnts = torch.randint(0, 40, (100,))
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    data = torch.rand((int(chunk_cnts.sum()),), dtype=torch.float64) + 0.5
+
+    def reference(x, is_prod, exclusive, normalize, reverse):
+        if reverse:
+            x = x.flip(0)
+        scan = torch.cumprod if is_prod else torch.cumsum
+        outputs = scan(x, dim=0)
+        if normalize:
+            outputs = outputs / outputs[-1:]
+        if exclusive:
+            outputs = torch.cat([torch.ones_like(x[:1]) * is_prod, outputs])
+            outputs = outputs[:-1]
+        return outputs.flip(0) if reverse else outputs
+
+    for is_prod in [False, True]:
+        for exclusive in [False, True]:
+            for reverse in [False, True]:
+                for normalize in [False, not is_prod]:
+                    outputs = _segmented_scan_fixed_order(
+                        chunk_starts,
+                        chunk_cnts,
+                        data,
+                        is_prod,
+                        exclusive,
+                        normalize,
+                        reverse,
+                    )
+                    outputs_ref = torch.cat(
+                        [
+                            reference(
+                                data[s : s + c],
+                                is_prod,
+                                exclusive,
+                                normalize,
+                                reverse,
+                            )
+                            for s, c in zip(
+                                chunk_starts.tolist(), chunk_cnts.tolist()
+                            )
+                        ]
+                    )
+                    assert torch.allclose(outputs, outputs_ref)
+
+
+def _run_pipeline(inputs):
+    """Scans, weights and accumulation with gradients."""
+    from nerfacc import cuda as _C
+
+    ray_indices, packed_info, t_starts, t_ends, sigmas, rgbs = inputs
+    sigmas = sigmas.clone().requires_grad_(True)
+    rgbs = rgbs.clone().requires_grad_(True)
+    n_rays = packed_info.shape[0]
+
+    outputs = [
+        nerfacc.inclusive_sum(sigmas, packed_info),
+        nerfacc.exclusive_prod(torch.sigmoid(sigmas), packed_info),
+    ]
+    weights, trans, _ = nerfacc.render_weight_from_density(
+        t_starts, t_ends, sigmas, packed_info=packed_info
+    )
+    outputs += [
+        weights,
+        trans,
+        nerfacc.accumulate_along_rays(weights, rgbs, ray_indices, n_rays),
+    ]
+    if _C.is_supported("rendering_forward", "cpu"):
+        colors, opacities, depths, _ = nerfacc.rendering(
+            t_starts,
+            t_ends,
+            ray_indices,
+            n_rays,
+            rgb_sigma_fn=lambda *_: (rgbs, sigmas),
+        )
+        outputs += [colors, opacities, depths]
+    loss = sum((out * torch.cos(out)).sum() for out in outputs)
+    grads = torch.autograd.grad(loss, [sigmas, rgbs])
+    return [out.detach() for out in outputs] + list(grads)
+
+
+def test_bitwise_reproducible_cpu(deterministic):
+    torch.manual_seed(42)
+    n_rays = 2000
+    chunk_cnts = torch.randint(0, 300, (n_rays,))
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    packed_info = torch.stack([chunk_starts, chunk_cnts], dim=-1)
+    ray_indices = torch.repeat_interleave(torch.arange(n_rays), chunk_cnts)
+    n_samples = ray_indices.shape[0]
+    t_starts = torch.rand((n_samples,))
+    t_ends = t_starts + torch.rand((n_samples,))
+    sigmas = torch.rand((n_samples,)) * 10
+    rgbs = torch.rand((n_samples, 3))
+    inputs = [ray_indices, packed_info, t_starts, t_ends, sigmas, rgbs]
+
+    num_threads = torch.get_num_threads()
+    try:
+        results = []
+        for threads in [1, 4, 1, 3]:
+            torch.set_num_threads(threads)
+            results.append(_run_pipeline(inputs))
+    finally:
+        torch.set_num_threads(num_threads)
+    for result in results[1:]:
+        for out, out_ref in zip(result, results[0]):
+            assert torch.equal(out, out_ref)
+
+
+def test_torch_reference_reproducible(deterministic):
+    from nerfacc.scan import (
+        _exclusive_prod_backward_torch,
+        _exclusive_prod_forward_torch,
+        _inclusive_sum_torch,
+    )
+
+    torch.manual_seed(42)
+    chunk_cnts = torch.randint(0, 300, (2000,))
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    data = torch.rand((int(chunk_cnts.sum()),))
+
+    def run():
+        sums = _inclusive_sum_torch(chunk_starts, chunk_cnts, data)
+        prods = _exclusive_prod_forward_torch(chunk_starts, chunk_cnts, data)
+        grads = _exclusive_prod_backward_torch(
+            chunk_starts, chunk_cnts, data, prods, sums
+        )
+        return sums, prods, grads
+
+    outputs_ref = run()
+    for _ in range(3):
+        for out, out_ref in zip(run(), outputs_ref):
+            assert torch.equal(out, out_ref)
+
+
+if __name__ == "__main__":
+    test_scan_fixed_order()
@@ -1,7 +1,10 @@
+import math
+import os
+
 import pytest
 import torch
 
-device = "cuda:0"
+device = "cuda:0" if torch.cuda.is_available() else "cpu"
 
 
 @pytest.mark.skipif(not torch.cuda.is_available, reason="No CUDA device")
@@ -233,10 +236,408 @@ def test_mark_invisible_cells():
     assert (grid_estimator.occs == 0).sum() == 53412
 
 
+def test_render_streaming_cpu():
+    from nerfacc import OccGridEstimator
+    from nerfacc import cuda as _C
+    from nerfacc import rendering
+
+    if not _C.is_supported("traverse_grids", "cpu"):
+        pytest.skip("No CPU extension")
+
+    torch.manual_seed(42)
+    n_rays = 256
+    render_step_size = 0.01
+    early_stop_eps = 1e-4
+
+    rays_o = torch.rand((n_rays, 3)) * 2 - 1.0
+    rays_o[:, 2] = -2.0
+    rays_d = torch.rand((n_rays, 3)) * 0.2 - 0.1
+    rays_d[:, 2] = 1.0
+    rays_d = rays_d / rays_d.norm(dim=-1, keepdim=True)
+
+    grid_estimator = OccGridEstimator(
+        roi_aabb=[-1.0, -1.0, -1.0, 1.0, 1.0, 1.0], resolution=32, levels=2
+    )
+    grid_estimator.binaries = torch.rand((2, 32, 32, 32)) > 0.2
+
+    def rgb_sigma_fn(t_starts, t_ends, ray_indices):
+        # an opaque ball in a faint fog.
+        t_mids = (t_starts + t_ends) / 2.0
+        x = rays_o[ray_indices] + t_mids[:, None] * rays_d[ray_indices]
+        sigmas = torch.where(x.norm(dim=-1) < 0.6, 50.0, 0.5)
+        return torch.sigmoid(x), sigmas
+
+    colors, opacities, depths, extras = grid_estimator.render_streaming(
+        rays_o,
+        rays_d,
+        rgb_sigma_fn,
+        render_step_size=render_step_size,
+        early_stop_eps=early_stop_eps,
+    )
+
+    ray_indices, t_starts, t_ends = grid_estimator.sampling(
+        rays_o,
+        rays_d,
+        sigma_fn=lambda *args: rgb_sigma_fn(*args)[1],
+        render_step_size=render_step_size,
+        early_stop_eps=early_stop_eps,
+    )
+    colors_ref, opacities_ref, depths_ref, _ = rendering(
+        t_starts, t_ends, ray_indices, n_rays, rgb_sigma_fn=rgb_sigma_fn
+    )
+    assert torch.allclose(colors, colors_ref, atol=1e-3)
+    assert torch.allclose(opacities, opacities_ref, atol=1e-3)
+    assert torch.allclose(depths, depths_ref, atol=1e-2)
+    # no more samples than the visible ones, plus the ends of the waves.
+    assert extras["n_evals"] < ray_indices.shape[0] + n_rays * extras["n_waves"]
+
+
+def test_occ_grid_snapshot(tmp_path):
+    from nerfacc import OccGridEstimator
+    from nerfacc.grid import MortonGrid
+
+    torch.manual_seed(42)
+    rays_o = torch.rand((100, 3)) * 2 - 1
+    rays_d = torch.randn((100, 3))
+    rays_d = rays_d / rays_d.norm(dim=-1, keepdim=True)
+    for resolution, levels in [(32, 1), ([5, 6, 7], 3), (16, 2)]:
+        grid_estimator = OccGridEstimator(
+            roi_aabb=[-1.0, -2.0, -1.0, 1.0, 1.0, 3.0],
+            resolution=resolution,
+            levels=levels,
+        )
+        grid_estimator.occs = torch.rand_like(grid_estimator.occs)
+        grid_estimator.binaries = (
+            torch.rand_like(grid_estimator.binaries, dtype=torch.float32) > 0.5
+        )
+        path = str(tmp_path / "grid.occ")
+        grid_estimator.save_snapshot(path)
+
+        loaded = OccGridEstimator.from_snapshot(path)
+        assert not loaded.training
+        assert torch.equal(loaded.resolution, grid_estimator.resolution)
+        assert torch.equal(loaded.aabbs, grid_estimator.aabbs)
+        binaries = loaded.binaries
+        if isinstance(binaries, MortonGrid):
+            binaries = binaries.to_dense()
+        assert torch.equal(binaries, grid_estimator.binaries)
+        assert torch.allclose(
+            loaded.occs.float(), grid_estimator.occs, atol=1e-3
+        )
+        ray_indices, t_starts, _ = loaded.sampling(
+            rays_o, rays_d, render_step_size=1e-2
+        )
+        _ray_indices, _t_starts, _ = grid_estimator.sampling(
+            rays_o, rays_d, render_step_size=1e-2
+        )
+        assert torch.equal(ray_indices, _ray_indices)
+        assert torch.allclose(t_starts, _t_starts, atol=1e-5)
+
+    # the power of 2 cubes are traversed in place, read-only.
+    assert isinstance(loaded.binaries, MortonGrid)
+    with pytest.raises(RuntimeError):
+        loaded.train().update_every_n_steps(0, lambda x: x[:, :1])
+    with pytest.raises(RuntimeError):
+        loaded.load_state_dict(grid_estimator.state_dict())
+    # ... from the mapping, not from a copy.
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([~loaded.morton_bits[-1, -1].item() & 0xFF]))
+    assert not torch.equal(loaded.binaries.to_dense(), grid_estimator.binaries)
+
+    with open(path, "r+b") as f:
+        f.write(b"NOTAGRID")
+    with pytest.raises(ValueError):
+        OccGridEstimator.from_snapshot(path)
+
+
+def test_traverse_grids_with_mips():
+    from nerfacc.estimators.occ_grid import OccGridEstimator
+    from nerfacc.grid import _enlarge_aabb, build_occupancy_mips, traverse_grids
+
+    torch.manual_seed(42)
+    n_rays = 1000
+    levels = 2
+    binaries = torch.rand((levels, 32, 32, 32)) > 0.999
+    binaries[:, 8:16, 8:24, 16:] = True
+    base_aabb = torch.tensor([-1.0, -1, -1, 1, 1, 1])
+    aabbs = torch.stack(
+        [_enlarge_aabb(base_aabb, 2**i) for i in range(levels)]
+    )
+    mips = build_occupancy_mips(binaries)
+    assert len(mips) == binaries.numel() * 73 // 512
+    assert (
+        mips[-levels * 64 :].sum()
+        == (
+            binaries.view(levels, 4, 8, 4, 8, 4, 8).sum(dim=(2, 4, 6)) > 0
+        ).sum()
+    )
+
+    rays_o = torch.randn((n_rays, 3))
+    rays_d = torch.randn((n_rays, 3))
+    rays_d = rays_d / rays_d.norm(dim=-1, keepdim=True)
+    for options in [
+        dict(step_size=1e-2),
+        dict(step_size=0.0),
+        dict(step_size=1e-2, cone_angle=1e-2),
+        dict(step_size=1e-2, traverse_steps_limit=8, over_allocate=True),
+    ]:
+        intervals, samples, _ = traverse_grids(
+            rays_o, rays_d, binaries, aabbs, **options
+        )
+        _intervals, _samples, _ = traverse_grids(
+            rays_o, rays_d, binaries, aabbs, mips=mips, **options
+        )
+        # jumping over empty blocks multiplies the step size instead of
+        # accumulating it, which only differs by rounding.
+        assert torch.allclose(intervals.vals, _intervals.vals, atol=1e-5)
+        assert torch.equal(intervals.is_left, _intervals.is_left)
+        assert torch.equal(intervals.is_right, _intervals.is_right)
+        assert torch.allclose(samples.vals, _samples.vals, atol=1e-5)
+        assert torch.equal(samples.packed_info, _samples.packed_info)
+
+    # the pyramid of the estimator follows its binaries.
+    grid_estimator = OccGridEstimator(
+        roi_aabb=base_aabb, resolution=32, levels=levels
+    )
+    assert not grid_estimator.mips.any()
+    grid_estimator.binaries = binaries.clone()
+    assert torch.equal(grid_estimator.mips, mips)
+    grid_estimator.binaries.fill_(False)
+    assert not grid_estimator.mips.any()
+    # fresh binaries tensors may reuse the address of the previous ones.
+    for i in range(20):
+        for _ in range(i % 3 + 1):
+            grid_estimator._update(
+                i,
+                lambda x: torch.full_like(x[:, :1], float(i % 2)),
+                ema_decay=0.0,
+            )
+        assert torch.equal(
+            grid_estimator.mips, build_occupancy_mips(grid_estimator.binaries)
+        )
+
+
+def test_unravel_index():
+    from nerfacc.estimators.occ_grid import _unravel_index
+
+    res = torch.tensor([3, 5, 7], dtype=torch.int32)
+    grid_coords = torch.stack(
+        torch.meshgrid([torch.arange(r) for r in res.tolist()], indexing="ij"),
+        dim=-1,
+    ).reshape(-1, 3)
+    indices = torch.arange(len(grid_coords))
+    assert torch.equal(_unravel_index(indices, res), grid_coords)
+
+
+def test_brick_grid():
+    from nerfacc.grid import BrickGrid, traverse_grids
+
+    torch.manual_seed(42)
+    n_rays = 1000
+    binaries = torch.rand((2, 16, 24, 32)) > 0.7
+    binaries[:, :8] = False  # empty blocks
+    aabbs = torch.tensor([[-1.0, -1, -1, 1, 1, 1], [-2.0, -2, -2, 2, 2, 2]])
+
+    bricks = BrickGrid.from_dense(binaries)
+    assert bricks.shape == binaries.shape
+    assert len(bricks.bricks) < bricks.brick_table.numel()
+    assert torch.equal(bricks.to_dense(), binaries)
+
+    rays_o = torch.randn((n_rays, 3))
+    rays_d = torch.randn((n_rays, 3))
+    rays_d = rays_d / rays_d.norm(dim=-1, keepdim=True)
+    intervals, samples, _ = traverse_grids(
+        rays_o, rays_d, binaries, aabbs, step_size=1e-2
+    )
+    _intervals, _samples, _ = traverse_grids(
+        rays_o, rays_d, bricks, aabbs, step_size=1e-2
+    )
+    assert torch.equal(intervals.vals, _intervals.vals)
+    assert torch.equal(intervals.packed_info, _intervals.packed_info)
+    assert torch.equal(samples.vals, _samples.vals)
+    assert torch.equal(samples.packed_info, _samples.packed_info)
+
+
+def test_morton_grid():
+    from nerfacc.grid import MortonGrid, _enlarge_aabb, _query, traverse_grids
+
+    torch.manual_seed(42)
+    n_rays = 1000
+    binaries = torch.rand((2, 32, 32, 32)) > 0.7
+    base_aabb = torch.tensor([-1.0, -1, -1, 1, 1, 1])
+    aabbs = torch.stack([_enlarge_aabb(base_aabb, 2**i) for i in range(2)])
+
+    grid = MortonGrid.from_dense(binaries)
+    assert grid.shape == binaries.shape
+    assert grid.bits.numel() * 8 == binaries.numel()
+    assert torch.equal(grid.to_dense(), binaries)
+
+    x = torch.rand((n_rays, 3)) * 6 - 3
+    occs, selector = _query(x, binaries, base_aabb)
+    _occs, _selector = _query(x, grid, base_aabb)
+    assert torch.equal(occs, _occs)
+    assert torch.equal(selector, _selector)
+
+    rays_o = torch.randn((n_rays, 3))
+    rays_d = torch.randn((n_rays, 3))
+    rays_d = rays_d / rays_d.norm(dim=-1, keepdim=True)
+    intervals, samples, _ = traverse_grids(
+        rays_o, rays_d, binaries, aabbs, step_size=1e-2
+    )
+    _intervals, _samples, _ = traverse_grids(
+        rays_o, rays_d, grid, aabbs, step_size=1e-2
+    )
+    assert torch.equal(intervals.vals, _intervals.vals)
+    assert torch.equal(intervals.packed_info, _intervals.packed_info)
+    assert torch.equal(samples.vals, _samples.vals)
+    assert torch.equal(samples.packed_info, _samples.packed_info)
+
+
+def test_sparse_occ_grid():
+    from nerfacc.estimators.occ_grid import OccGridEstimator
+    from nerfacc.estimators.sparse_occ_grid import SparseOccGridEstimator
+
+    torch.manual_seed(42)
+    n_rays = 1000
+
+    def occ_eval_fn(x):
+        # constant within the cells of both levels, whatever the jittering.
+        c = torch.floor(x * 2).long()
+        occupied = (c[:, 0] * 7 + c[:, 1] * 13 + c[:, 2] * 3) % 11 == 0
+        return occupied.float()[:, None]
+
+    K = torch.tensor([[[50.0, 0, 32], [0, 50, 32], [0, 0, 1]]])
+    c2w = torch.diag(torch.tensor([1.0, -1, -1, 1]))[None]
+    c2w[0, 2, 3] = 3.0
+    estimators = [
+        cls(roi_aabb=[-1.0, -1, -1, 1, 1, 1], resolution=[16, 32, 8], levels=2)
+        for cls in [OccGridEstimator, SparseOccGridEstimator]
+    ]
+    for estimator in estimators:
+        estimator.mark_invisible_cells(K, c2w, 64, 64, near_plane=0.5)
+        for step in range(4):
+            estimator._update(step, occ_eval_fn, occ_thre=0.5, warmup_steps=2)
+    grid_estimator, sparse_estimator = estimators
+    assert torch.equal(
+        sparse_estimator.binaries.to_dense(), grid_estimator.binaries
+    )
+    assert len(sparse_estimator.brick_occs) < (
+        sparse_estimator.brick_table.numel()
+    )
+    assert math.isclose(
+        sparse_estimator._mean_occupancy(),
+        grid_estimator._mean_occupancy(),
+        rel_tol=1e-5,
+    )
+
+    rays_o = torch.randn((n_rays, 3)) * 0.1 + torch.tensor([0.0, 0, 3])
+    rays_d = torch.randn((n_rays, 3)) * 0.3 + torch.tensor([0.0, 0, -1])
+    rays_d = rays_d / rays_d.norm(dim=-1, keepdim=True)
+    samples = grid_estimator.sampling(rays_o, rays_d, render_step_size=1e-2)
+    _samples = sparse_estimator.sampling(rays_o, rays_d, render_step_size=1e-2)
+    # the dense grid jumps over its empty blocks, which only rounds differently.
+    assert torch.equal(samples[0], _samples[0])
+    for x, _x in zip(samples[1:], _samples[1:]):
+        assert torch.allclose(x, _x, atol=1e-5)
+
+    # the bricks of the cells that are not occupied anymore are freed.
+    loaded = SparseOccGridEstimator(
+        roi_aabb=[-1.0, -1, -1, 1, 1, 1], resolution=[16, 32, 8], levels=2
+    )
+    loaded.load_state_dict(sparse_estimator.state_dict())
+    assert torch.equal(loaded.brick_occs, sparse_estimator.brick_occs)
+    for step in range(4, 8):
+        loaded._update(
+            step,
+            lambda x: torch.zeros_like(x[:, :1]),
+            occ_thre=0.5,
+            ema_decay=0.5,
+        )
+    assert not loaded.binaries.to_dense().any()
+    assert (loaded.brick_occs < 0).any(dim=-1).all()
+
+    # the shared API refuses what the bricks cannot do.
+    with pytest.raises(ValueError):
+        loaded.update_every_n_steps(8, occ_eval_fn, warmup_steps=0, budget=64)
+    with pytest.raises(NotImplementedError):
+        loaded.save_snapshot("unused.nacc")
+
+
+def test_budgeted_update():
+    from nerfacc.estimators.occ_grid import OccGridEstimator
+    from nerfacc.grid import build_occupancy_mips
+
+    torch.manual_seed(42)
+    budget = 512
+
+    def occ_eval_fn(x):
+        return (x.norm(dim=-1, keepdim=True) < 0.5).float()
+
+    grid_estimator = OccGridEstimator(
+        roi_aabb=[-1.0, -1, -1, 1, 1, 1], resolution=16, levels=2
+    )
+    n_cells = grid_estimator.occs.numel()
+    # the warmup still updates all the cells at once.
+    grid_estimator.update_every_n_steps(
+        0, occ_eval_fn, occ_thre=0.5, warmup_steps=1, budget=budget
+    )
+    assert grid_estimator.visits is None
+    assert grid_estimator.mips is not None
+
+    rays_o = torch.randn((100, 3)) * 0.1 + torch.tensor([0.0, 0, 3])
+    rays_d = torch.randn((100, 3)) * 0.3 + torch.tensor([0.0, 0, -1])
+    rays_d = rays_d / rays_d.norm(dim=-1, keepdim=True)
+    # the sweep gets at least half of the budget.
+    n_steps = 2 * n_cells // budget
+    for step in range(1, n_steps + 1):
+        occs = grid_estimator.occs.clone()
+        binaries = grid_estimator.binaries.clone()
+        visits = (
+            grid_estimator.visits.clone()
+            if grid_estimator.visits is not None
+            else torch.zeros_like(occs)
+        )
+        grid_estimator.update_every_n_steps(
+            step, occ_eval_fn, occ_thre=0.5, warmup_steps=1, budget=budget
+        )
+        refreshed = grid_estimator.last_refresh == step
+        assert 0 < refreshed.sum() <= budget
+        # the most visited cells are refreshed first.
+        most_visited = visits.topk(10)
+        assert refreshed[most_visited.indices[most_visited.values > 0]].all()
+        assert (grid_estimator.occs[~refreshed] == occs[~refreshed]).all()
+        changed = grid_estimator.binaries.view(-1) != binaries.view(-1)
+        assert not changed[~refreshed].any()
+        assert torch.equal(
+            grid_estimator.mips, build_occupancy_mips(grid_estimator.binaries)
+        )
+        if grid_estimator._visible_occ_sum is not None:
+            assert torch.isclose(
+                grid_estimator._visible_occ_sum.float(),
+                grid_estimator.occs.sum(),
+            )
+
+        # the samples are counted in the cells they fall in.
+        ray_indices, t_starts, t_ends = grid_estimator.sampling(
+            rays_o, rays_d, render_step_size=1e-2
+        )
+        assert grid_estimator.visits.sum() > 0
+    # every cell is refreshed within a bounded number of steps.
+    assert (grid_estimator.last_refresh >= 1).all()
+
+
 if __name__ == "__main__":
     test_ray_aabb_intersect()
     test_traverse_grids()
     test_traverse_grids_with_near_far_planes()
     test_sampling_with_min_max_distances()
+    test_render_streaming_cpu()
+    test_traverse_grids_with_mips()
+    test_unravel_index()
+    test_brick_grid()
+    test_morton_grid()
+    test_sparse_occ_grid()
+    test_budgeted_update()
     test_mark_invisible_cells()
     test_traverse_grids_test_mode()
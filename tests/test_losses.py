@@ -0,0 +1,54 @@
+import torch
+
+
+def test_distortion_cpu():
+    from nerfacc.data_specs import PackedRays
+    from nerfacc.losses import distortion
+    from nerfacc.pack import pack_info
+
+    torch.manual_seed(42)
+    n_rays, n_samples = 10, 8
+    t_starts = torch.rand((n_rays, n_samples)).sort(dim=-1).values
+    t_ends = t_starts + 0.01
+    weights = torch.rand((n_rays, n_samples))
+
+    # Brute force: sum_{i,j} w_i w_j |t_i - t_j| + 1/3 sum_i w_i^2 delta_i
+    t_mids = 0.5 * (t_starts + t_ends)
+    loss_bi = (
+        weights[:, :, None]
+        * weights[:, None, :]
+        * (t_mids[:, :, None] - t_mids[:, None, :]).abs()
+    ).sum(dim=(-1, -2))
+    loss_uni = (weights.pow(2) * (t_ends - t_starts)).sum(dim=-1) / 3
+    loss_ref = (loss_bi + loss_uni)[:, None]
+
+    loss = distortion(weights, t_starts, t_ends)
+    assert torch.allclose(loss, loss_ref)
+
+    ray_indices = torch.arange(n_rays).repeat_interleave(n_samples)
+    loss = distortion(
+        weights.flatten(),
+        t_starts.flatten(),
+        t_ends.flatten(),
+        ray_indices=ray_indices,
+        n_rays=n_rays,
+    )
+    assert torch.allclose(loss, loss_ref)
+    loss = distortion(
+        weights.flatten(),
+        t_starts.flatten(),
+        t_ends.flatten(),
+        pack_info(ray_indices, n_rays),
+    )
+    assert torch.allclose(loss, loss_ref)
+    loss = distortion(
+        weights.flatten(),
+        t_starts.flatten(),
+        t_ends.flatten(),
+        ray_indices=PackedRays(ray_indices=ray_indices, n_rays=n_rays),
+    )
+    assert torch.allclose(loss, loss_ref)
+
+
+if __name__ == "__main__":
+    test_distortion_cpu()
@@ -18,5 +18,76 @@ def test_pack_info():
     assert (packed_info == _packed_info).all()
 
 
+def test_pack_info_cpu():
+    from nerfacc.pack import pack_info
+
+    ray_indices = torch.tensor([0, 2, 2, 2, 2, 4])
+    packed_info = pack_info(ray_indices, n_rays=6)
+    assert packed_info.dtype == torch.long
+    assert packed_info[:, 0].tolist() == [0, 1, 1, 5, 5, 6]
+    assert packed_info[:, 1].tolist() == [1, 0, 4, 0, 1, 0]
+    # n_rays inferred from the data.
+    assert pack_info(ray_indices.int()).tolist() == packed_info[:5].tolist()
+
+
+def test_packed_rays_cpu():
+    import nerfacc
+    from nerfacc.data_specs import PackedRays
+    from nerfacc.pack import pack_info
+
+    torch.manual_seed(42)
+    n_rays = 10
+    ray_indices = torch.randint(0, n_rays, (100,)).sort().values
+    packed_info = pack_info(ray_indices, n_rays)
+
+    rays = PackedRays(ray_indices=ray_indices, n_rays=n_rays)
+    assert rays.n_rays == n_rays
+    assert torch.equal(rays.packed_info, packed_info)
+    # computed once and cached.
+    assert rays.packed_info is rays.packed_info
+    # the sums need not skip any gaps.
+    assert rays.is_contiguous
+    rays = PackedRays(packed_info=packed_info)
+    assert not rays.is_contiguous
+    assert rays.n_rays == n_rays
+    assert torch.equal(rays.ray_indices, ray_indices)
+    assert rays.ray_indices is rays.ray_indices
+
+    t_starts = torch.rand_like(ray_indices, dtype=torch.float32)
+    t_ends = t_starts + 0.1
+    sigmas = torch.rand_like(t_starts)
+    rgbs = torch.rand((len(t_starts), 3))
+    assert torch.equal(
+        nerfacc.inclusive_sum(sigmas, rays),
+        nerfacc.inclusive_sum(sigmas, packed_info),
+    )
+    weights, _, _ = nerfacc.render_weight_from_density(
+        t_starts, t_ends, sigmas, packed_info=rays
+    )
+    weights_ref, _, _ = nerfacc.render_weight_from_density(
+        t_starts, t_ends, sigmas, ray_indices=ray_indices, n_rays=n_rays
+    )
+    assert torch.equal(weights, weights_ref)
+    assert torch.allclose(
+        nerfacc.accumulate_along_rays(weights, rgbs, rays),
+        nerfacc.accumulate_along_rays(weights, rgbs, ray_indices, n_rays),
+    )
+    colors, opacities, depths, _ = nerfacc.rendering(
+        t_starts, t_ends, rays, rgb_sigma_fn=lambda *_: (rgbs, sigmas)
+    )
+    colors_ref, opacities_ref, depths_ref, _ = nerfacc.rendering(
+        t_starts,
+        t_ends,
+        ray_indices,
+        n_rays,
+        rgb_sigma_fn=lambda *_: (rgbs, sigmas),
+    )
+    assert torch.allclose(colors, colors_ref)
+    assert torch.allclose(opacities, opacities_ref)
+    assert torch.allclose(depths, depths_ref)
+
+
 if __name__ == "__main__":
     test_pack_info()
+    test_pack_info_cpu()
+    test_packed_rays_cpu()
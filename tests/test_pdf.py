@@ -127,7 +127,116 @@ def test_pdf_loss():
     assert torch.allclose(loss, loss2, atol=1e-4)
 
 
+def test_pdf_cpu():
+    from nerfacc.data_specs import RayIntervals
+    from nerfacc.pdf import (
+        _sample_from_weighted,
+        importance_sampling,
+        searchsorted,
+    )
+
+    torch.manual_seed(42)
+    n_rays, n_edges, n_intervals = 5, 101, 10
+    vals = torch.sort(torch.rand((n_rays, n_edges)), -1)[0]
+    cdfs = torch.sort(torch.rand((n_rays, n_edges)), -1)[0]
+    chunk_cnts = torch.full((n_rays,), n_edges, dtype=torch.long)
+    chunk_starts = torch.cumsum(chunk_cnts, 0) - chunk_cnts
+    packed_info = torch.stack([chunk_starts, chunk_cnts], -1)
+    intervals = RayIntervals(vals=vals)
+    flat_intervals = RayIntervals(vals=vals.flatten(), packed_info=packed_info)
+
+    # searchsorted: batched and flattened.
+    query = RayIntervals(vals=torch.rand((n_rays, 30)))
+    ids_left, ids_right = searchsorted(intervals, query)
+    _ids_right = torch.searchsorted(vals, query.vals, right=True)
+    _ids_right = torch.clamp(_ids_right, 0, n_edges - 1)
+    assert (ids_right == _ids_right).all()
+    assert (ids_left == torch.clamp(_ids_right - 1, 0, n_edges - 1)).all()
+    query_cnts = torch.full((n_rays,), 30, dtype=torch.long)
+    flat_query = RayIntervals(
+        vals=query.vals.flatten(),
+        packed_info=torch.stack(
+            [torch.cumsum(query_cnts, 0) - query_cnts, query_cnts], -1
+        ),
+    )
+    flat_ids_left, flat_ids_right = searchsorted(flat_intervals, flat_query)
+    offsets = chunk_starts[:, None]
+    assert (flat_ids_left == (ids_left + offsets).flatten()).all()
+    assert (flat_ids_right == (ids_right + offsets).flatten()).all()
+
+    # importance sampling with int n_intervals_per_ray.
+    _intervals, _samples = importance_sampling(intervals, cdfs, n_intervals)
+    for i in range(n_rays):
+        _vals, _mids = _sample_from_weighted(
+            vals[i : i + 1],
+            cdfs[i : i + 1, 1:] - cdfs[i : i + 1, :-1],
+            n_intervals,
+            False,
+            vals[i].min(),
+            vals[i].max(),
+        )
+        assert torch.allclose(_intervals.vals[i : i + 1], _vals, atol=1e-4)
+        assert torch.allclose(_samples.vals[i : i + 1], _mids, atol=1e-4)
+    intervals2, samples2 = importance_sampling(
+        flat_intervals, cdfs.flatten(), n_intervals
+    )
+    assert torch.allclose(intervals2.vals, _intervals.vals)
+    assert torch.allclose(samples2.vals, _samples.vals)
+
+    # importance sampling with per-ray n_intervals_per_ray.
+    n_per_ray = torch.tensor([n_intervals, 0, n_intervals, 1, n_intervals])
+    intervals3, samples3 = importance_sampling(
+        flat_intervals, cdfs.flatten(), n_per_ray
+    )
+    assert (samples3.packed_info[:, 1] == n_per_ray).all()
+    assert (
+        intervals3.packed_info[:, 1] == (n_per_ray + 1) * (n_per_ray > 0)
+    ).all()
+    for i in [0, 2, 4]:
+        start, cnt = samples3.packed_info[i].tolist()
+        assert torch.allclose(
+            samples3.vals[start : start + cnt], _samples.vals[i]
+        )
+        assert (samples3.ray_indices[start : start + cnt] == i).all()
+        start, cnt = intervals3.packed_info[i].tolist()
+        assert torch.allclose(
+            intervals3.vals[start : start + cnt], _intervals.vals[i]
+        )
+    t_starts = intervals3.vals[intervals3.is_left]
+    t_ends = intervals3.vals[intervals3.is_right]
+    assert len(t_starts) == len(t_ends) == n_per_ray.sum()
+    assert (t_starts <= t_ends).all()
+
+    # stratified samples stay sorted and within the intervals.
+    _, samples4 = importance_sampling(intervals, cdfs, n_intervals, True)
+    assert (samples4.vals[:, 1:] >= samples4.vals[:, :-1]).all()
+    assert (samples4.vals >= vals[:, :1]).all()
+    assert (samples4.vals <= vals[:, -1:]).all()
+
+
+def test_ray_segments_zero_copy():
+    from nerfacc.data_specs import RayIntervals, RaySamples
+
+    packed_info = torch.tensor([[0, 2], [2, 0], [2, 4]])
+    intervals = RayIntervals(torch.rand(6), packed_info=packed_info)
+    assert torch.equal(intervals.chunk_starts, packed_info[:, 0])
+    assert torch.equal(intervals.chunk_cnts, packed_info[:, 1])
+    assert intervals.packed_info is packed_info
+
+    spec = intervals._to_cpp()
+    assert spec.chunk_starts.data_ptr() == intervals.chunk_starts.data_ptr()
+    assert spec.chunk_cnts.data_ptr() == intervals.chunk_cnts.data_ptr()
+    for cls in [RayIntervals, RaySamples]:
+        segments = cls._from_cpp(spec)
+        assert segments.chunk_starts.data_ptr() == spec.chunk_starts.data_ptr()
+        assert segments.chunk_cnts.data_ptr() == spec.chunk_cnts.data_ptr()
+        # packed_info is stacked on demand.
+        assert torch.equal(segments.packed_info, packed_info)
+
+
 if __name__ == "__main__":
     test_importance_sampling()
     test_searchsorted()
     test_pdf_loss()
+    test_pdf_cpu()
+    test_ray_segments_zero_copy()
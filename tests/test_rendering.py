@@ -218,6 +218,275 @@ def test_rendering():
     )
 
 
+def test_accumulate_along_rays_packed():
+    from nerfacc.volrend import accumulate_along_rays, accumulate_along_rays_
+
+    torch.manual_seed(42)
+    n_rays = 50
+    chunk_cnts = torch.randint(0, 10, (n_rays,))
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    packed_info = torch.stack([chunk_starts, chunk_cnts], dim=-1)
+    ray_indices = torch.repeat_interleave(torch.arange(n_rays), chunk_cnts)
+    n_samples = ray_indices.shape[0]
+
+    for values in [None, torch.rand((n_samples, 3))]:
+        weights = torch.rand((n_samples,), requires_grad=True)
+        outputs = accumulate_along_rays(
+            weights, values, packed_info=packed_info
+        )
+        outputs_ref = accumulate_along_rays(
+            weights, values, ray_indices=ray_indices, n_rays=n_rays
+        )
+        assert outputs.shape == outputs_ref.shape
+        assert torch.allclose(outputs, outputs_ref)
+
+        grad_outputs = torch.rand_like(outputs)
+        (grad,) = torch.autograd.grad(outputs, weights, grad_outputs)
+        (grad_ref,) = torch.autograd.grad(outputs_ref, weights, grad_outputs)
+        assert torch.allclose(grad, grad_ref)
+
+        inplace = torch.ones_like(outputs)
+        with torch.no_grad():
+            accumulate_along_rays_(
+                weights, values, outputs=inplace, packed_info=packed_info
+            )
+        assert torch.allclose(inplace, outputs_ref + 1)
+
+    # gapped chunks, e.g. from `traverse_grids(over_allocate=True)`.
+    gapped_starts = chunk_starts + torch.arange(n_rays) * 2
+    gapped_info = torch.stack([gapped_starts, chunk_cnts], dim=-1)
+    sample_ids = torch.repeat_interleave(
+        gapped_starts - chunk_starts, chunk_cnts
+    ) + torch.arange(n_samples)
+    weights = torch.rand((n_samples,))
+    gapped_weights = torch.full((n_samples + 2 * n_rays,), float("nan"))
+    gapped_weights[sample_ids] = weights
+    outputs = accumulate_along_rays(gapped_weights, packed_info=gapped_info)
+    outputs_ref = accumulate_along_rays(
+        weights, ray_indices=ray_indices, n_rays=n_rays
+    )
+    assert torch.allclose(outputs, outputs_ref)
+
+
+def test_render_weight_from_density_cpu():
+    from nerfacc import cuda as _C
+    from nerfacc.volrend import (
+        render_transmittance_from_density,
+        render_weight_from_density,
+    )
+
+    if not _C.is_available("cpu"):
+        pytest.skip("No CPU extension")
+
+    torch.manual_seed(42)
+    chunk_cnts = torch.randint(0, 10, (20,))
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    packed_info = torch.stack([chunk_starts, chunk_cnts], dim=-1)
+    n_samples = int(chunk_cnts.sum())
+
+    def make_inputs(shape):
+        t_starts = torch.rand(shape, dtype=torch.float64)
+        t_ends = t_starts + torch.rand(shape, dtype=torch.float64)
+        sigmas = torch.rand(shape, dtype=torch.float64) * 2
+        prefix_trans = torch.rand(shape, dtype=torch.float64)
+        return [
+            x.requires_grad_(True)
+            for x in [t_starts, t_ends, sigmas, prefix_trans]
+        ]
+
+    for shape, info in [((n_samples,), packed_info), ((8, 16), None)]:
+        inputs = make_inputs(shape)
+
+        def fn(t_starts, t_ends, sigmas, prefix_trans):
+            return render_weight_from_density(
+                t_starts, t_ends, sigmas, info, prefix_trans=prefix_trans
+            )
+
+        def fn_ref(t_starts, t_ends, sigmas, prefix_trans):
+            trans, alphas = render_transmittance_from_density(
+                t_starts, t_ends, sigmas, info, prefix_trans=prefix_trans
+            )
+            return trans * alphas, trans, alphas
+
+        for out, out_ref in zip(fn(*inputs), fn_ref(*inputs)):
+            assert torch.allclose(out, out_ref)
+        assert torch.autograd.gradcheck(fn, inputs)
+
+        # gradients w.r.t. only a subset of the outputs
+        weights, _, _ = fn(*inputs)
+        grads = torch.autograd.grad(weights.sum(), inputs)
+        weights_ref, _, _ = fn_ref(*inputs)
+        grads_ref = torch.autograd.grad(weights_ref.sum(), inputs)
+        for grad, grad_ref in zip(grads, grads_ref):
+            assert torch.allclose(grad, grad_ref)
+
+
+def test_rendering_fused_cpu():
+    from nerfacc import cuda as _C
+    from nerfacc.volrend import (
+        accumulate_along_rays,
+        render_weight_from_alpha,
+        render_weight_from_density,
+        rendering,
+    )
+
+    if not _C.is_supported("rendering_forward", "cpu"):
+        pytest.skip("No CPU extension")
+
+    torch.manual_seed(42)
+    n_rays = 100
+    chunk_cnts = torch.randint(0, 20, (n_rays,))
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    packed_info = torch.stack([chunk_starts, chunk_cnts], dim=-1)
+    ray_indices = torch.repeat_interleave(torch.arange(n_rays), chunk_cnts)
+    n_samples = ray_indices.shape[0]
+    t_starts = torch.rand((n_samples,), dtype=torch.float64)
+    t_ends = t_starts + torch.rand((n_samples,), dtype=torch.float64)
+    rgbs = torch.rand((n_samples, 3), dtype=torch.float64)
+    densities = torch.rand((n_samples,), dtype=torch.float64) * 2
+    densities[::5] = 0.0
+    grad_colors = torch.rand((n_rays, 3), dtype=torch.float64)
+    grad_weights = torch.rand((n_samples,), dtype=torch.float64)
+    grad_trans = torch.rand((n_samples,), dtype=torch.float64)
+
+    for from_alpha in [False, True]:
+        if from_alpha:
+            densities = densities / 2
+            densities[::7] = 1.0
+
+        # reference: render_weight_* and accumulate_along_rays.
+        rgbs_ref = rgbs.clone().requires_grad_(True)
+        densities_ref = densities.clone().requires_grad_(True)
+        if from_alpha:
+            weights_ref, trans_ref = render_weight_from_alpha(
+                densities_ref, packed_info=packed_info
+            )
+        else:
+            weights_ref, trans_ref, _ = render_weight_from_density(
+                t_starts, t_ends, densities_ref, packed_info=packed_info
+            )
+        colors_ref = accumulate_along_rays(
+            weights_ref, rgbs_ref, ray_indices, n_rays
+        )
+        opacities_ref = accumulate_along_rays(
+            weights_ref, None, ray_indices, n_rays
+        )
+        depths_ref = accumulate_along_rays(
+            weights_ref,
+            (t_starts + t_ends)[:, None] / 2.0,
+            ray_indices,
+            n_rays,
+        ) / opacities_ref.clamp_min(torch.finfo(torch.float64).eps)
+
+        rgbs_fused = rgbs.clone().requires_grad_(True)
+        densities_fused = densities.clone().requires_grad_(True)
+        colors, opacities, depths, extras = rendering(
+            t_starts,
+            t_ends,
+            ray_indices,
+            n_rays,
+            rgb_sigma_fn=None
+            if from_alpha
+            else lambda *_: (rgbs_fused, densities_fused),
+            rgb_alpha_fn=lambda *_: (rgbs_fused, densities_fused)
+            if from_alpha
+            else None,
+        )
+        assert torch.allclose(colors, colors_ref)
+        assert torch.allclose(opacities, opacities_ref)
+        assert torch.allclose(depths, depths_ref)
+        assert torch.allclose(extras["weights"], weights_ref)
+        assert torch.allclose(extras["trans"], trans_ref)
+
+        for loss_fn in [
+            lambda c, o, d, w, t: (c * grad_colors).sum(),
+            lambda c, o, d, w, t: (c * grad_colors).sum()
+            + o.sum()
+            + d.sum()
+            + (w * grad_weights).sum()
+            + (t * grad_trans).sum(),
+        ]:
+            for x in [rgbs_ref, densities_ref, rgbs_fused, densities_fused]:
+                x.grad = None
+            loss_fn(
+                colors_ref, opacities_ref, depths_ref, weights_ref, trans_ref
+            ).backward(retain_graph=True)
+            loss_fn(
+                colors, opacities, depths, extras["weights"], extras["trans"]
+            ).backward(retain_graph=True)
+            assert torch.allclose(rgbs_fused.grad, rgbs_ref.grad)
+            assert torch.allclose(densities_fused.grad, densities_ref.grad)
+
+    # batched inputs
+    t_starts = torch.rand((10, 8))
+    t_ends = t_starts + torch.rand((10, 8))
+    rgbs = torch.rand((10, 8, 3))
+    sigmas = torch.rand((10, 8))
+    colors, opacities, depths, extras = rendering(
+        t_starts, t_ends, rgb_sigma_fn=lambda *_: (rgbs, sigmas)
+    )
+    weights_ref, _, _ = render_weight_from_density(t_starts, t_ends, sigmas)
+    assert colors.shape == (10, 3) and opacities.shape == (10, 1)
+    assert extras["weights"].shape == (10, 8)
+    assert torch.allclose(extras["weights"], weights_ref, atol=1e-6)
+    assert torch.allclose(
+        colors, accumulate_along_rays(weights_ref, rgbs), atol=1e-6
+    )
+
+
+def test_rendering_fused_vs_unfused_cpu():
+    from nerfacc import cuda as _C
+    from nerfacc.volrend import rendering
+
+    if not _C.is_supported("rendering_forward", "cpu"):
+        pytest.skip("No CPU extension")
+
+    torch.manual_seed(42)
+    n_rays = 100
+    ray_indices = torch.randint(0, n_rays, (1000,)).sort().values
+    n_samples = ray_indices.shape[0]
+    t_starts = torch.rand((n_samples,), dtype=torch.float64)
+    t_ends = t_starts + torch.rand((n_samples,), dtype=torch.float64)
+    rgbs = torch.rand((n_samples, 3), dtype=torch.float64)
+    densities = torch.rand((n_samples,), dtype=torch.float64)
+    render_bkgd = torch.rand((3,), dtype=torch.float64)
+
+    for from_alpha in [False, True]:
+        outputs, grads = [], []
+        # the fused op is skipped when the intervals require grad.
+        for requires_grad in [False, True]:
+            _rgbs = rgbs.clone().requires_grad_(True)
+            _densities = densities.clone().requires_grad_(True)
+            fn = lambda *_: (_rgbs, _densities)
+            colors, opacities, depths, extras = rendering(
+                t_starts.clone().requires_grad_(requires_grad),
+                t_ends,
+                ray_indices,
+                n_rays,
+                rgb_sigma_fn=None if from_alpha else fn,
+                rgb_alpha_fn=fn if from_alpha else None,
+                render_bkgd=render_bkgd,
+            )
+            loss = (
+                colors.sum()
+                + opacities.sum()
+                + depths.sum()
+                + sum((v * v).sum() for v in extras.values())
+            )
+            outputs.append((colors, opacities, depths, extras))
+            grads.append(torch.autograd.grad(loss, [_rgbs, _densities]))
+
+        (colors, opacities, depths, extras), ref = outputs
+        assert torch.allclose(colors, ref[0])
+        assert torch.allclose(opacities, ref[1])
+        assert torch.allclose(depths, ref[2])
+        assert extras.keys() == ref[3].keys()
+        for key in extras:
+            assert torch.allclose(extras[key], ref[3][key]), key
+        for grad, grad_ref in zip(*grads):
+            assert torch.allclose(grad, grad_ref)
+
+
 if __name__ == "__main__":
     test_render_visibility()
     test_render_weight_from_alpha()
@@ -225,3 +494,7 @@ if __name__ == "__main__":
     test_accumulate_along_rays()
     test_grads()
     test_rendering()
+    test_accumulate_along_rays_packed()
+    test_render_weight_from_density_cpu()
+    test_rendering_fused_cpu()
+    test_rendering_fused_vs_unfused_cpu()
@@ -124,8 +124,203 @@ def test_exclusive_prod():
     assert torch.allclose(grad1, grad2)
 
 
+def test_scan_cpu():
+    from nerfacc.scan import (
+        exclusive_prod,
+        exclusive_sum,
+        inclusive_prod,
+        inclusive_sum,
+    )
+
+    torch.manual_seed(42)
+
+    # chunks of different sizes, including empty ones.
+    chunk_cnts = torch.randint(0, 20, (100,), dtype=torch.long)
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    packed_info = torch.stack([chunk_starts, chunk_cnts], dim=-1)
+    n_edges = int(chunk_cnts.sum())
+    ray_indices = torch.repeat_interleave(
+        torch.arange(len(chunk_cnts)), chunk_cnts
+    )
+
+    data = torch.rand((n_edges,), dtype=torch.float64)
+    # zeros are where a division-based product gradient would break.
+    data[::7] = 0.0
+    grad_outputs = torch.rand((n_edges,), dtype=torch.float64)
+
+    for fn in [inclusive_sum, exclusive_sum, inclusive_prod, exclusive_prod]:
+        data1 = data.clone().requires_grad_(True)
+        outputs1 = fn(data1, packed_info=packed_info)
+        outputs1.backward(grad_outputs)
+
+        # reference: scan each chunk independently.
+        data2 = data.clone().requires_grad_(True)
+        outputs2 = torch.cat(
+            [
+                fn(data2[ray_indices == i])
+                for i in range(len(chunk_cnts))
+                if chunk_cnts[i] > 0
+            ]
+        )
+        outputs2.backward(grad_outputs)
+
+        assert torch.allclose(outputs1, outputs2)
+        assert torch.allclose(data1.grad, data2.grad)
+
+
+def test_scan_torch():
+    from nerfacc.scan import (
+        _exclusive_prod_forward_torch,
+        _exclusive_sum_torch,
+        _inclusive_prod_forward_torch,
+        _inclusive_sum_torch,
+    )
+
+    torch.manual_seed(42)
+
+    chunk_cnts = torch.randint(0, 20, (100,), dtype=torch.long)
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    n_edges = int(chunk_cnts.sum())
+    ray_indices = torch.repeat_interleave(
+        torch.arange(len(chunk_cnts)), chunk_cnts
+    )
+    data = torch.rand((n_edges,), dtype=torch.float64) * 2 - 1
+    data[::7] = 0.0
+    grad_outputs = torch.rand((n_edges,), dtype=torch.float64)
+
+    def exclusive_cumsum(x):
+        return torch.cumsum(x, dim=0) - x
+
+    def exclusive_cumprod(x):
+        return torch.cumprod(torch.cat([torch.ones_like(x[:1]), x[:-1]]), 0)
+
+    cases = [
+        (_inclusive_sum_torch, lambda x: torch.cumsum(x, dim=0)),
+        (_exclusive_sum_torch, exclusive_cumsum),
+        (_inclusive_prod_forward_torch, lambda x: torch.cumprod(x, dim=0)),
+        (_exclusive_prod_forward_torch, exclusive_cumprod),
+    ]
+    for fn, ref_fn in cases:
+        for stability in [None, "float64", "kahan"]:
+            data1 = data.clone().requires_grad_(True)
+            outputs1 = fn(chunk_starts, chunk_cnts, data1, stability=stability)
+            data2 = data.clone().requires_grad_(True)
+            outputs2 = torch.cat(
+                [
+                    ref_fn(data2[ray_indices == i])
+                    for i in range(len(chunk_cnts))
+                ]
+            )
+            assert torch.allclose(outputs1, outputs2)
+
+            if "sum" in fn.__name__:
+                outputs1.backward(grad_outputs)
+                outputs2.backward(grad_outputs)
+                assert torch.allclose(data1.grad, data2.grad)
+
+    # normalize
+    outputs = _inclusive_sum_torch(
+        chunk_starts, chunk_cnts, data.abs() + 0.1, normalize=True
+    )
+    last = (chunk_starts + chunk_cnts - 1)[chunk_cnts > 0]
+    assert torch.allclose(outputs[last], torch.ones_like(outputs[last]))
+
+
+def test_scan_torch_stability():
+    from nerfacc.scan import _exclusive_sum_torch
+
+    torch.manual_seed(42)
+
+    # long chunks: the global prefix sum gets much larger than each chunk.
+    chunk_cnts = torch.full((20,), 50000, dtype=torch.long)
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    data = torch.rand((int(chunk_cnts.sum()),))
+    outputs_ref = _exclusive_sum_torch(
+        chunk_starts, chunk_cnts, data.double(), stability=None
+    )
+
+    errors = {}
+    for stability in [None, "float64", "kahan"]:
+        outputs = _exclusive_sum_torch(
+            chunk_starts, chunk_cnts, data, stability=stability
+        )
+        assert outputs.dtype == data.dtype
+        errors[stability] = (outputs.double() - outputs_ref).abs().max()
+    assert errors["float64"] < 1e-2
+    assert errors["kahan"] < 1e-2
+    assert errors["kahan"] < errors[None]
+
+
+def test_scan_backends():
+    from nerfacc import cuda as _C
+    from nerfacc.scan import (
+        _exclusive_prod_backward_torch,
+        _exclusive_sum_torch,
+        _inclusive_prod_backward_torch,
+        _inclusive_sum_torch,
+    )
+
+    backends = _C.available_backends()
+    assert "torch-reference" in backends
+    assert "inclusive_sum" in backends["torch-reference"]
+    if not _C.is_available("cpu"):
+        return
+    assert _C.get_backend("inclusive_sum", "cpu") == "cpu-ext"
+    assert _C.get_backend("inclusive_sum", "meta") == "torch-reference"
+    with pytest.raises(RuntimeError):
+        _C.get_backend("traverse_grids", "meta")
+
+    # the torch reference ops match the cpu-ext ops.
+    torch.manual_seed(42)
+    chunk_cnts = torch.randint(0, 20, (100,), dtype=torch.long)
+    chunk_starts = torch.cumsum(chunk_cnts, dim=0) - chunk_cnts
+    n_edges = int(chunk_cnts.sum())
+    data = torch.rand((n_edges,)) + 0.1
+    grad_outputs = torch.rand((n_edges,))
+
+    for fn, ref_fn in [
+        (_C.inclusive_sum, _inclusive_sum_torch),
+        (_C.exclusive_sum, _exclusive_sum_torch),
+    ]:
+        for normalize, backward in [
+            (False, False),
+            (True, False),
+            (False, True),
+        ]:
+            outputs = fn(chunk_starts, chunk_cnts, data, normalize, backward)
+            outputs_ref = ref_fn(
+                chunk_starts, chunk_cnts, data, normalize, backward
+            )
+            assert torch.allclose(outputs, outputs_ref, atol=1e-5)
+
+    for fwd_fn, bwd_fn, ref_fn in [
+        (
+            _C.inclusive_prod_forward,
+            _C.inclusive_prod_backward,
+            _inclusive_prod_backward_torch,
+        ),
+        (
+            _C.exclusive_prod_forward,
+            _C.exclusive_prod_backward,
+            _exclusive_prod_backward_torch,
+        ),
+    ]:
+        outputs = fwd_fn(chunk_starts, chunk_cnts, data)
+        grad_inputs = bwd_fn(
+            chunk_starts, chunk_cnts, data, outputs, grad_outputs
+        )
+        grad_inputs_ref = ref_fn(
+            chunk_starts, chunk_cnts, data, outputs, grad_outputs
+        )
+        assert torch.allclose(grad_inputs, grad_inputs_ref, atol=1e-4)
+
+
 if __name__ == "__main__":
     test_inclusive_sum()
     test_exclusive_sum()
     test_inclusive_prod()
     test_exclusive_prod()
+    test_scan_cpu()
+    test_scan_torch()
+    test_scan_torch_stability()
+    test_scan_backends()